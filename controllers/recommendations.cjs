@@ -8,6 +8,7 @@ var _ = require('lodash');
 var moment = require('moment');
 
 var getRecommendationFor = require('../engine/recommendations/events_manager.cjs').getRecommendationFor;
+var ranking = require('../engine/recommendations/ranking.cjs');
 var airbrake = null;
 if(process.env.AIRBRAKE_PROJECT_ID) {
   airbrake = require('../utils/airbrake.cjs');
@@ -140,68 +141,6 @@ var processRecommendations = function (levelType, req, res, recommendedItemIds,
   }
 };
 
-var processRecommendationsLight = function (groupId, req, res, recommendedItemIds, error, redisCacheKey) {
-  if (error) {
-    log.error("processRecommendationsLight Error", { err: error, userId:  req.user ? req.user.id : -1, errorStatus:  500 });
-    if(airbrake) {
-      airbrake.notify(error).then((airbrakeErr)=> {
-        if (airbrakeErr.error) {
-          log.error("AirBrake Error", { context: 'airbrake', err: airbrakeErr.error, errorStatus: 500 });
-        }
-        res.send({recommendations: [], groupId: groupId });
-      });
-    } else {
-      res.send({recommendations: [], groupId: groupId });
-    }
-  } else if (!recommendedItemIds) {
-    log.error("processRecommendationsLight no recommendedItemIds", { userId:  req.user ? req.user.id : -1, errorStatus:  500 });
-    res.send({recommendations: [], groupId: groupId });
-  } else {
-    log.info("processRecommendationsLight for group status");
-
-    models.Post.findAll({
-      where: {
-        id: {
-          $in: recommendedItemIds
-        }
-      },
-      attributes: ['id','name','description'],
-      include: [
-        {
-          model: models.Group,
-          required: true,
-          attributes: models.Group.defaultAttributesPublic,
-          where: {
-            id: groupId
-          }
-        }
-      ]
-    }).then(function(posts) {
-      posts.sort(function(a, b){
-        return recommendedItemIds.indexOf(a.id) - recommendedItemIds.indexOf(b.id);
-      });
-
-      const recommendationsInfo = {recommendations: posts, groupId: groupId };
-      if (redisCacheKey) {
-        req.redisClient.setEx(redisCacheKey, process.env.RECOMMENDATIONS_CACHE_TTL ? parseInt(process.env.RECOMMENDATIONS_CACHE_TTL) : 5, JSON.stringify(recommendationsInfo));
-      }
-      res.send(recommendationsInfo);
-    }).catch(function(error) {
-      log.error("processRecommendationsLight Error ", { err: error, userId:  req.user ? req.user.id : -1, errorStatus: 500 });
-      if(airbrake) {
-        airbrake.notify(error).then((airbrakeErr)=> {
-          if (airbrakeErr.error) {
-            log.error("AirBrake Error", { context: 'airbrake', err: airbrakeErr.error, errorStatus: 500 });
-          }
-          res.send({recommendations: [], groupId: groupId });
-        });
-      } else {
-        res.send({recommendations: [], groupId: groupId });
-      }
-    });
-  }
-};
-
 router.get('/domains/:id', auth.can('view domain'), function(req, res) {
   var options = setupOptions(req);
 
@@ -241,53 +180,55 @@ router.get('/groups/:id', auth.can('view group'), function(req, res) {
   }, req.user ? req.user.default_locale : null);
 });
 
+// Served from the ranked post lists in Redis, the external recommender only refreshes them in
+// the background so this keeps working when it is slow or down
 router.put('/groups/:id/getPostRecommendations', auth.can('view group'), function(req, res) {
-  const redisCacheKey = "cache:getPostRecommendations:"+req.params.id+":userId:"+(req.user ? req.user.id : "notLoggedIn");
-  req.redisClient.get(redisCacheKey).then(recommendations => {
-    if (recommendations) {
-      res.send(JSON.parse(recommendations));
-    } else {
-      var options = setupOptions(req);
+  var options = setupOptions(req);
+  var groupId = parseInt(req.params.id);
 
-      options = _.merge(options, {
-        group_id: req.params.id,
-        limit: 100
-      });
+  var fetchRecommendations = function (callback) {
+    models.Group.findOne({
+      where: {
+        id: groupId
+      },
+      attributes: [
+        'id', 'configuration'
+      ]
+    }).then(group => {
+      if (group) {
+        var dateOptions = null; //DATE_OPTIONS_YEAR;
+        if (group.configuration && group.configuration.maxDaysBackForRecommendations) {
+          var maxDays = parseInt(group.configuration.maxDaysBackForRecommendations);
+          dateOptions = {name: "date", after: moment().add(-Math.abs(maxDays), 'days').toISOString()};
+        }
+        getRecommendationFor(req, options.user_id, dateOptions, { group_id: groupId, limit: 100 }, callback,
+          req.user ? req.user.default_locale : null);
+      } else {
+        callback("Group not found");
+      }
+    }).catch(error => {
+      callback(error);
+    });
+  };
 
-      models.Group.findOne({
-        where: {
-          id: req.params.id
-        },
-        attributes: [
-          'id', 'configuration'
-        ]
-      }).then(group => {
-        if (group) {
-          var dateOptions = null; //DATE_OPTIONS_YEAR;
-          if (group.configuration && group.configuration.maxDaysBackForRecommendations && group.configuration.maxDaysBackForRecommendations) {
-            var maxDays = parseInt(group.configuration.maxDaysBackForRecommendations);
-            dateOptions = {name: "date", after: moment().add(-Math.abs(maxDays), 'days').toISOString()};
+  ranking.getRankedPostIds(groupId, options.user_id, 100, fetchRecommendations).then(recommendedItemIds => {
+    return ranking.hydratePosts(recommendedItemIds, 'getPostRecommendations:group:' + groupId, {
+      attributes: ['id','name','description'],
+      include: [
+        {
+          model: models.Group,
+          required: true,
+          attributes: models.Group.defaultAttributesPublic,
+          where: {
+            id: groupId
           }
-
-          getRecommendationFor(req, options.user_id, dateOptions, options, function (error, recommendedItemIds) {
-            if (!error) {
-              processRecommendationsLight(req.params.id, req, res, recommendedItemIds, error, redisCacheKey);
-            } else {
-              log.error("Error from getRecommendationFor", {error});
-              res.send({recommendations: [], groupId: req.params.id});
-            }
-          }, req.user ? req.user.default_locale : null);
-        } else {
-          log.error("Group not found");
-          res.send({recommendations: [], groupId: req.params.id});
         }
-      }).catch(error => {
-        log.error(error);
-        res.send({recommendations: [], groupId: req.params.id});
-      });
-    }
+      ]
+    });
+  }).then(posts => {
+    res.send({recommendations: posts, groupId: req.params.id});
   }).catch(error => {
-    log.error(error);
+    log.error("getPostRecommendations Error", { err: error, userId:  req.user ? req.user.id : -1, errorStatus:  500 });
     res.send({recommendations: [], groupId: req.params.id});
   });
 });
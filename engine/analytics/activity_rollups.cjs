@@ -0,0 +1,112 @@
+const models = require("../../../models/index.cjs");
+const log = require('../../utils/logger.cjs');
+const _ = require('lodash');
+
+// Daily activity counts per domain, community and group in ac_activity_daily_counts.
+//
+// New activities are counted as they are created, refreshActivityRollups recounts whole days from
+// ac_activities to fill the table and to pick up activities that were later deleted.
+// Days are UTC calendar days, like the date_trunc buckets in statsCalc.
+
+const SCOPES = [
+  { scopeType: 'domain', column: 'domain_id' },
+  { scopeType: 'community', column: 'community_id' },
+  { scopeType: 'group', column: 'group_id' }
+];
+
+const utcDay = (date) => new Date(date).toISOString().slice(0, 10);
+
+// Called from the AcActivity afterCreate hook
+const recordActivity = (activity) => {
+  if (activity.deleted || activity.status !== 'active') {
+    return;
+  }
+  const day = utcDay(activity.created_at || Date.now());
+  const rows = SCOPES.filter(scope => activity[scope.column]).map(scope => {
+    return [scope.scopeType, activity[scope.column], activity.type, day, 1];
+  });
+  if (rows.length > 0) {
+    models.sequelize.query(`
+      INSERT INTO ac_activity_daily_counts (scope_type, scope_id, type, day, count, created_at, updated_at)
+      SELECT scope_type, scope_id, type, CAST(day AS DATE), count, now(), now()
+      FROM (VALUES :rows) AS new_counts (scope_type, scope_id, type, day, count)
+      ON CONFLICT (scope_type, scope_id, type, day)
+      DO UPDATE SET count = ac_activity_daily_counts.count + EXCLUDED.count, updated_at = now()`,
+      { replacements: { rows } }
+    ).catch(error => {
+      log.error("Could not update activity daily counts", { err: error, activityId: activity.id });
+    });
+  }
+};
+
+/**
+ * Recounts the days from fromDate (all days when not given) from ac_activities
+ */
+const refreshActivityRollups = async (fromDate) => {
+  const fromDay = fromDate ? utcDay(fromDate) : null;
+  const dayWhere = fromDay ? 'AND created_at >= CAST(:fromDay AS DATE)' : '';
+  await models.sequelize.transaction(async (transaction) => {
+    await models.sequelize.query(
+      `DELETE FROM ac_activity_daily_counts ${fromDay ? 'WHERE day >= CAST(:fromDay AS DATE)' : ''}`,
+      { replacements: { fromDay }, transaction });
+    for (const scope of SCOPES) {
+      await models.sequelize.query(`
+        INSERT INTO ac_activity_daily_counts (scope_type, scope_id, type, day, count, created_at, updated_at)
+        SELECT :scopeType, ${scope.column}, type, CAST(date_trunc('day', created_at) AS DATE), count(*), now(), now()
+        FROM ac_activities
+        WHERE ${scope.column} IS NOT NULL AND deleted = false AND status = 'active' ${dayWhere}
+        GROUP BY ${scope.column}, type, CAST(date_trunc('day', created_at) AS DATE)`,
+        { replacements: { scopeType: scope.scopeType, fromDay }, transaction });
+    }
+  });
+};
+
+/**
+ * Returns the rollup scope for activity stats queries it can answer, where options with only a
+ * type filter and one of domain_id, community_id or group_id, and null otherwise
+ */
+const getRollupScope = (model, whereOptions, includeOptions) => {
+  if (model !== models.AcActivity || (includeOptions && includeOptions.length > 0) || !whereOptions) {
+    return null;
+  }
+  const keys = Object.keys(whereOptions);
+  const scopes = SCOPES.filter(scope => _.includes(keys, scope.column));
+  if (scopes.length !== 1 || _.without(keys, scopes[0].column, 'type').length > 0) {
+    return null;
+  }
+  const scopeId = whereOptions[scopes[0].column];
+  const type = whereOptions.type;
+  let types = null;
+  if (typeof type === 'string') {
+    types = [type];
+  } else if (type && Array.isArray(type.$in) && Object.keys(type).length === 1) {
+    types = type.$in;
+  } else if (type !== undefined) {
+    return null;
+  }
+  if (typeof scopeId === 'object' || (types && types.length === 0)) {
+    return null;
+  }
+  return { scopeType: scopes[0].scopeType, scopeId, types };
+};
+
+/**
+ * Returns [{ day: 'YYYY-MM-DD', count }] in day order for a scope from getRollupScope
+ */
+const getDailyCounts = async (rollupScope) => {
+  const [rows] = await models.sequelize.query(`
+    SELECT to_char(day, 'YYYY-MM-DD') AS day, CAST(sum(count) AS INTEGER) AS count
+    FROM ac_activity_daily_counts
+    WHERE scope_type = :scopeType AND scope_id = :scopeId ${rollupScope.types ? 'AND type IN (:types)' : ''}
+    GROUP BY day
+    ORDER BY day ASC`,
+    { replacements: rollupScope });
+  return rows;
+};
+
+module.exports = {
+  recordActivity,
+  refreshActivityRollups,
+  getRollupScope,
+  getDailyCounts
+};
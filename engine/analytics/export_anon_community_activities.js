@@ -1,323 +1,385 @@
 const models = require('../../../models/index.cjs');
 const _ = require('lodash');
-const async = require('async');
-const log = require('../../../utils/logger.cjs');
+const log = require('../../utils/logger.cjs');
 const crypto = require('crypto');
 const fs = require('fs');
+const path = require('path');
+
+// Exports the users, activities, posts and points of a community with encrypted ids to CSV files
+// and uploads them to the analytics service.
+//   node export_anon_community_activities.js <communityId> <accessKey> <outputDir>
+//
+// Rows are read in id ordered pages and streamed to the files. After each page the position and
+// the file sizes are saved to checkpoint.json in outputDir, running the same command again after
+// an interruption continues from there. The checkpoint holds the encryption key so ids stay the
+// same across a resume, it is removed when the export is done.
 
 //const request = require('request');
 
 const request = {
   post: (data, done) => {
-      console.log(JSON.stringify(data, null, 4));
+      console.log(data.url);
       done();
   }
 };
 
-const clean = (text) => {
-  //console.log("Before: "+ text);
-  var newText = text.replace('"',"'").replace('\n','').replace('\r','').replace(/(\r\n|\n|\r)/gm,"").replace(/"/gm,"'").replace(/,/,';').trim();
-  //console.log("After:" + newText);
-  return newText.replace(/´/g,'');
+const PAGE_SIZE = process.env.ANON_EXPORT_PAGE_SIZE ? parseInt(process.env.ANON_EXPORT_PAGE_SIZE) : 1000;
+const UPLOAD_CONCURRENCY = process.env.ANON_EXPORT_UPLOAD_CONCURRENCY ? parseInt(process.env.ANON_EXPORT_UPLOAD_CONCURRENCY) : 10;
+const BATCH_UPLOAD = process.env.ANON_EXPORT_BATCH_UPLOAD === 'true';
+const UPLOAD_BATCH_SIZE = process.env.ANON_EXPORT_UPLOAD_BATCH_SIZE ? parseInt(process.env.ANON_EXPORT_UPLOAD_BATCH_SIZE) : 500;
+const TRANSLATION_CONCURRENCY = 4;
+const MAX_CACHED_IDS = 100000;
+
+const ACTIVITY_TYPES = [
+  "activity.post.new","activity.post.opposition.new","activity.post.endorsement.new",
+  "activity.point.new","activity.point.helpful.new","activity.point.unhelpful.new"
+];
+
+const STAGES = ['users', 'activities', 'posts', 'points', 'done'];
+
+const OUTPUT_FILES = {
+  users: { fileName: 'users.csv', header: "Id\n" },
+  activities: { fileName: 'activities.csv', header: "Id,Date,Type,PointId,PostId,UserId\n" },
+  posts: { fileName: 'posts.csv', header: "Id,Date,Name,NameEn,Description,DescriptionEn,ToxicityScore\n" },
+  points: { fileName: 'points.csv', header: "Id,Date,Content,ContentEn,Value,ToxicityScore\n" },
+  // Ids of the posts and points the activities refer to, exported in the later stages
+  postIds: { fileName: 'post_ids.txt', header: "" },
+  pointIds: { fileName: 'point_ids.txt', header: "" }
 };
 
-const getEncryptedId = (id, key, iv) => {
-  let cipher = crypto.createCipheriv('aes-256-cbc', Buffer.from(key), iv);
-  let encrypted = cipher.update(id.toString());
-  encrypted = Buffer.concat([encrypted, cipher.final()]);
-  return encrypted.toString('hex');
+const clean = (text) => {
+  var newText = (text || '').replace('"',"'").replace('\n','').replace('\r','').replace(/(\r\n|\n|\r)/gm,"").replace(/"/gm,"'").replace(/,/,';').trim();
+  return newText.replace(/´/g,'');
 };
 
-let csvPostsTxt = "Id,Date,Name,NameEn,Description,DescriptionEn,ToxicityScore\n";
-
-const saveAnonymousPost = (post, accessKey, done) => {
-  let expiryDate = new Date();
-  expiryDate.setDate(expiryDate.getDate() + 7);
-
-  const properties = {
-    id: post.id,
-    name: post.name,
-    name_en: post.name_en,
-    date: post.created_at.toISOString(),
-    description: post.description,
-    description_en: post.description_en,
-    toxicity_score: post.toxicity_score,
-    access_key: accessKey,
-    access_expires_at: expiryDate.toISOString()
-  };
-
-  csvPostsTxt += post.id+','+properties.date+',"'+clean(post.name)+'","'+clean(post.name_en)+'",'+'"'+clean(post.description)+'",'+'"'+clean(post.description_en)+'",'+post.toxicity_score+'\n'
-
-  const options = {
-    url: process.env["AC_ANALYTICS_BASE_URL"]+"anonPosts/"+process.env.AC_ANALYTICS_CLUSTER_ID+"/"+`${accessKey}${post.id}`,
-    headers: {
-      'X-API-KEY': process.env["AC_ANALYTICS_KEY"]
-    },
-    json: properties
+// Ids repeat across activities, each one is only encrypted once
+const createIdEncrypter = (key, iv) => {
+  const encryptedIds = new Map();
+  return (id) => {
+    let encrypted = encryptedIds.get(id);
+    if (!encrypted) {
+      const cipher = crypto.createCipheriv('aes-256-cbc', key, iv);
+      encrypted = Buffer.concat([cipher.update(id.toString()), cipher.final()]).toString('hex');
+      if (encryptedIds.size >= MAX_CACHED_IDS) {
+        encryptedIds.clear();
+      }
+      encryptedIds.set(id, encrypted);
+    }
+    return encrypted;
   };
-
-  request.post(options, (error) => {
-    done(error);
-  });
 };
 
-let csvPointsTxt = "Id,Date,Content,ContentEn,Value,ToxicityScore\n";
-
-const saveAnonymousPoint = (point, accessKey, done) => {
+const loadCheckpoint = async (outputDir, communityId, accessKey) => {
+  const checkpointPath = path.join(outputDir, 'checkpoint.json');
+  try {
+    const checkpoint = JSON.parse(await fs.promises.readFile(checkpointPath, 'utf8'));
+    if (checkpoint.communityId == communityId) {
+      log.info("Resuming anonymous export", { communityId, stage: checkpoint.stage, lastId: checkpoint.lastId });
+      return checkpoint;
+    }
+  } catch (error) {
+    if (error.code !== 'ENOENT') {
+      throw error;
+    }
+  }
   let expiryDate = new Date();
   expiryDate.setDate(expiryDate.getDate() + 7);
-
-  const properties = {
-    id: point.id,
-    date: point.created_at.toISOString(),
-    content: point.content,
-    content_en: point.content_en,
-    value: point.value,
-    access_key: accessKey,
-    toxicity_score: point.toxicity_score,
-    access_expires_at: expiryDate.toISOString()
-  };
-
-  csvPointsTxt += point.id+','+properties.date+',"'+clean(point.content)+'",'+'"'+clean(point.content_en)+'",'+point.value+','+point.toxicity_score+'\n';
-
-  const options = {
-    url: process.env["AC_ANALYTICS_BASE_URL"]+"anonPoints/"+process.env.AC_ANALYTICS_CLUSTER_ID+"/"+`${accessKey}${point.id}`,
-    headers: {
-      'X-API-KEY': process.env["AC_ANALYTICS_KEY"]
-    },
-    json: properties
+  return {
+    communityId,
+    accessKey,
+    accessExpiresAt: expiryDate.toISOString(),
+    encryptionKey: crypto.randomBytes(32).toString('hex'),
+    encryptionIv: crypto.randomBytes(16).toString('hex'),
+    stage: STAGES[0],
+    lastId: 0,
+    offsets: {}
   };
-
-  request.post(options, (error) => {
-    done(error);
-  });
 };
 
-let csvActivitiesTxt = "Id,Date,Type,PointId,PostId,UserId\n";
-
-const saveActivity = (activity, accessKey, done) => {
-  let expiryDate = new Date();
-  expiryDate.setDate(expiryDate.getDate() + 7);
-
-  const properties = {
-    id: activity.id,
-    date: activity.created_at.toISOString(),
-    type: activity.type,
-    point_id: activity.point_id,
-    post_id: activity.post_id,
-    user_id: activity.user_id,
-    access_key: accessKey,
-    access_expires_at: expiryDate.toISOString()
-  };
-
-  csvActivitiesTxt += activity.id+','+properties.date+',"'+activity.type+'",'+'"'+activity.point_id+'",'+'"'+activity.post_id+'",'+'"'+activity.user_id+'"\n';
-
-  const options = {
-    url: process.env["AC_ANALYTICS_BASE_URL"]+"anonActivities/"+process.env.AC_ANALYTICS_CLUSTER_ID+"/"+`${accessKey}${activity.id}`,
-    headers: {
-      'X-API-KEY': process.env["AC_ANALYTICS_KEY"]
-    },
-    json: properties
-  };
-
-  request.post(options, (error) => {
-    done(error);
+const saveCheckpoint = async (outputDir, checkpoint, writers) => {
+  _.forEach(writers, (writer, name) => {
+    checkpoint.offsets[name] = writer.bytes;
   });
+  const checkpointPath = path.join(outputDir, 'checkpoint.json');
+  await fs.promises.writeFile(checkpointPath + '.tmp', JSON.stringify(checkpoint), { mode: 0o600 });
+  await fs.promises.rename(checkpointPath + '.tmp', checkpointPath);
 };
 
-let csvUsersTxt = "Id\n";
-
-const saveAnonymousUser = (user, accessKey, done) => {
-  let expiryDate = new Date();
-  expiryDate.setDate(expiryDate.getDate() + 7);
-
-  const properties = {
-    id: user.id,
-    access_key: accessKey,
-    access_expires_at: expiryDate.toISOString()
-  };
-
-  csvUsersTxt += user.id+'\n';
-
-  const options = {
-    url: process.env["AC_ANALYTICS_BASE_URL"]+"anonUsers/"+process.env.AC_ANALYTICS_CLUSTER_ID+"/"+`${accessKey}${user.id}`,
-    headers: {
-      'X-API-KEY': process.env["AC_ANALYTICS_KEY"]
+// Appends to the file, after cutting off what was written after the last checkpoint
+const openWriter = async (outputDir, name, offset) => {
+  const filePath = path.join(outputDir, OUTPUT_FILES[name].fileName);
+  if (offset) {
+    await fs.promises.truncate(filePath, offset);
+  }
+  const stream = fs.createWriteStream(filePath, { flags: offset ? 'a' : 'w' });
+  const writer = {
+    filePath,
+    bytes: offset || 0,
+    // Resolves once the text is flushed, which also keeps memory flat when the disk is slow
+    write: (text) => {
+      writer.bytes += Buffer.byteLength(text);
+      return new Promise((resolve, reject) => {
+        stream.write(text, error => error ? reject(error) : resolve());
+      });
     },
-    json: properties
+    close: () => new Promise(resolve => stream.end(resolve))
   };
+  if (!offset && OUTPUT_FILES[name].header) {
+    await writer.write(OUTPUT_FILES[name].header);
+  }
+  return writer;
+};
 
-  request.post(options, (error) => {
-    done(error);
+const getTranslation = (item, textType) => {
+  return new Promise((resolve) => {
+    const req = {
+      query: {
+        textType,
+        targetLanguage: 'en'
+      }
+    };
+    models.AcTranslationCache.getTranslation(req, item, (error, translation) => {
+      resolve(translation ? translation.content : 'no translation');
+    });
   });
 };
 
-const collectAllPostsAndPoints = (activities, collectedPostIds, collectedPointIds) => {
-  activities.forEach((item)=>{
-
-    if (item.Post) {
-      collectedPostIds.push(item.Post.id);
+// Like Promise.all over items.map(fn) with at most limit calls running
+const mapLimit = async (items, limit, fn) => {
+  const results = [];
+  let nextIndex = 0;
+  const workers = _.times(Math.min(limit, items.length), async () => {
+    while (nextIndex < items.length) {
+      const index = nextIndex++;
+      results[index] = await fn(items[index]);
     }
+  });
+  await Promise.all(workers);
+  return results;
+};
 
-    if (item.Point) {
-      collectedPointIds.push(item.Point.id);
+// Posts each record to anon<Type>/<cluster>/<esId> with at most UPLOAD_CONCURRENCY requests
+// running. With ANON_EXPORT_BATCH_UPLOAD=true the records are sent UPLOAD_BATCH_SIZE at a time to
+// addManyAnon<Type>/<cluster> instead, only for analytics services that have those endpoints.
+const uploadRecords = async (recordType, accessKey, records) => {
+  const post = (options) => new Promise((resolve, reject) => {
+    request.post(options, (error) => error ? reject(error) : resolve());
+  });
+  const headers = {
+    'X-API-KEY': process.env["AC_ANALYTICS_KEY"]
+  };
+  if (BATCH_UPLOAD) {
+    for (const batch of _.chunk(records, UPLOAD_BATCH_SIZE)) {
+      await post({
+        url: process.env["AC_ANALYTICS_BASE_URL"]+"addMany"+_.upperFirst(recordType)+"/"+process.env.AC_ANALYTICS_CLUSTER_ID,
+        headers,
+        json: {
+          access_key: accessKey,
+          records: batch.map(record => Object.assign({ esId: `${accessKey}${record.id}` }, record))
+        }
+      });
     }
+  } else {
+    await mapLimit(records, UPLOAD_CONCURRENCY, record => post({
+      url: process.env["AC_ANALYTICS_BASE_URL"]+recordType+"/"+process.env.AC_ANALYTICS_CLUSTER_ID+"/"+`${accessKey}${record.id}`,
+      headers,
+      json: record
+    }));
+  }
+};
 
-    if (!item.Point && !item.Post) {
-      log.warn("Can't find post or point id for activity in anonymous export", { item });
+// Unique ids from an id list file above lastId in ascending order
+const readCollectedIds = async (writer, lastId) => {
+  const content = await fs.promises.readFile(writer.filePath, 'utf8');
+  const ids = new Set();
+  content.split('\n').forEach(line => {
+    const id = parseInt(line);
+    if (id > lastId) {
+      ids.add(id);
     }
   });
+  return Array.from(ids).sort((a, b) => a - b);
 };
 
-const sendAllCollectedPostAndPoints = (accessKey, collectedPostIds, collectedPointIds, encryptionKey, encryptionIv, done) => {
-  collectedPostIds = _.uniq(collectedPostIds);
-  collectedPointIds = _.uniq(collectedPointIds);
-
-  async.series([
-    (seriesCallback) => {
-      async.forEachSeries(collectedPostIds, (postId, forEachSeriesCallback) => {
-        models.Post.findOne({
-          where: {
-            id: postId
-          },
-          attributes: ['id','name','description','public_data','created_at','data']
-        }).then((post)=>{
-          let req = {
-            query: {
-              textType: 'postContent',
-              targetLanguage: 'en'
-            }
-          };
-          models.AcTranslationCache.getTranslation(req, post, function (error, descriptionEn) {
-            req = {
-              query: {
-                textType: 'postName',
-                targetLanguage: 'en'
-              }
-            };
-            models.AcTranslationCache.getTranslation(req, post, function (error, nameEn) {
-              saveAnonymousPost({
-                id: getEncryptedId((post.id), encryptionKey, encryptionIv),
-                name: post.name,
-                name_en: nameEn ? nameEn.content : 'no translation',
-                created_at: post.created_at,
-                toxicity_score: (post.data && post.data.moderation) ? post.data.moderation.toxicityScore : null,
-                description: post.description,
-                description_en: descriptionEn ? descriptionEn.content : 'no translation',
-              }, accessKey, forEachSeriesCallback);
-            });
-          });
-        }).catch((error)=> {
-          forEachSeriesCallback(error);
-        });
-      },(error) => {
-        seriesCallback(error);
-      });
-    },
-    (seriesCallback) => {
-      async.forEachSeries(collectedPointIds, (pointId, forEachSeriesCallback) => {
-        models.Point.findOne({
-          where: {
-            id: pointId
-          },
-          order: [
-            [ models.PointRevision, 'created_at', 'asc' ],
-          ],
-          attributes: ['id','created_at','content','value','data'],
-          include: [
-            {
-              model: models.PointRevision,
-              attributes: ['id','content']
-            }
-          ]
-        }).then((point)=>{
-          let req = {
-            query: {
-              textType: 'pointContent',
-              targetLanguage: 'en'
-            }
-          };
-          models.AcTranslationCache.getTranslation(req, point, function (error, contentEn) {
-            saveAnonymousPoint({
-              id: getEncryptedId((point.id), encryptionKey, encryptionIv),
-              content: point.content,
-              value: point.value,
-              toxicity_score: (point.data && point.data.moderation) ? point.data.moderation.toxicityScore : null,
-              created_at: point.created_at,
-              content_en: contentEn ? contentEn.content : 'no translation'
-            }, accessKey, forEachSeriesCallback);
-          });
-        }).catch((error)=> {
-          forEachSeriesCallback(error);
-        });
-      },(error) => {
-        seriesCallback(error);
-      });
-    },
-  ], (error) => {
-    done(error);
-  })
+const exportUsers = async (context) => {
+  const { checkpoint, writers, encryptId } = context;
+  const userIds = context.userIds.filter(userId => userId > checkpoint.lastId);
+  for (const pageIds of _.chunk(userIds, PAGE_SIZE)) {
+    const users = pageIds.map(userId => ({
+      id: encryptId(userId),
+      access_key: checkpoint.accessKey,
+      access_expires_at: checkpoint.accessExpiresAt
+    }));
+    await writers.users.write(users.map(user => user.id+'\n').join(''));
+    await uploadRecords('anonUsers', checkpoint.accessKey, users);
+    checkpoint.lastId = _.last(pageIds);
+    await saveCheckpoint(context.outputDir, checkpoint, writers);
+  }
 };
 
-const sendAllUserActivitiesWithContent = (userId, communityId, collectedPostIds, collectedPointIds, encryptionKey, encryptionIv, accessKey, done) => {
-  models.AcActivity.findAll({
-    where: {
-      user_id: userId,
-      community_id: communityId,
-      type: {
-        $in: [
-          "activity.post.new","activity.post.opposition.new","activity.post.endorsement.new",
-          "activity.point.new","activity.point.helpful.new","activity.point.unhelpful.new"
-        ]
-      }
-    },
-    attributes: ['id','type','created_at','user_id','post_id','point_id'],
-    include: [
-      {
-        model: models.Post,
-        required: false,
-        attributes: ['id']
+const exportActivities = async (context) => {
+  const { checkpoint, writers, encryptId } = context;
+  const communityUserIds = new Set(context.userIds);
+  let page;
+  do {
+    page = await models.AcActivity.findAll({
+      where: {
+        community_id: checkpoint.communityId,
+        type: {
+          $in: ACTIVITY_TYPES
+        },
+        id: {
+          $gt: checkpoint.lastId
+        }
       },
-      {
-        model: models.Point,
-        required: false,
-        attributes: ['id']
-      }
-    ]
-  }).then((activities) => {
-    collectAllPostsAndPoints(activities, collectedPostIds, collectedPointIds);
-    async.forEachSeries(activities, (activity, forEachSeriesCallback) => {
+      attributes: ['id','type','created_at','user_id','post_id','point_id'],
+      include: [
+        {
+          model: models.Post,
+          required: false,
+          attributes: ['id']
+        },
+        {
+          model: models.Point,
+          required: false,
+          attributes: ['id']
+        }
+      ],
+      order: [['id', 'ASC']],
+      limit: PAGE_SIZE
+    });
+
+    const memberActivities = page.filter(activity => communityUserIds.has(activity.user_id));
+    const activities = [];
+    memberActivities.forEach(activity => {
       if (activity.Post || activity.Point) {
-        saveActivity({
-          id: getEncryptedId(activity.id, encryptionKey, encryptionIv),
+        activities.push({
+          id: encryptId(activity.id),
+          date: activity.created_at.toISOString(),
           type: activity.type,
-          created_at: activity.created_at,
-          post_id: activity.Post ? getEncryptedId(activity.Post.id, encryptionKey, encryptionIv) : null,
-          point_id: activity.Point ? getEncryptedId(activity.Point.id, encryptionKey, encryptionIv) : null,
-          user_id: getEncryptedId(activity.user_id, encryptionKey, encryptionIv)
-        }, accessKey, forEachSeriesCallback);
+          post_id: activity.Post ? encryptId(activity.Post.id) : null,
+          point_id: activity.Point ? encryptId(activity.Point.id) : null,
+          user_id: encryptId(activity.user_id),
+          access_key: checkpoint.accessKey,
+          access_expires_at: checkpoint.accessExpiresAt
+        });
       } else {
-        log.warn("Can't find post or point for activity");
-        forEachSeriesCallback();
+        log.warn("Can't find post or point id for activity in anonymous export", { activityId: activity.id });
       }
-    }, (error) => {
-      done(error);
     });
-  }).catch(function (error) {
-    done(error);
-  });
+
+    if (page.length > 0) {
+      await writers.activities.write(activities.map(activity => {
+        return activity.id+','+activity.date+',"'+activity.type+'",'+'"'+activity.point_id+'",'+'"'+activity.post_id+'",'+'"'+activity.user_id+'"\n';
+      }).join(''));
+      const postIds = memberActivities.filter(activity => activity.Post).map(activity => activity.Post.id);
+      const pointIds = memberActivities.filter(activity => activity.Point).map(activity => activity.Point.id);
+      await writers.postIds.write(postIds.map(id => id+'\n').join(''));
+      await writers.pointIds.write(pointIds.map(id => id+'\n').join(''));
+      await uploadRecords('anonActivities', checkpoint.accessKey, activities);
+      checkpoint.lastId = _.last(page).id;
+      await saveCheckpoint(context.outputDir, checkpoint, writers);
+    }
+  } while (page.length === PAGE_SIZE);
 };
 
-const importCommunityUsersAndActivities = (communityId, accessKey, done) => {
-  const encryptionKey = crypto.randomBytes(32);
-  const encryptionIv = crypto.randomBytes(16);
-  let collectedPostIds = [];
-  let collectedPointIds = [];
+const exportPosts = async (context) => {
+  const { checkpoint, writers, encryptId } = context;
+  const postIds = await readCollectedIds(writers.postIds, checkpoint.lastId);
+  for (const pageIds of _.chunk(postIds, PAGE_SIZE)) {
+    const posts = await models.Post.findAll({
+      where: {
+        id: {
+          $in: pageIds
+        }
+      },
+      attributes: ['id','name','description','public_data','created_at','data'],
+      order: [['id', 'ASC']]
+    });
+    const anonPosts = await mapLimit(posts, TRANSLATION_CONCURRENCY, async (post) => {
+      const descriptionEn = await getTranslation(post, 'postContent');
+      const nameEn = await getTranslation(post, 'postName');
+      return {
+        id: encryptId(post.id),
+        name: post.name,
+        name_en: nameEn,
+        date: post.created_at.toISOString(),
+        description: post.description,
+        description_en: descriptionEn,
+        toxicity_score: (post.data && post.data.moderation) ? post.data.moderation.toxicityScore : null,
+        access_key: checkpoint.accessKey,
+        access_expires_at: checkpoint.accessExpiresAt
+      };
+    });
+    await writers.posts.write(anonPosts.map(post => {
+      return post.id+','+post.date+',"'+clean(post.name)+'","'+clean(post.name_en)+'",'+'"'+clean(post.description)+'",'+'"'+clean(post.description_en)+'",'+post.toxicity_score+'\n';
+    }).join(''));
+    await uploadRecords('anonPosts', checkpoint.accessKey, anonPosts);
+    checkpoint.lastId = _.last(pageIds);
+    await saveCheckpoint(context.outputDir, checkpoint, writers);
+  }
+};
 
-  models.Community.findOne({
+const exportPoints = async (context) => {
+  const { checkpoint, writers, encryptId } = context;
+  const pointIds = await readCollectedIds(writers.pointIds, checkpoint.lastId);
+  for (const pageIds of _.chunk(pointIds, PAGE_SIZE)) {
+    const points = await models.Point.findAll({
+      where: {
+        id: {
+          $in: pageIds
+        }
+      },
+      order: [
+        [ 'id', 'asc' ],
+        [ models.PointRevision, 'created_at', 'asc' ],
+      ],
+      attributes: ['id','created_at','content','value','data'],
+      include: [
+        {
+          model: models.PointRevision,
+          attributes: ['id','content']
+        }
+      ]
+    });
+    const anonPoints = await mapLimit(points, TRANSLATION_CONCURRENCY, async (point) => {
+      const contentEn = await getTranslation(point, 'pointContent');
+      return {
+        id: encryptId(point.id),
+        date: point.created_at.toISOString(),
+        content: point.content,
+        content_en: contentEn,
+        value: point.value,
+        toxicity_score: (point.data && point.data.moderation) ? point.data.moderation.toxicityScore : null,
+        access_key: checkpoint.accessKey,
+        access_expires_at: checkpoint.accessExpiresAt
+      };
+    });
+    await writers.points.write(anonPoints.map(point => {
+      return point.id+','+point.date+',"'+clean(point.content)+'",'+'"'+clean(point.content_en)+'",'+point.value+','+point.toxicity_score+'\n';
+    }).join(''));
+    await uploadRecords('anonPoints', checkpoint.accessKey, anonPoints);
+    checkpoint.lastId = _.last(pageIds);
+    await saveCheckpoint(context.outputDir, checkpoint, writers);
+  }
+};
+
+const stageExporters = {
+  users: exportUsers,
+  activities: exportActivities,
+  posts: exportPosts,
+  points: exportPoints
+};
+
+const exportCommunity = async (communityId, accessKey, outputDir) => {
+  await fs.promises.mkdir(outputDir, { recursive: true });
+  const checkpoint = await loadCheckpoint(outputDir, communityId, accessKey);
+
+  const community = await models.Community.findOne({
     where: {
       id: communityId
     },
+    attributes: ['id'],
     include: [
       {
         model: models.User,
@@ -326,43 +388,61 @@ const importCommunityUsersAndActivities = (communityId, accessKey, done) => {
         required: true,
       }
     ]
-  }).then(function (community) {
-    if (community && community.CommunityUsers) {
-      async.forEachSeries(community.CommunityUsers, (user, eachSeriesCallback) => {
-        saveAnonymousUser({
-          id: getEncryptedId(user.id, encryptionKey, encryptionIv)
-        }, accessKey, (error) => {
-          if (error) {
-            eachSeriesCallback(error);
-          } else {
-            sendAllUserActivitiesWithContent(user.id, communityId, collectedPostIds, collectedPointIds, encryptionKey, encryptionIv, accessKey, eachSeriesCallback);
-          }
-        })
-      }, (error) => {
-        if (error) {
-          done(error);
-        } else {
-          sendAllCollectedPostAndPoints(accessKey, collectedPostIds, collectedPointIds, encryptionKey, encryptionIv, (error) => {
-            done(error);
-          })
-        }
-      });
-    } else {
-      done("Could not find community");
-    }
-  }).catch(function (error) {
+  });
+  if (!community || !community.CommunityUsers) {
+    throw "Could not find community";
+  }
+
+  const writers = {};
+  for (const name of Object.keys(OUTPUT_FILES)) {
+    writers[name] = await openWriter(outputDir, name, checkpoint.offsets[name]);
+  }
+
+  const context = {
+    outputDir,
+    checkpoint,
+    writers,
+    userIds: community.CommunityUsers.map(user => user.id).sort((a, b) => a - b),
+    encryptId: createIdEncrypter(Buffer.from(checkpoint.encryptionKey, 'hex'), Buffer.from(checkpoint.encryptionIv, 'hex'))
+  };
+
+  for (let stageIndex = STAGES.indexOf(checkpoint.stage); STAGES[stageIndex] !== 'done'; stageIndex++) {
+    const stage = STAGES[stageIndex];
+    log.info("Anonymous export stage", { communityId, stage });
+    await stageExporters[stage](context);
+    checkpoint.stage = STAGES[stageIndex + 1];
+    checkpoint.lastId = 0;
+    await saveCheckpoint(outputDir, checkpoint, writers);
+  }
+
+  for (const name of Object.keys(writers)) {
+    await writers[name].close();
+  }
+  await fs.promises.unlink(writers.postIds.filePath);
+  await fs.promises.unlink(writers.pointIds.filePath);
+  await fs.promises.unlink(path.join(outputDir, 'checkpoint.json'));
+};
+
+const importCommunityUsersAndActivities = (communityId, accessKey, outputDir, done) => {
+  exportCommunity(communityId, accessKey, outputDir).then(() => {
+    done();
+  }).catch(error => {
     done(error);
   });
 };
 
-importCommunityUsersAndActivities(1017, "12345", ()=> {
-  fs.writeFileSync("/home/robert/Scratch/MMU/users.csv", csvUsersTxt);
-  fs.writeFileSync("/home/robert/Scratch/MMU/posts.csv", csvPostsTxt);
-  fs.writeFileSync("/home/robert/Scratch/MMU/points.csv", csvPointsTxt);
-  fs.writeFileSync("/home/robert/Scratch/MMU/activities.csv", csvActivitiesTxt);
-  process.exit();
-});
+if (require.main === module) {
+  const [communityId, accessKey, outputDir] = process.argv.slice(2);
+  importCommunityUsersAndActivities(parseInt(communityId), accessKey, outputDir, (error) => {
+    if (error) {
+      console.error(error);
+    } else {
+      console.log(`Export done in ${outputDir}`);
+    }
+    process.exit();
+  });
+}
 
 module.exports = {
   importCommunityUsersAndActivities
-};
\ No newline at end of file
+};
@@ -0,0 +1,84 @@
+const request = require("request");
+const log = require("../../../utils/logger.cjs");
+
+// Sends Plausible events through a queue with at most CONCURRENCY requests on the wire over kept
+// alive connections. Network errors, 429 and 5xx answers are retried with exponential backoff.
+
+const CONCURRENCY = process.env.PLAUSIBLE_EVENT_CONCURRENCY ? parseInt(process.env.PLAUSIBLE_EVENT_CONCURRENCY) : 8;
+const MAX_RETRIES = process.env.PLAUSIBLE_EVENT_RETRIES ? parseInt(process.env.PLAUSIBLE_EVENT_RETRIES) : 3;
+const RETRY_BASE_DELAY_MS = process.env.PLAUSIBLE_EVENT_RETRY_DELAY_MS ? parseInt(process.env.PLAUSIBLE_EVENT_RETRY_DELAY_MS) : 500;
+
+const queue = [];
+let active = 0;
+
+const stats = {
+  queued: 0,
+  sent: 0,
+  retried: 0,
+  forbidden: 0,
+  failed: 0
+};
+
+const post = (options) => {
+  return new Promise((resolve) => {
+    request.post(Object.assign({ forever: true }, options), (error, content) => {
+      resolve({ error, content });
+    });
+  });
+};
+
+const isRetryable = (error, content) => {
+  return !!error || !content || content.statusCode == 429 || content.statusCode >= 500;
+};
+
+const sendWithRetries = async (options, logLine) => {
+  for (let attempt = 0; ; attempt++) {
+    const { error, content } = await post(options);
+    if (content && content.statusCode == 202) {
+      stats.sent += 1;
+      return;
+    } else if (content && content.statusCode == 403) {
+      stats.forbidden += 1;
+      log.warn(`Got 403 from plausible for ${logLine}`);
+      return;
+    } else if (attempt < MAX_RETRIES && isRetryable(error, content)) {
+      stats.retried += 1;
+      const delay = RETRY_BASE_DELAY_MS * Math.pow(2, attempt) * (1 + Math.random() / 2);
+      await new Promise(resolve => setTimeout(resolve, delay));
+    } else {
+      stats.failed += 1;
+      const statusCode = content ? content.statusCode : null;
+      log.error(`Error in sending to plausible ${statusCode} ${error} ${logLine}`);
+      throw statusCode || error;
+    }
+  }
+};
+
+const pump = () => {
+  while (active < CONCURRENCY && queue.length > 0) {
+    const job = queue.shift();
+    active += 1;
+    sendWithRetries(job.options, job.logLine).then(job.resolve, job.reject).finally(() => {
+      active -= 1;
+      pump();
+    });
+  }
+};
+
+/**
+ * Queues a Plausible event request, resolves once Plausible accepted it or answered 403
+ */
+const sendPlausibleEvent = (options, logLine) => {
+  return new Promise((resolve, reject) => {
+    stats.queued += 1;
+    queue.push({ options, logLine, resolve, reject });
+    pump();
+  });
+};
+
+const getStats = () => Object.assign({ waiting: queue.length, active }, stats);
+
+module.exports = {
+  sendPlausibleEvent,
+  getStats
+};
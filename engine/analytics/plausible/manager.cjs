@@ -2,6 +2,8 @@ const models = require("../../../../models/index.cjs");
 const log = require("../../../utils/logger.cjs");
 const request = require("request");
 const moment = require("moment");
+const { getCacheKey, getCachedStats } = require("./stats_cache.cjs");
+const { sendPlausibleEvent } = require("./event_sender.cjs");
 
 // This SQL is needed to allow the site API
 // UPDATE api_keys SET scopes = '{sites:provision:*}' WHERE name = 'Development';
@@ -160,6 +162,23 @@ const allGoals = [
   "open - share dialog - clipboard"
 ];
 
+function fetchStats(options) {
+  return new Promise((resolve, reject) => {
+    request.get(Object.assign({ forever: true }, options), (error, content) => {
+      if (content && content.statusCode != 200) {
+        log.error(error);
+        log.error(content);
+        reject(content.statusCode);
+      } else if (content) {
+        log.debug(content.body);
+        resolve(content.body);
+      } else {
+        reject("No body for plausible content");
+      }
+    });
+  });
+}
+
 async function plausibleStatsProxy(plausibleUrl, props) {
   return await new Promise((resolve, reject) => {
     if (process.env["PLAUSIBLE_BASE_URL"] && process.env["PLAUSIBLE_API_KEY"]) {
@@ -225,18 +244,7 @@ async function plausibleStatsProxy(plausibleUrl, props) {
 
       log.debug(JSON.stringify(options));
 
-      request.get(options, (error, content) => {
-        if (content && content.statusCode != 200) {
-          log.error(error);
-          log.error(content);
-          reject(content.statusCode);
-        } else if (content) {
-          log.debug(content.body);
-          resolve(content.body);
-        } else {
-          reject("No body for plausible content")
-        }
-      });
+      getCachedStats(getCacheKey(options.url), () => fetchStats(options)).then(resolve, reject);
     } else {
       log.warn("No plausible base url or api key");
       resolve();
@@ -258,18 +266,7 @@ async function getPlausibleStats(statsParams) {
 
       log.info(JSON.stringify(options));
 
-      request.get(options, (error, content) => {
-        if (content && content.statusCode != 200) {
-          log.error(error);
-          log.error(content);
-          reject(content.statusCode);
-        } else if (content) {
-          console.log(content.body);
-          resolve(content.body);
-        } else {
-          reject("No body for plausible content");
-        }
-      });
+      getCachedStats(getCacheKey(options.url), () => fetchStats(options)).then(resolve, reject);
     } else {
       log.warn("No plausible base url or api key");
       resolve();
@@ -464,20 +461,7 @@ async function addPlausibleEvent(
       const logLine = `${ipAddress} Plausible ${eventName} - ${JSON.stringify(props)} - ${useUrl} - ${referrer} -${userAgent}`;
       log.debug(logLine);
 
-      request.post(options, async (error, content) => {
-        if (content && content.statusCode != 202) {
-          if (content.statusCode == 403) {
-            log.warn(`Got 403 from plausible for ${logLine}`)
-            resolve();
-          } else {
-            log.error(`Error in sending to plausible ${content.statusCode} ${content.error} ${logLine}`);
-            log.error(content);
-            reject(content.statusCode);
-          }
-        } else {
-          resolve();
-        }
-      });
+      sendPlausibleEvent(options, logLine).then(resolve, reject);
     } else {
       log.warn("No plausible base url or api key");
       resolve();
@@ -0,0 +1,127 @@
+const crypto = require("crypto");
+const log = require("../../../utils/logger.cjs");
+const getRedisCommands = require("../../../utils/redis_commands.cjs");
+
+// Stale-while-revalidate cache for Plausible stats responses.
+//
+// Responses younger than FRESH_SECONDS are served as they are. Up to STALE_SECONDS after that they
+// are still served but refreshed in the background, older ones are fetched before answering.
+// Concurrent requests for the same query share one upstream request. Entries live in process and,
+// when Redis is ready, in Redis so all web processes share them.
+
+const FRESH_SECONDS = process.env.PLAUSIBLE_STATS_CACHE_FRESH_SECONDS ? parseInt(process.env.PLAUSIBLE_STATS_CACHE_FRESH_SECONDS) : 60;
+const STALE_SECONDS = process.env.PLAUSIBLE_STATS_CACHE_STALE_SECONDS ? parseInt(process.env.PLAUSIBLE_STATS_CACHE_STALE_SECONDS) : 10 * 60;
+const MAX_LOCAL_ENTRIES = process.env.PLAUSIBLE_STATS_CACHE_MAX_ENTRIES ? parseInt(process.env.PLAUSIBLE_STATS_CACHE_MAX_ENTRIES) : 1000;
+
+const localEntries = new Map();
+const inFlight = new Map();
+
+const stats = {
+  fresh: 0,
+  stale: 0,
+  misses: 0,
+  upstreamRequests: 0,
+  sharedRequests: 0,
+  revalidationErrors: 0
+};
+
+/**
+ * Builds a cache key from a url with its query parameters sorted, so the same query in another
+ * parameter order hits the same entry
+ */
+const getCacheKey = (url) => {
+  const [path, query] = url.split("?");
+  const searchParams = new URLSearchParams(query);
+  searchParams.sort();
+  const hash = crypto.createHash("sha1").update(`${path}?${searchParams.toString()}`).digest("hex");
+  return `cache:plausible:stats:${hash}`;
+};
+
+const setLocalEntry = (key, entry) => {
+  localEntries.delete(key);
+  localEntries.set(key, entry);
+  if (localEntries.size > MAX_LOCAL_ENTRIES) {
+    localEntries.delete(localEntries.keys().next().value);
+  }
+};
+
+const getEntry = async (key) => {
+  const localEntry = localEntries.get(key);
+  if (localEntry) {
+    return localEntry;
+  }
+  const redis = getRedisCommands();
+  if (redis) {
+    try {
+      const entryJson = await redis.get(key);
+      if (entryJson) {
+        const entry = JSON.parse(entryJson);
+        setLocalEntry(key, entry);
+        return entry;
+      }
+    } catch (error) {
+      log.error("Could not read Plausible stats cache", { err: error });
+    }
+  }
+  return null;
+};
+
+// One upstream request per key at a time, the result is stored for everyone waiting on it
+const refresh = (key, fetcher) => {
+  if (inFlight.has(key)) {
+    stats.sharedRequests += 1;
+    return inFlight.get(key);
+  }
+  stats.upstreamRequests += 1;
+  const promise = fetcher().then((body) => {
+    const entry = { body, fetchedAt: Date.now() };
+    setLocalEntry(key, entry);
+    const redis = getRedisCommands();
+    if (redis) {
+      redis.setEx(key, FRESH_SECONDS + STALE_SECONDS, JSON.stringify(entry)).catch(error => {
+        log.error("Could not write Plausible stats cache", { err: error });
+      });
+    }
+    return body;
+  }).finally(() => {
+    inFlight.delete(key);
+  });
+  inFlight.set(key, promise);
+  return promise;
+};
+
+/**
+ * Returns the cached response for key, fetcher() returns a promise of a fresh one
+ */
+const getCachedStats = async (key, fetcher) => {
+  const entry = await getEntry(key);
+  const ageSeconds = entry ? (Date.now() - entry.fetchedAt) / 1000 : null;
+
+  if (entry && ageSeconds < FRESH_SECONDS) {
+    stats.fresh += 1;
+    return entry.body;
+  } else if (entry && ageSeconds < FRESH_SECONDS + STALE_SECONDS) {
+    stats.stale += 1;
+    refresh(key, fetcher).catch(error => {
+      stats.revalidationErrors += 1;
+      log.error("Could not revalidate Plausible stats", { err: error });
+    });
+    return entry.body;
+  } else {
+    stats.misses += 1;
+    return await refresh(key, fetcher);
+  }
+};
+
+const getStats = () => Object.assign({ localEntries: localEntries.size, inFlight: inFlight.size }, stats);
+
+const clear = () => {
+  localEntries.clear();
+};
+
+module.exports = {
+  getCacheKey,
+  getCachedStats,
+  getStats,
+  clear
+};
@@ -1,7 +1,6 @@
 const models = require("../../../models/index.cjs");
 const log = require('../../utils/logger.cjs');
-const moment = require('moment');
-const _ = require('lodash');
+const activityRollups = require('./activity_rollups.cjs');
 
 const getPointDomainIncludes = (id) => {
   return [
@@ -90,73 +89,62 @@ const getGroupIncludes = (id) => {
   ]
 };
 
+// The daily counts are only complete after scripts/analytics_refresh_activity_rollups.js has run
+const useActivityRollups = process.env.STATS_ACTIVITY_ROLLUPS === 'true';
+
+// Counts rows per UTC day in the database, returns [{ day: 'YYYY-MM-DD', count }] in day order
+const countModelRowsByDay = (model, whereOptions, includeOptions) => {
+  const createdAt = models.sequelize.col(`${model.name}.created_at`);
+  const day = models.sequelize.fn('to_char', models.sequelize.fn('date_trunc', 'day', createdAt), 'YYYY-MM-DD');
+  return model.findAll({
+    where: whereOptions,
+    include: includeOptions,
+    attributes: [
+      [day, 'day'],
+      [models.sequelize.fn('count', models.sequelize.col(`${model.name}.id`)), 'count']
+    ],
+    group: [day],
+    order: [[day, 'ASC']],
+    raw: true
+  });
+};
+
+// Sums the day counts into the chart series, periods without rows are left out
+const dailyCountsToTimePeriods = (dailyCounts) => {
+  const finalDays = [];
+  const finalMonths = [];
+  const finalYears = [];
+  dailyCounts.forEach(row => {
+    const count = parseInt(row.count);
+    const month = row.day.slice(0, 7);
+    const year = row.day.slice(0, 4);
+    finalDays.push({x: row.day, y: count});
+    if (finalMonths.length > 0 && finalMonths[finalMonths.length - 1].x === month) {
+      finalMonths[finalMonths.length - 1].y += count;
+    } else {
+      finalMonths.push({x: month, y: count});
+    }
+    if (finalYears.length > 0 && finalYears[finalYears.length - 1].x === year) {
+      finalYears[finalYears.length - 1].y += count;
+    } else {
+      finalYears.push({x: year, y: count});
+    }
+  });
+  return {finalDays, finalMonths, finalYears};
+};
+
 const countModelRowsByTimePeriod = (req, cacheKey, model, whereOptions, includeOptions, done) => {
   const redisKey = "cachev4:"+cacheKey;
   req.redisClient.get(redisKey).then(results => {
     if (results) {
-      done(null, results);
+      done(null, JSON.parse(results));
     } else {
-      model.findAll({
-        where: whereOptions,
-        include: includeOptions,
-        attributes: ['created_at'],
-        order: [['created_at', 'ASC']]
-      }).then((results) => {
-        if (results && results.length>0) {const startDate = moment(results[0].created_at);
-          const endDate = moment(results[results.length - 1].created_at);
-
-          const days = _.groupBy(results, function (item) {
-            return moment(item.created_at).format("YYYY/MM/DD");
-          });
-
-          const months = _.groupBy(results, function (item) {
-            return moment(item.created_at).format("YYYY/MM");
-          });
-
-          const years = _.groupBy(results, function (item) {
-            return moment(item.created_at).format("YYYY");
-          });
-
-          const totalDaysCount = endDate.diff(startDate, 'days', false) + 2;
-          let currentDate = moment(results[0].created_at);
-          let finalDays = [];
-          for (let i = 0; i < totalDaysCount; i++) {
-            const currentDateText = currentDate.format("YYYY/MM/DD");
-            if (days[currentDateText]) {
-              finalDays.push({x: currentDate.format("YYYY-MM-DD"), y: days[currentDateText].length})
-            } else {
-              //    finalDays.push({ x: currentDate.format("YYYY-MM-DD"), y: 0})
-            }
-            currentDate = currentDate.add(1, "days");
-          }
-
-          const totalMonthsCount = endDate.diff(startDate, 'months', false) + 2;
-          let currentMonth = moment(results[0].created_at);
-          let finalMonths = [];
-          for (let i = 0; i < totalMonthsCount; i++) {
-            const currentMonthText = currentMonth.format("YYYY/MM");
-            if (months[currentMonthText]) {
-              finalMonths.push({x: currentMonth.format("YYYY-MM"), y: months[currentMonthText].length})
-            } else {
-              //    finalMonths.push({ x: currentMonth.format("YYYY-MM"), y: 0})
-            }
-            currentMonth = currentMonth.add(1, "months");
-          }
-
-          const totalYearsCount = endDate.diff(startDate, 'years', false) + 2;
-          let currentYear = moment(results[0].created_at);
-          let finalYears = [];
-          for (let i = 0; i < totalYearsCount; i++) {
-            const currentYearText = currentYear.format("YYYY");
-            if (years[currentYearText]) {
-              finalYears.push({x: currentYearText, y: years[currentYearText].length})
-            } else {
-//        finalYears.push({ x: currentYearText, y: 0})
-            }
-            currentYear = currentYear.add(1, "years");
-          }
-
-          const finalResults = {finalDays, finalMonths, finalYears};
+      const rollupScope = useActivityRollups ? activityRollups.getRollupScope(model, whereOptions, includeOptions) : null;
+      const dailyCountsPromise = rollupScope ?
+        activityRollups.getDailyCounts(rollupScope) : countModelRowsByDay(model, whereOptions, includeOptions);
+      dailyCountsPromise.then((dailyCounts) => {
+        if (dailyCounts && dailyCounts.length>0) {
+          const finalResults = dailyCountsToTimePeriods(dailyCounts);
           req.redisClient.setEx(redisKey, process.env.STATS_CACHE_TTL ? parseInt(process.env.STATS_CACHE_TTL) : 5 * 60, JSON.stringify(finalResults));
           done(null, finalResults);
         } else {
@@ -0,0 +1,283 @@
+const moment = require("moment");
+const models = require("../../../../models/index.cjs");
+
+// SQL version of the FraudGet* grouping for the scheduled fraud scan (FraudScannerNotifier).
+// The items of a community are grouped by IP address, user agent, browser fingerprint and post or
+// point id with GROUP BY in a sliding window of FRAUD_SCAN_WINDOW_DAYS. Only clusters with items
+// above the watermark, the highest item id seen by the previous scan, are returned and they are
+// read through a server side cursor, so a scan does not hold the community's items in memory.
+// The scores follow the ladders in FraudGetEndorsements, FraudGetRatings and FraudGetPointQualities.
+
+const FRAUD_SCAN_WINDOW_DAYS = process.env.FRAUD_SCAN_WINDOW_DAYS ? parseInt(process.env.FRAUD_SCAN_WINDOW_DAYS) : 30;
+const FRAUD_SCAN_CURSOR_BATCH = process.env.FRAUD_SCAN_CURSOR_BATCH ? parseInt(process.env.FRAUD_SCAN_CURSOR_BATCH) : 500;
+
+// Deleted rows are left out like the default scopes do for the FraudGet* queries, so items
+// already removed by the FraudDelete* jobs are not counted again
+const POST_ITEMS_JOIN = `
+  JOIN posts ON posts.id = items.post_id AND posts.deleted = false
+  JOIN groups ON groups.id = posts.group_id AND groups.deleted = false`;
+
+const POINT_ITEMS_JOIN = `
+  JOIN points ON points.id = items.point_id AND points.deleted = false
+  JOIN posts ON posts.id = points.post_id AND posts.deleted = false
+  JOIN groups ON groups.id = posts.group_id AND groups.deleted = false`;
+
+const BY_USER_AGENT_LADDER = [[10, 95], [5, 90], [4, 85], [3, 80], [2, 75], [0, 70]];
+const BY_FINGERPRINT_PARENT_LADDER = [[10, 100], [5, 98], [4, 95], [3, 90], [2, 85], [0, 80]];
+const BY_FINGERPRINT_HIGH_LADDER = [[5, 99], [4, 95], [3, 90], [2, 85], [0, 80]];
+const BY_IP_HIGH_LADDER = [[100, 90], [50, 85], [25, 80], [10, 75], [5, 70], [2, 65], [0, 50]];
+
+const COLLECTIONS = {
+  endorsements: {
+    table: "endorsements",
+    parentColumn: "post_id",
+    join: POST_ITEMS_JOIN,
+    ladders: {
+      byIpUserAgentPostId: BY_USER_AGENT_LADDER,
+      byIpFingerprintPostId: BY_FINGERPRINT_PARENT_LADDER,
+      byIpFingerprint: [[5, 90], [4, 80], [3, 60], [2, 55], [0, 30]],
+      byIpAddress: [[100, 90], [50, 80], [25, 70], [10, 60], [5, 50], [2, 40], [0, 30]]
+    }
+  },
+  ratings: {
+    table: "ratings",
+    parentColumn: "post_id",
+    join: POST_ITEMS_JOIN,
+    perRatingType: true,
+    ladders: {
+      byIpUserAgentPostId: BY_USER_AGENT_LADDER,
+      byIpFingerprintPostId: BY_FINGERPRINT_PARENT_LADDER,
+      byIpFingerprint: BY_FINGERPRINT_HIGH_LADDER,
+      byIpAddress: BY_IP_HIGH_LADDER
+    }
+  },
+  pointQualities: {
+    table: "point_qualities",
+    parentColumn: "point_id",
+    join: POINT_ITEMS_JOIN,
+    ladders: {
+      byIpUserAgentPointId: BY_USER_AGENT_LADDER,
+      byIpFingerprintPointId: BY_FINGERPRINT_PARENT_LADDER,
+      byIpFingerprint: BY_FINGERPRINT_HIGH_LADDER,
+      byIpAddress: BY_IP_HIGH_LADDER
+    }
+  }
+};
+
+const FINGERPRINT = "items.data->>'browserFingerprint'";
+
+const HAS_FINGERPRINT = `${FINGERPRINT} IS NOT NULL AND ${FINGERPRINT} NOT IN ('', 'undefined')`;
+
+// The group keys of each method, perParent methods compare the cluster size to the number of posts or points
+const METHODS = {
+  byIpAddress: { keys: ["items.ip_address"], perParent: true },
+  byIpUserAgentPostId: { keys: ["items.ip_address", "items.post_id", "items.user_agent"] },
+  byIpUserAgentPointId: { keys: ["items.ip_address", "items.point_id", "items.user_agent"] },
+  byIpFingerprintPostId: { keys: ["items.ip_address", "items.post_id", FINGERPRINT], where: HAS_FINGERPRINT },
+  byIpFingerprintPointId: { keys: ["items.ip_address", "items.point_id", FINGERPRINT], where: HAS_FINGERPRINT },
+  byIpFingerprint: { keys: ["items.ip_address", FINGERPRINT], where: HAS_FINGERPRINT, perParent: true }
+};
+
+// Same score as FraudBase.getTimeDifferentScores with the average gap of a day being its timespan
+// divided by the gaps between its items, days with a single item score 50
+const TIME_SCORE_SQL = `
+  avg(CASE
+    WHEN day_count < 2 THEN 50
+    WHEN day_seconds / (day_count - 1) < 1 THEN 99
+    WHEN day_seconds / (day_count - 1) < 5 THEN 97
+    WHEN day_seconds / (day_count - 1) < 50 THEN 95
+    WHEN day_seconds / (day_count - 1) < 100 THEN 90
+    WHEN day_seconds / (day_count - 1) < 200 THEN 85
+    WHEN day_seconds / (day_count - 1) < 400 THEN 80
+    WHEN day_seconds / (day_count - 1) < 800 THEN 75
+    WHEN day_seconds / (day_count - 1) < 900 THEN 60
+    ELSE 50
+  END)`;
+
+const parseIds = (idsText) => {
+  return idsText ? idsText.split(",").map(id => parseInt(id)) : [];
+};
+
+class FraudClusterScanner {
+  constructor(communityId, collectionType, watermark) {
+    this.communityId = communityId;
+    this.collectionType = collectionType;
+    this.collection = COLLECTIONS[collectionType];
+    this.watermark = watermark || 0;
+    this.maxId = null;
+    this.ratingsCount = null;
+  }
+
+  getMethods() {
+    return Object.keys(this.collection.ladders).concat(["byMissingBrowserFingerprint"]);
+  }
+
+  getStartFingerprintMoment()  {
+    if (this.collectionType==="endorsements") {
+      return moment("16/02/2022","DD/MM/YYYY").toDate();
+    } else {
+      return moment("24/02/2022","DD/MM/YYYY").toDate();
+    }
+  }
+
+  // Items created after the scan started are left for the next scan
+  async setupMaxId() {
+    const [[{ max_id }]] = await models.sequelize.query(`SELECT max(id) AS max_id FROM ${this.collection.table}`);
+    this.maxId = max_id ? parseInt(max_id) : 0;
+    return this.maxId;
+  }
+
+  getReplacements() {
+    return {
+      communityId: this.communityId,
+      windowStart: moment().subtract(FRAUD_SCAN_WINDOW_DAYS, "days").toDate(),
+      watermark: this.watermark,
+      maxId: this.maxId,
+      fingerprintStart: this.getStartFingerprintMoment()
+    };
+  }
+
+  getItemsWhere(extraWhere) {
+    return `
+      FROM ${this.collection.table} AS items ${this.collection.join}
+      WHERE groups.community_id = :communityId
+        AND items.deleted = false
+        AND items.created_at >= :windowStart
+        AND items.id <= :maxId
+        ${extraWhere ? `AND ${extraWhere}` : ""}`;
+  }
+
+  // Number of rating types of the community's groups, FraudGetRatings divides cluster sizes by it
+  async getRatingsCount() {
+    if (this.ratingsCount === null) {
+      const [rows] = await models.sequelize.query(`
+        SELECT groups.configuration ${this.getItemsWhere()}
+        ORDER BY items.post_id ASC
+        LIMIT 1`,
+        { replacements: this.getReplacements() });
+      const configuration = rows.length > 0 ? rows[0].configuration : null;
+      this.ratingsCount = configuration && configuration.customRatings ? Object.keys(configuration.customRatings).length : 10000000;
+    }
+    return this.ratingsCount;
+  }
+
+  async getSizeDivider(method) {
+    let divider = 1;
+    if (METHODS[method].perParent) {
+      const [[{ parent_count }]] = await models.sequelize.query(`
+        SELECT count(DISTINCT items.${this.collection.parentColumn}) AS parent_count
+        ${this.getItemsWhere(METHODS[method].where)}`,
+        { replacements: this.getReplacements() });
+      divider = parseInt(parent_count);
+    }
+    if (this.collection.perRatingType) {
+      divider *= await this.getRatingsCount();
+    }
+    return divider;
+  }
+
+  // Yields the rows of the query through a server side cursor
+  async *queryCursor(sql, replacements) {
+    const transaction = await models.sequelize.transaction();
+    let committed = false;
+    try {
+      await models.sequelize.query(`DECLARE fraud_scan_cursor NO SCROLL CURSOR FOR ${sql}`, { replacements, transaction });
+      for (;;) {
+        const [rows] = await models.sequelize.query(`FETCH ${FRAUD_SCAN_CURSOR_BATCH} FROM fraud_scan_cursor`, { transaction });
+        if (rows.length === 0) {
+          break;
+        }
+        for (const row of rows) {
+          yield row;
+        }
+      }
+      await transaction.commit();
+      committed = true;
+    } finally {
+      if (!committed) {
+        await transaction.rollback();
+      }
+    }
+  }
+
+  /**
+   * Yields the clusters with new items that are larger than the method's threshold as
+   * { keys, count, timeScore, newItemIds, unfingerprintedItemIds }
+   */
+  async *getClusters(method) {
+    const keys = METHODS[method].keys;
+    const keyColumns = keys.map((key, index) => `${key} AS key_${index}`).join(", ");
+    const keyAliases = keys.map((key, index) => `key_${index}`).join(", ");
+    const replacements = Object.assign(this.getReplacements(), { minCount: await this.getSizeDivider(method) });
+
+    const sql = `
+      WITH days AS (
+        SELECT ${keyColumns},
+          count(*) AS day_count,
+          extract(epoch FROM max(items.created_at) - min(items.created_at)) AS day_seconds,
+          max(items.id) AS max_id,
+          string_agg(CAST(items.id AS TEXT), ',') FILTER (WHERE items.id > :watermark) AS new_ids,
+          string_agg(CAST(items.id AS TEXT), ',') FILTER (WHERE items.id > :watermark
+            AND CAST(items.data AS TEXT) = '{}' AND items.created_at > :fingerprintStart) AS unfingerprinted_ids
+        ${this.getItemsWhere(METHODS[method].where)}
+        GROUP BY ${keyAliases}, date_trunc('day', items.created_at)
+      )
+      SELECT ${keyAliases}, sum(day_count) AS count, ${TIME_SCORE_SQL} AS time_score,
+        string_agg(new_ids, ',') AS new_ids, string_agg(unfingerprinted_ids, ',') AS unfingerprinted_ids
+      FROM days
+      GROUP BY ${keyAliases}
+      HAVING max(max_id) > :watermark AND sum(day_count) > :minCount`;
+
+    for await (const row of this.queryCursor(sql, replacements)) {
+      yield {
+        keys: keys.map((key, index) => row[`key_${index}`]),
+        count: parseInt(row.count),
+        sizeRatio: parseInt(row.count) / replacements.minCount,
+        timeScore: parseFloat(row.time_score),
+        newItemIds: parseIds(row.new_ids),
+        unfingerprintedItemIds: parseIds(row.unfingerprinted_ids)
+      };
+    }
+  }
+
+  getLadderScore(method, sizeRatio) {
+    const ladder = this.collection.ladders[method];
+    for (let i=0;i<ladder.length;i++) {
+      if (sizeRatio > ladder[i][0]) {
+        return ladder[i][1];
+      }
+    }
+    return ladder[ladder.length-1][1];
+  }
+
+  // New items without a browser id, FraudBase.groupTopDataByNoFingerprints scores them 90-100%
+  async *getMissingBrowserIdItemIds() {
+    const sql = `
+      SELECT items.id ${this.getItemsWhere(`items.id > :watermark
+        AND items.data IS NOT NULL
+        AND coalesce(items.data->>'browserId', '') = ''
+        AND items.created_at > :fingerprintStart`)}`;
+    for await (const row of this.queryCursor(sql, this.getReplacements())) {
+      yield row.id;
+    }
+  }
+
+  /**
+   * Yields the ids of new items the method scores above minConfidence percent
+   */
+  async *getSuspiciousItemIds(method, minConfidence) {
+    if (method === "byMissingBrowserFingerprint") {
+      yield* this.getMissingBrowserIdItemIds();
+      return;
+    }
+    for await (const cluster of this.getClusters(method)) {
+      const confidence = parseInt(((cluster.timeScore + this.getLadderScore(method, cluster.sizeRatio)) / 2).toFixed(0));
+      const itemIds = confidence > minConfidence ? cluster.newItemIds : cluster.unfingerprintedItemIds;
+      for (let i=0;i<itemIds.length;i++) {
+        yield itemIds[i];
+      }
+    }
+  }
+}
+
+module.exports = FraudClusterScanner;
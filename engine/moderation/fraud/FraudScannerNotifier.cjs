@@ -1,11 +1,8 @@
 const _ = require("lodash");
 const models = require("../../../../models/index.cjs");
 const i18n = require('../../../utils/i18n.cjs');
-const deepEqual = require('deep-equal');
 
-const FraudGetEndorsements = require("./FraudGetEndorsements");
-const FraudGetPointQualities = require("./FraudGetPointQualities");
-const FraudGetRatings = require("./FraudGetRatings");
+const FraudClusterScanner = require("./FraudClusterScanner.cjs");
 const queue = require("../../../workers/queue.cjs");
 const Backend = require("i18next-fs-backend");
 const path = require("path");
@@ -17,7 +14,8 @@ class FraudScannerNotifier {
     this.currentCommunity = null;
     this.uniqueCollectionItemsIds = {};
     this.collectionsToScan = ['endorsements', 'ratings','pointQualities'];
-    this.scannerModels = [FraudGetEndorsements, FraudGetRatings, FraudGetPointQualities];
+    this.newWatermarks = {};
+    this.minConfidence = 75;
   }
 
   getCommunityURL () {
@@ -53,25 +51,6 @@ class FraudScannerNotifier {
     }
   }
 
-  setupCounts(items, collectionType) {
-    if (!this.uniqueCollectionItemsIds[collectionType]) {
-      this.uniqueCollectionItemsIds[collectionType]=[];
-    }
-
-    if (items) {
-      for (let i=0;i<items.length;i++)  {
-        if (this.uniqueCollectionItemsIds[collectionType].indexOf(items[i].id) === -1) {
-          const confidenceScore = parseInt(items[i].confidenceScore.replace("%",""));
-          if (confidenceScore>75) {
-            this.uniqueCollectionItemsIds[collectionType].push(items[i].id);
-          }
-        }
-      }
-    } else {
-      console.error(`No job data for ${collectionType}`);
-    }
-  }
-
   capitalizeFirstLetter(string) {
     return string.charAt(0).toUpperCase() + string.slice(1);
   }
@@ -132,95 +111,58 @@ class FraudScannerNotifier {
     }
   }
 
-  getContainerOldCount(collectionType) {
-    let foundCollection;
-
-    if (this.currentCommunity.data.lastFraudScanResults) {
-      for (let i=0;i<this.currentCommunity.data.lastFraudScanResults.length;i++) {
-        if (this.currentCommunity.data.lastFraudScanResults[i].collectionType &&
-            this.currentCommunity.data.lastFraudScanResults[i].collectionType===collectionType) {
-          foundCollection = this.currentCommunity.data.lastFraudScanResults[i];
-          break;
-        }
-      }
-    }
-
-    return foundCollection;
-  }
-
-  getWithDifference(results) {
-    const newResults = JSON.parse(JSON.stringify(results));
-
-    for (let i=0;i<newResults.length;i++) {
-      const oldResults = this.getContainerOldCount(newResults[i].collectionType);
-
-      if (oldResults) {
-        newResults[i].changeFromLastCount = newResults[i].count-oldResults.count;
-      }
-
+  getWatermarks() {
+    if (this.currentCommunity.data && this.currentCommunity.data.fraudScanWatermarks) {
+      return this.currentCommunity.data.fraudScanWatermarks;
+    } else {
+      return {};
     }
-
-    return newResults;
   }
 
-
+  // Reports the items flagged since the last scan and moves the watermarks past them
   async notify() {
     const fraudScanResults = [];
 
     for (let c=0;c<this.collectionsToScan.length;c++) {
-      const collectionLength = this.uniqueCollectionItemsIds[this.collectionsToScan[c]].length;
+      const collectionLength = this.uniqueCollectionItemsIds[this.collectionsToScan[c]].size;
       if (collectionLength>0) {
         fraudScanResults.push({ collectionType: this.capitalizeFirstLetter(this.collectionsToScan[c]), count: collectionLength});
       }
     }
 
     if (fraudScanResults.length>0) {
-      if (!this.currentCommunity.data ||
-          !this.currentCommunity.data.lastFraudScanResults ||
-          !deepEqual(this.currentCommunity.data.lastFraudScanResults, fraudScanResults)
-      ) {
-        await this.sendNotificationEmails(this.getWithDifference(fraudScanResults));
+      await this.sendNotificationEmails(fraudScanResults);
+    }
 
-        await this.currentCommunity.reload();
+    await this.currentCommunity.reload();
 
-        if (!this.currentCommunity.data) {
-          this.currentCommunity.data = {};
-        }
+    if (!this.currentCommunity.data) {
+      this.currentCommunity.data = {};
+    }
 
-        this.currentCommunity.data.lastFraudScanResults = fraudScanResults;
-        this.currentCommunity.changed('data', true);
-        await this.currentCommunity.save();
-      } else {
-        console.log("Not resending same numbers");
-      }
+    if (fraudScanResults.length>0) {
+      this.currentCommunity.data.lastFraudScanResults = fraudScanResults;
     }
+    this.currentCommunity.data.fraudScanWatermarks = this.newWatermarks;
+    this.currentCommunity.changed('data', true);
+    await this.currentCommunity.save();
   }
 
   async scan() {
-    for (let c=0;c<this.collectionsToScan.length;c++) {
-      let methodsToScan = ['byIpFingerprint','byMissingBrowserFingerprint','byIpAddress'];
+    const watermarks = this.getWatermarks();
+    this.newWatermarks = {};
 
-      if (this.collectionsToScan[c]==="pointQualities") {
-        methodsToScan = methodsToScan.concat(['byIpFingerprintPointId', 'byIpUserAgentPointId']);
-      } else {
-        methodsToScan = methodsToScan.concat(['byIpFingerprintPostId', 'byIpUserAgentPostId']);
-      }
+    for (let c=0;c<this.collectionsToScan.length;c++) {
+      const collectionType = this.collectionsToScan[c];
+      const scanner = new FraudClusterScanner(this.currentCommunity.id, collectionType, watermarks[collectionType]);
+      this.newWatermarks[collectionType] = await scanner.setupMaxId();
+      this.uniqueCollectionItemsIds[collectionType] = new Set();
 
+      const methodsToScan = scanner.getMethods();
       for (let m=0;m<methodsToScan.length;m++) {
-        let job = await models.AcBackgroundJob.createJobAsync({},{});
-        const workPackage = {
-          userId: -1,
-          communityId: this.currentCommunity.id,
-          jobId: job.id,
-          collectionType: this.collectionsToScan[c],
-          selectedMethod: methodsToScan[m]
+        for await (const itemId of scanner.getSuspiciousItemIds(methodsToScan[m], this.minConfidence)) {
+          this.uniqueCollectionItemsIds[collectionType].add(itemId);
         }
-
-        const scanner = new this.scannerModels[c](workPackage);
-        await scanner.processAndGetFraudItems();
-        job = await job.reload();
-        this.setupCounts(job.data.items, this.collectionsToScan[c]);
-        await job.destroy();
       }
     }
   }
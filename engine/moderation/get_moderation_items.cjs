@@ -5,6 +5,7 @@ const async = require('async');
 const moment = require('moment');
 const log = require('../../utils/logger.cjs');
 const _ = require('lodash');
+const getCachedModerationCount = require('./moderation_counts.cjs').getCachedModerationCount;
 
 const domainIncludes = (domainId) => {
   return [
@@ -214,23 +215,27 @@ const getItems = (posts, points, options) => {
   return items;
 };
 
+const moderationWhere = (options) => {
+  return {
+    deleted: false,
+    $or: [
+      {
+        counter_flags: {
+          $gt: options.allContent ? -1 : 0
+        },
+      },
+      {
+        status: "in_moderation_queue"
+      }
+    ],
+  };
+};
+
 const getModelModeration = (options, callback) => {
   options.model.unscoped().findAll({
-    where: {
-      deleted: false,
-      $or: [
-        {
-          counter_flags: {
-            $gt: options.allContent ? -1 : 0
-          },
-        },
-        {
-          status: "in_moderation_queue"
-        }
-      ],
-    },
-    //TODO: Have paging here at some point
-    limit: 7500,
+    where: options.where || moderationWhere(options),
+    // The paged feed loads the items of one page by id
+    limit: options.where ? undefined : 7500,
     order: options.order,
     include: options.includes,
     attributes: options.attributes
@@ -243,19 +248,7 @@ const getModelModeration = (options, callback) => {
 
 const countModelModeration = (options, callback) => {
   options.model.unscoped().count({
-    where: {
-      deleted: false,
-      $or: [
-        {
-          counter_flags: {
-            $gt: options.allContent ? -1 : 0
-          },
-        },
-        {
-          status: "in_moderation_queue"
-        }
-      ],
-    },
+    where: moderationWhere(options),
     include: options.includes
   }).then(count => {
     callback(null, count);
@@ -264,43 +257,79 @@ const countModelModeration = (options, callback) => {
   })
 };
 
-const getAllModeratedItemsByMaster = (options, callback) => {
-  let posts, points;
+const postAttributes = ['id','created_at','counter_flags','language','data','name','cover_media_type','description','status','public_data','user_id'];
 
-  const postBaseIncludes = _.cloneDeep(options.includes);
-  const pointBaseIncludes = _.cloneDeep(options.includes);
+const pointAttributes = ['id','created_at','counter_flags','name','language','data','post_id','status','public_data','user_id'];
 
-  async.series([
-    parallelCallback => {
-      let postIncludes = postBaseIncludes.concat([
-        {
-          model: models.Image,
-          required: false,
-          as: 'PostHeaderImages',
-          attributes:["formats",'updated_at']
-        },
-        {
-          model: models.Audio,
-          required: false,
-          attributes: ['id','formats','updated_at','listenable','public_meta','meta'],
-          as: 'PostAudios',
-        }
-      ]);
+const getPostIncludes = (options) => {
+  let postIncludes = _.cloneDeep(options.includes).concat([
+    {
+      model: models.Image,
+      required: false,
+      as: 'PostHeaderImages',
+      attributes:["formats",'updated_at']
+    },
+    {
+      model: models.Audio,
+      required: false,
+      attributes: ['id','formats','updated_at','listenable','public_meta','meta'],
+      as: 'PostAudios',
+    }
+  ]);
 
-      if (!options.userId) {
-        postIncludes = postIncludes.concat([ { model: models.User, attributes: models.User.defaultAttributesWithSocialMediaPublicAndEmail }]);
-      } else {
-        postIncludes = postIncludes.concat([ { model: models.Group, attributes: ['id','name','configuration'] }]);
-      }
+  if (!options.userId) {
+    postIncludes = postIncludes.concat([ { model: models.User, attributes: models.User.defaultAttributesWithSocialMediaPublicAndEmail }]);
+  } else {
+    postIncludes = postIncludes.concat([ { model: models.Group, attributes: ['id','name','configuration'] }]);
+  }
+
+  return postIncludes;
+};
+
+const getPostOrder = () => {
+  return [
+    [ { model: models.Image, as: 'PostHeaderImages' } ,'updated_at', 'asc' ],
+    [ { model: models.Audio, as: "PostAudios" }, 'updated_at', 'desc' ],
+  ];
+};
+
+const getPointIncludes = (options) => {
+  let pointIncludes = _.cloneDeep(options.includes).concat([
+    {
+      model: models.Audio,
+      required: false,
+      attributes: ['id','formats','updated_at','listenable','public_meta','meta'],
+      as: 'PointAudios'
+    },
+    {
+      model: models.PointRevision,
+      attributes: ['id','content'],
+      required: false
+    }
+  ]);
+
+  if (!options.userId) {
+    pointIncludes = pointIncludes.concat([ { model: models.User, attributes: models.User.defaultAttributesWithSocialMediaPublicAndEmail }]);
+  } else {
+    pointIncludes = pointIncludes.concat([ { model: models.Group, required: false, attributes: ['id','name','configuration'] }]);
+  }
+
+  return pointIncludes;
+};
 
-      const order = [
-        [ { model: models.Image, as: 'PostHeaderImages' } ,'updated_at', 'asc' ],
-        [ { model: models.Audio, as: "PostAudios" }, 'updated_at', 'desc' ],
-      ];
+const getPointOrder = () => {
+  return [
+    [ { model: models.Audio, as: "PointAudios" }, 'updated_at', 'desc' ],
+    [ models.PointRevision, 'created_at', 'asc' ],
+  ];
+};
 
-      const attributes = ['id','created_at','counter_flags','language','data','name','cover_media_type','description','status','public_data','user_id'];
+const getAllModeratedItemsByMaster = (options, callback) => {
+  let posts, points;
 
-      getModelModeration(_.merge(_.cloneDeep(options), {model: models.Post, includes: postIncludes, order, attributes }), (error, postsIn) => {
+  async.series([
+    parallelCallback => {
+      getModelModeration(_.merge(_.cloneDeep(options), {model: models.Post, includes: getPostIncludes(options), order: getPostOrder(), attributes: postAttributes }), (error, postsIn) => {
         if (error) {
           parallelCallback(error);
         } else {
@@ -310,45 +339,225 @@ const getAllModeratedItemsByMaster = (options, callback) => {
       })
     },
     parallelCallback => {
-      let pointIncludes = pointBaseIncludes.concat([
+      getModelModeration(_.merge(_.cloneDeep(options), {model: models.Point, attributes: pointAttributes, includes: getPointIncludes(options), order: getPointOrder() }), (error, pointsIn) => {
+        points = pointsIn;
+        models.Point.setVideosForPoints(points, parallelCallback);
+      })
+    }
+  ], error => {
+    log.info("get_moderation_items got items from database");
+    callback(error, getItems(posts, points, options));
+  });
+};
+
+// Paged moderation feed
+//
+// Pages are read with a keyset cursor over (status, counter_flags, created_at, id) in the same
+// order as getItems, or over (created_at, id) for all content. Only the sort columns of the next
+// page are read from posts and points, merged, and then the items of that page are loaded with
+// their includes.
+
+const DEFAULT_PAGE_SIZE = 50;
+const MAX_PAGE_SIZE = 500;
+
+// Filters by the scope without loading the scope models
+const getPageScope = (options) => {
+  if (options.userId) {
+    return { where: { user_id: options.userId }, include: [] };
+  } else if (options.groupId) {
+    return { where: { group_id: options.groupId }, include: [] };
+  } else if (options.communityId) {
+    return {
+      where: {},
+      include: [
         {
-          model: models.Audio,
-          required: false,
-          attributes: ['id','formats','updated_at','listenable','public_meta','meta'],
-          as: 'PointAudios'
-        },
+          model: models.Group,
+          required: true,
+          attributes: [],
+          where: {
+            community_id: options.communityId
+          }
+        }
+      ]
+    };
+  } else {
+    return {
+      where: {},
+      include: [
         {
-          model: models.PointRevision,
-          attributes: ['id','content'],
-          required: false
+          model: models.Group,
+          required: true,
+          attributes: [],
+          include: [
+            {
+              model: models.Community,
+              required: true,
+              attributes: [],
+              where: {
+                domain_id: options.domainId
+              }
+            }
+          ]
         }
-      ]);
+      ]
+    };
+  }
+};
 
-      if (!options.userId) {
-        pointIncludes = pointIncludes.concat([ { model: models.User, attributes: models.User.defaultAttributesWithSocialMediaPublicAndEmail }]);
-      } else {
-        pointIncludes = pointIncludes.concat([ { model: models.Group, required: false, attributes: ['id','name','configuration'] }]);
-      }
+const encodeCursor = (item) => {
+  return Buffer.from(JSON.stringify({
+    status: item.status,
+    counter_flags: item.counter_flags,
+    created_at: item.created_at,
+    id: item.id,
+    type: item.type
+  })).toString('base64');
+};
 
-      const order = [
-        [ { model: models.Audio, as: "PointAudios" }, 'updated_at', 'desc' ],
-        [ models.PointRevision, 'created_at', 'asc' ],
-      ];
+const decodeCursor = (cursor) => {
+  return cursor ? JSON.parse(Buffer.from(cursor, 'base64').toString()) : null;
+};
 
-      const attributes = ['id','created_at','counter_flags','name','language','data','post_id','status','public_data','user_id'];
+// Posts sort before points with the same sort values and id
+const compareTypes = (a, b) => {
+  return a.type === b.type ? 0 : (a.type === 'post' ? -1 : 1);
+};
 
-      getModelModeration(_.merge(_.cloneDeep(options), {model: models.Point, attributes, includes: pointIncludes, order }), (error, pointsIn) => {
-        points = pointsIn;
-        models.Point.setVideosForPoints(points, parallelCallback);
-      })
+const comparePageItems = (allContent) => {
+  return (a, b) => {
+    if (!allContent && a.status !== b.status) {
+      return a.status < b.status ? -1 : 1;
+    } else if (!allContent && a.counter_flags !== b.counter_flags) {
+      return b.counter_flags - a.counter_flags;
+    } else if (new Date(a.created_at).getTime() !== new Date(b.created_at).getTime()) {
+      return new Date(b.created_at).getTime() - new Date(a.created_at).getTime();
+    } else if (a.id !== b.id) {
+      return b.id - a.id;
+    } else {
+      return compareTypes(a, b);
     }
-  ], error => {
-    log.info("get_moderation_items got items from database");
-    callback(error, getItems(posts, points, options));
+  };
+};
+
+// Rows of the model that come after the cursor in page order
+const afterCursorWhere = (cursor, itemType, allContent) => {
+  const createdAt = new Date(cursor.created_at);
+  const sameId = itemType === 'point' && cursor.type === 'post' ? { id: { $lte: cursor.id } } : { id: { $lt: cursor.id } };
+  const afterCreatedAt = {
+    $or: [
+      { created_at: { $lt: createdAt } },
+      Object.assign({ created_at: createdAt }, sameId)
+    ]
+  };
+  if (allContent) {
+    return afterCreatedAt;
+  } else {
+    return {
+      $or: [
+        { status: { $gt: cursor.status } },
+        { status: cursor.status, counter_flags: { $lt: cursor.counter_flags } },
+        Object.assign({ status: cursor.status, counter_flags: cursor.counter_flags }, afterCreatedAt)
+      ]
+    };
+  }
+};
+
+const getModelPageKeys = (model, itemType, options, cursor, limit) => {
+  const scope = getPageScope(options);
+  const moderation = moderationWhere(options);
+  return model.unscoped().findAll({
+    where: Object.assign({
+      deleted: false,
+      $and: _.compact([
+        { $or: moderation.$or },
+        cursor ? afterCursorWhere(cursor, itemType, options.allContent) : null
+      ])
+    }, scope.where),
+    include: scope.include,
+    attributes: ['id', 'status', 'counter_flags', 'created_at'],
+    order: options.allContent ?
+      [['created_at', 'DESC'], ['id', 'DESC']] :
+      [['status', 'ASC'], ['counter_flags', 'DESC'], ['created_at', 'DESC'], ['id', 'DESC']],
+    limit,
+    raw: true
+  }).then(rows => {
+    return rows.map(row => Object.assign({ type: itemType }, row));
   });
 };
 
-const countAllModeratedItemsByMaster = (options, callback) => {
+const loadPageModels = (options, model, ids, includes, order, attributes, setVideos, callback) => {
+  if (ids.length === 0) {
+    callback(null, []);
+  } else {
+    getModelModeration(_.merge(_.cloneDeep(options), { model, includes, order, attributes, where: { id: { $in: ids } } }), (error, items) => {
+      if (error) {
+        callback(error);
+      } else {
+        setVideos(items, (error) => {
+          callback(error, items);
+        });
+      }
+    });
+  }
+};
+
+/**
+ * Returns { items, nextCursor } for one page of the moderation feed, options.cursor is the
+ * nextCursor of the previous page and options.limit the page size
+ */
+const getModeratedItemsPageByMaster = (options, callback) => {
+  const limit = Math.min(parseInt(options.limit) || DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE);
+  let cursor;
+  try {
+    cursor = decodeCursor(options.cursor);
+  } catch (error) {
+    callback("Invalid moderation cursor");
+    return;
+  }
+
+  Promise.all([
+    getModelPageKeys(models.Post, 'post', options, cursor, limit + 1),
+    getModelPageKeys(models.Point, 'point', options, cursor, limit + 1)
+  ]).then(([postKeys, pointKeys]) => {
+    const pageKeys = postKeys.concat(pointKeys).sort(comparePageItems(options.allContent));
+    const hasMore = pageKeys.length > limit;
+    const page = pageKeys.slice(0, limit);
+    let posts, points;
+
+    async.parallel([
+      parallelCallback => {
+        loadPageModels(options, models.Post, page.filter(key => key.type === 'post').map(key => key.id),
+          getPostIncludes(options), getPostOrder(), postAttributes, models.Post.setVideosForPosts, (error, items) => {
+            posts = items;
+            parallelCallback(error);
+          });
+      },
+      parallelCallback => {
+        loadPageModels(options, models.Point, page.filter(key => key.type === 'point').map(key => key.id),
+          getPointIncludes(options), getPointOrder(), pointAttributes, models.Point.setVideosForPoints, (error, items) => {
+            points = items;
+            parallelCallback(error);
+          });
+      }
+    ], error => {
+      if (error) {
+        callback(error);
+      } else {
+        const itemsByKey = new Map();
+        posts.forEach(post => itemsByKey.set(`post-${post.id}`, getPushItem('post', post)));
+        points.forEach(point => itemsByKey.set(`point-${point.id}`, getPushItem('point', point)));
+        callback(null, {
+          items: _.compact(page.map(key => itemsByKey.get(`${key.type}-${key.id}`))),
+          nextCursor: hasMore ? encodeCursor(_.last(page)) : null
+        });
+      }
+    });
+  }).catch(error => {
+    callback(error);
+  });
+};
+
+const countAllModeratedItemsInDatabase = (options, callback) => {
   let totalCount = 0;
 
   async.series([
@@ -379,6 +588,12 @@ const countAllModeratedItemsByMaster = (options, callback) => {
   });
 };
 
+const countAllModeratedItemsByMaster = (options, callback) => {
+  getCachedModerationCount(options, (countCallback) => {
+    countAllModeratedItemsInDatabase(options, countCallback);
+  }, callback);
+};
+
 const getAllModeratedItemsByDomain = (options, callback) => {
   getAllModeratedItemsByMaster(_.merge(options, {includes: domainIncludes(options.domainId) }), callback);
 };
@@ -395,6 +610,22 @@ const getAllModeratedItemsByUser = (options, callback) => {
   getAllModeratedItemsByMaster(_.merge(options, {includes: userIncludes(options.userId) }), callback);
 };
 
+const getModeratedItemsPageByDomain = (options, callback) => {
+  getModeratedItemsPageByMaster(_.merge(options, {includes: domainIncludes(options.domainId) }), callback);
+};
+
+const getModeratedItemsPageByCommunity = (options, callback) => {
+  getModeratedItemsPageByMaster(_.merge(options, {includes: communityIncludes(options.communityId) }), callback);
+};
+
+const getModeratedItemsPageByGroup = (options, callback) => {
+  getModeratedItemsPageByMaster(_.merge(options, {includes: groupIncludes(options.groupId) }), callback);
+};
+
+const getModeratedItemsPageByUser = (options, callback) => {
+  getModeratedItemsPageByMaster(_.merge(options, {includes: userIncludes(options.userId) }), callback);
+};
+
 const countAllModeratedItemsByDomain = (options, callback) => {
   countAllModeratedItemsByMaster(_.merge(options, {includes: domainIncludes(options.domainId) }), callback);
 };
@@ -420,6 +651,10 @@ module.exports = {
   getAllModeratedItemsByUser,
   getAllModeratedItemsByCommunity,
   getAllModeratedItemsByGroup,
+  getModeratedItemsPageByDomain,
+  getModeratedItemsPageByCommunity,
+  getModeratedItemsPageByGroup,
+  getModeratedItemsPageByUser,
   countAllModeratedItemsByDomain,
   countAllModeratedItemsByCommunity,
   countAllModeratedItemsByGroup,
@@ -35,8 +35,10 @@ class CommunityLabeling extends ImageLabelingBase {
   async reviewImagesFromCollection() {
     return await new Promise(async (resolve, reject) => {
       try {
-        await this.reviewAndLabelImages(this.collection.CommunityLogoImages);
-        await this.reviewAndLabelImages(this.collection.CommunityHeaderImages);
+        await this.reviewAndLabelImages([
+          ...this.collection.CommunityLogoImages,
+          ...this.collection.CommunityHeaderImages,
+        ]);
         await this.reviewAndLabelVideos(
           models.Community,
           this.collection.id,
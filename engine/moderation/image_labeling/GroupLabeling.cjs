@@ -51,11 +51,14 @@ class GroupLabeling extends ImageLabelingBase {
   async reviewImagesFromCollection() {
     return await new Promise(async (resolve, reject) => {
       try {
-        await this.reviewAndLabelImages(this.collection.GroupLogoImages);
-        await this.reviewAndLabelImages(this.collection.GroupHeaderImages);
+        let images = [
+          ...this.collection.GroupLogoImages,
+          ...this.collection.GroupHeaderImages,
+        ];
         for (let category of this.collection.Categories) {
-          await this.reviewAndLabelImages(category.CategoryIconImages);
+          images = images.concat(category.CategoryIconImages);
         }
+        await this.reviewAndLabelImages(images);
         await this.reviewAndLabelVideos(
           models.Group,
           this.collection.id,
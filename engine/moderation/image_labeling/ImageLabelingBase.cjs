@@ -1,8 +1,50 @@
 const vision = require('@google-cloud/vision');
+const axios = require('axios');
 const models = require("../../../../models/index.cjs");
-var downloadFile = require('download-file');
-const fs = require("fs");
 const log = require('../../../utils/logger.cjs');
+const imageReviewCache = require('./image_review_cache.cjs');
+
+// Images are downloaded into memory and labeled IMAGE_LABELING_CONCURRENCY at a time, the results
+// are then written to the collection with one save. Vision results are cached by perceptual hash
+// in image_review_cache.cjs so reused and near duplicate images are not sent to Vision again.
+
+const IMAGE_LABELING_CONCURRENCY = process.env.IMAGE_LABELING_CONCURRENCY ? parseInt(process.env.IMAGE_LABELING_CONCURRENCY) : 4;
+const MAX_IMAGE_DOWNLOAD_BYTES = process.env.MAX_IMAGE_LABELING_DOWNLOAD_BYTES ? parseInt(process.env.MAX_IMAGE_LABELING_DOWNLOAD_BYTES) : 20 * 1024 * 1024;
+const IMAGE_DOWNLOAD_TIMEOUT_MS = 30 * 1000;
+
+let visionClient = null;
+
+// One client per process, it keeps its gRPC channel open between jobs
+const getVisionClient = () => {
+  if (!visionClient) {
+    visionClient = new vision.ImageAnnotatorClient({
+      credentials: JSON.parse(process.env.GOOGLE_APPLICATION_CREDENTIALS_JSON),
+      projectId: process.env.GOOGLE_TRANSLATE_PROJECT_ID
+        ? process.env.GOOGLE_TRANSLATE_PROJECT_ID
+        : undefined,
+    });
+  }
+  return visionClient;
+};
+
+// Like Promise.all over items.map(fn) with at most limit calls running
+const mapLimit = async (items, limit, fn) => {
+  const results = [];
+  let nextIndex = 0;
+  const workers = [...Array(Math.min(limit, items.length)).keys()].map(async () => {
+    while (nextIndex < items.length) {
+      const index = nextIndex++;
+      results[index] = await fn(items[index]);
+    }
+  });
+  await Promise.all(workers);
+  return results;
+};
+
+const getLargestImageUrl = (image) => {
+  const imageFormat = JSON.parse(image.formats);
+  return imageFormat[imageFormat.length - 1];
+};
 
 class ImageLabelingBase {
   constructor(workPackage) {
@@ -10,86 +52,135 @@ class ImageLabelingBase {
     this.collection = null;
     this.reportContent = false;
     this.reportContentWithNotification = false;
-    this.visionClient = new vision.ImageAnnotatorClient({
-      credentials: JSON.parse(process.env.GOOGLE_APPLICATION_CREDENTIALS_JSON),
-      projectId: process.env.GOOGLE_TRANSLATE_PROJECT_ID
-        ? process.env.GOOGLE_TRANSLATE_PROJECT_ID
-        : undefined,
-    });
     this.visionRequesBase = {
       features: [
         { type: "LABEL_DETECTION" },
         { type: "SAFE_SEARCH_DETECTION" },
       ],
-      image: { source: { imageUri: undefined } },
     };
+    this.timings = {};
+    this.counts = { images: 0, cacheHits: 0, visionCalls: 0 };
+    this.reviewsByHash = new Map();
   }
 
-  async reviewAndLabelUrl(imageUrl, mediaType, mediaId) {
-    return await new Promise(async (resolve, reject) => {
-      try {
-        const splitUrl = imageUrl.split('/');
-        const fileName =  splitUrl[splitUrl.length-1];
-        const fileNameWithPath = '/tmp/'+fileName;
-        downloadFile(imageUrl, { filename: fileName, directory: '/tmp/'}, async (error) => {
-          if (error) {
-            fs.unlink(fileNameWithPath, unlinkError => {
-              reject('Could not download file');
-              return;
-            })
-          } else {
-            const [result] = await this.visionClient.annotateImage({
-              ...this.visionRequesBase,
-                image: { source: { filename: fileNameWithPath } }
-            });
+  // Runs fn and adds its duration to the stage, stages run in parallel add up
+  async timeStage(stage, fn) {
+    const startedAt = Date.now();
+    try {
+      return await fn();
+    } finally {
+      this.timings[stage] = (this.timings[stage] || 0) + (Date.now() - startedAt);
+    }
+  }
 
-            try {
-              fs.unlink(fileNameWithPath, async (unlinkError) => {
-                if (unlinkError)
-                  log.error(unlinkError);
-                if (result.error) {
-                  reject(result.error.message);
-                } else {
-                  const imageLabels = { ...result.labelAnnotations, mediaType, mediaId };
-                  const imageReviews = {
-                    ...result.safeSearchAnnotation,
-                    mediaType,
-                    mediaId,
-                  };
-                  log.info(`Image Labels: ${imageReviews ? JSON.stringify(imageReviews) : ''}`);
-                  await this.collection.reload();
-                  if (!this.collection.data) {
-                    this.collection.set("data", {});
-                  }
-                  if (!this.collection.data.labels) {
-                    this.collection.set("data.labels", {});
-                  }
-                  if (!this.collection.data.moderation) {
-                    this.collection.set("data.moderation", {});
-                  }
-                  if (!this.collection.data.moderation.imageReviews) {
-                    this.collection.set("data.moderation.imageReviews", []);
-                  }
-                  if (!this.collection.data.labels.images) {
-                    this.collection.set("data.labels.images", []);
-                  }
-                  this.collection.data.moderation.imageReviews.push(imageReviews);
-                  this.collection.data.labels.images.push(imageLabels);
-                  this.collection.changed("data", true);
-                  await this.collection.save();
-                  await this.evaluteImageReviews(imageReviews);
-                  resolve({ imageLabels, imageReviews });
-                }
-              });
-            } catch (error) {
-              reject(error);
-            }
-          }
-        });
-      } catch (error) {
-        reject(error);
+  async downloadImage(imageUrl) {
+    try {
+      const response = await axios.get(imageUrl, {
+        responseType: 'arraybuffer',
+        timeout: IMAGE_DOWNLOAD_TIMEOUT_MS,
+        maxContentLength: MAX_IMAGE_DOWNLOAD_BYTES,
+      });
+      return Buffer.from(response.data);
+    } catch (error) {
+      log.error("Could not download image", { imageUrl, err: error.message });
+      throw 'Could not download file';
+    }
+  }
+
+  // Returns the labels and safe search annotation of the image, from the cache when possible
+  async labelImageUrl(imageUrl) {
+    const imageBuffer = await this.timeStage("download", () => this.downloadImage(imageUrl));
+    const imageHash = await this.timeStage("hash", () => imageReviewCache.computeImageHash(imageBuffer));
+    this.counts.images += 1;
+
+    // The same image used twice in the collection is only reviewed once
+    if (imageHash && this.reviewsByHash.has(imageHash)) {
+      this.counts.cacheHits += 1;
+      return await this.reviewsByHash.get(imageHash);
+    }
+    const review = this.reviewImageBuffer(imageBuffer, imageHash);
+    if (imageHash) {
+      this.reviewsByHash.set(imageHash, review);
+    }
+    return await review;
+  }
+
+  async reviewImageBuffer(imageBuffer, imageHash) {
+    const cached = await this.timeStage("cache", () => imageReviewCache.getCachedReview(imageHash));
+    if (cached) {
+      this.counts.cacheHits += 1;
+      return cached;
+    }
+
+    this.counts.visionCalls += 1;
+    const [result] = await this.timeStage("vision", () => getVisionClient().annotateImage({
+      ...this.visionRequesBase,
+      image: { content: imageBuffer }
+    }));
+    if (result.error) {
+      throw result.error.message;
+    }
+    const review = {
+      labelAnnotations: result.labelAnnotations,
+      safeSearchAnnotation: result.safeSearchAnnotation,
+    };
+    await this.timeStage("cache", () => imageReviewCache.setCachedReview(imageHash, review));
+    return review;
+  }
+
+  // Labels the images with a bounded worker pool, media is a list of { imageUrl, mediaType, mediaId }
+  async labelMedia(media) {
+    return await mapLimit(media, IMAGE_LABELING_CONCURRENCY, async ({ imageUrl, mediaType, mediaId }) => {
+      const review = await this.labelImageUrl(imageUrl);
+      const imageLabels = { ...review.labelAnnotations, mediaType, mediaId };
+      const imageReviews = {
+        ...review.safeSearchAnnotation,
+        mediaType,
+        mediaId,
+      };
+      log.info(`Image Labels: ${imageReviews ? JSON.stringify(imageReviews) : ''}`);
+      return { imageLabels, imageReviews };
+    });
+  }
+
+  // Adds the results to the collection with one save and evaluates them for reporting
+  async saveLabelResults(results) {
+    if (results.length === 0) {
+      return;
+    }
+    await this.timeStage("save", async () => {
+      await this.collection.reload();
+      if (!this.collection.data) {
+        this.collection.set("data", {});
+      }
+      if (!this.collection.data.labels) {
+        this.collection.set("data.labels", {});
+      }
+      if (!this.collection.data.moderation) {
+        this.collection.set("data.moderation", {});
+      }
+      if (!this.collection.data.moderation.imageReviews) {
+        this.collection.set("data.moderation.imageReviews", []);
+      }
+      if (!this.collection.data.labels.images) {
+        this.collection.set("data.labels.images", []);
       }
+      for (let { imageLabels, imageReviews } of results) {
+        this.collection.data.moderation.imageReviews.push(imageReviews);
+        this.collection.data.labels.images.push(imageLabels);
+      }
+      this.collection.changed("data", true);
+      await this.collection.save();
     });
+    for (let { imageReviews } of results) {
+      await this.evaluteImageReviews(imageReviews);
+    }
+  }
+
+  async reviewAndLabelUrl(imageUrl, mediaType, mediaId) {
+    const [result] = await this.labelMedia([{ imageUrl, mediaType, mediaId }]);
+    await this.saveLabelResults([result]);
+    return result;
   }
 
   async reportImageToModerators(options) {
@@ -138,23 +229,15 @@ class ImageLabelingBase {
   }
 
   async reviewAndLabelImages(images) {
-    return await new Promise(async (resolve, reject) => {
-      try {
-        for (let image of images) {
-          if (!this.hasImageIdBeenReviewed(image.id)) {
-            const imageFormat = JSON.parse(image.formats);
-            await this.reviewAndLabelUrl(
-              imageFormat[imageFormat.length - 1],
-              "Image",
-              image.id
-            );
-          }
-        }
-        resolve();
-      } catch (error) {
-        reject(error);
+    const seenImageIds = new Set();
+    const media = [];
+    for (let image of images) {
+      if (!this.hasImageIdBeenReviewed(image.id) && !seenImageIds.has(image.id)) {
+        seenImageIds.add(image.id);
+        media.push({ imageUrl: getLargestImageUrl(image), mediaType: "Image", mediaId: image.id });
       }
-    });
+    }
+    await this.saveLabelResults(await this.labelMedia(media));
   }
 
   async reviewAndLabelVideos(
@@ -225,25 +308,25 @@ class ImageLabelingBase {
                   Math.floor(Math.random() * video.VideoImages.length)
                 ]
               );
-              for (let image of searchImages) {
-                const imageFormat = JSON.parse(image.formats);
-                const { imageLabels, imageReviews } =
-                await this.reviewAndLabelUrl(
-                  imageFormat[imageFormat.length - 1],
-                    "Video",
-                    image.id
-                  );
-                if (!video.meta) {
-                  video.set("meta", {});
-                }
-                if (!video.meta.moderation) {
-                  video.set("meta.moderation", {});
-                }
-                video.set("meta.moderation.imageReviews", imageReviews);
-                video.set("meta.imageLabels", imageLabels);
-                video.changed("meta", true);
-                await video.save();
+              const results = await this.labelMedia(
+                searchImages.map((image) => ({
+                  imageUrl: getLargestImageUrl(image),
+                  mediaType: "Video",
+                  mediaId: image.id,
+                }))
+              );
+              await this.saveLabelResults(results);
+              const { imageLabels, imageReviews } = results[results.length - 1];
+              if (!video.meta) {
+                video.set("meta", {});
               }
+              if (!video.meta.moderation) {
+                video.set("meta.moderation", {});
+              }
+              video.set("meta.moderation.imageReviews", imageReviews);
+              video.set("meta.imageLabels", imageLabels);
+              video.changed("meta", true);
+              await this.timeStage("save", () => video.save());
             }
           }
         }
@@ -305,9 +388,17 @@ class ImageLabelingBase {
     return await new Promise(async (resolve, reject) => {
       try {
         if (process.env.GOOGLE_APPLICATION_CREDENTIALS_JSON) {
-          await this.getCollection();
+          const startedAt = Date.now();
+          await this.timeStage("load", () => this.getCollection());
           await this.reviewImagesFromCollection();
-          await this.reportContentIfNeeded();
+          await this.timeStage("report", () => this.reportContentIfNeeded());
+          log.info("Image labeling timings", {
+            labeling: this.constructor.name,
+            collectionId: this.collection ? this.collection.id : null,
+            totalMs: Date.now() - startedAt,
+            stagesMs: this.timings,
+            ...this.counts,
+          });
         }
         resolve();
       } catch (error) {
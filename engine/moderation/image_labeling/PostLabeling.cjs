@@ -41,9 +41,11 @@ class PostLabeling extends ImageLabelingBase {
   async reviewImagesFromCollection() {
     return await new Promise(async (resolve, reject) => {
       try {
-        await this.reviewAndLabelImages(this.collection.PostImages);
-        await this.reviewAndLabelImages(this.collection.PostHeaderImages);
-        await this.reviewAndLabelImages(this.collection.PostUserImages);
+        await this.reviewAndLabelImages([
+          ...this.collection.PostImages,
+          ...this.collection.PostHeaderImages,
+          ...this.collection.PostUserImages,
+        ]);
         await this.reviewAndLabelVideos(
           models.Post,
           this.collection.id,
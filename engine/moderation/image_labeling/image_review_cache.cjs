@@ -0,0 +1,128 @@
+const log = require("../../../utils/logger.cjs");
+const getRedisCommands = require("../../../utils/redis_commands.cjs");
+
+// Vision API results cached by a perceptual hash of the image, so the same logo or header image
+// used in many groups, or a re-encoded or resized copy of it, is only sent to Vision once.
+//
+// The hash is a 64 bit difference hash (dHash). Images whose hashes differ in at most
+// MAX_HASH_DISTANCE bits count as the same image. To find them without scanning every hash, each
+// hash is also indexed under its four 16 bit bands; two hashes that differ in at most 3 bits
+// always share at least one band.
+//
+// Hashing needs the optional sharp package, without it images are labeled without the cache.
+
+const MAX_HASH_DISTANCE = process.env.IMAGE_REVIEW_MAX_HASH_DISTANCE ? parseInt(process.env.IMAGE_REVIEW_MAX_HASH_DISTANCE) : 3;
+const CACHE_TTL = process.env.IMAGE_REVIEW_CACHE_TTL_SECONDS ? parseInt(process.env.IMAGE_REVIEW_CACHE_TTL_SECONDS) : 60 * 60 * 24 * 90;
+const NUMBER_OF_BANDS = 4;
+
+let sharp;
+
+const getSharp = () => {
+  if (sharp === undefined) {
+    try {
+      sharp = require("sharp");
+    } catch (error) {
+      sharp = null;
+      log.warn("sharp is not installed, image reviews are not cached", { err: error.message });
+    }
+  }
+  return sharp;
+};
+
+const resultKey = (hash) => `cache:imagereview:${hash}`;
+
+const bandKey = (index, hash) => `cache:imagereview:band:${index}:${hash.substr(index * 4, 4)}`;
+
+/**
+ * Returns the dHash of the image as 16 hex characters, or null without sharp and for formats
+ * sharp can not read
+ */
+const computeImageHash = async (imageBuffer) => {
+  if (!getSharp()) {
+    return null;
+  }
+  let pixels;
+  try {
+    pixels = await sharp(imageBuffer).grayscale().resize(9, 8, { fit: "fill" }).raw().toBuffer();
+  } catch (error) {
+    log.warn("Could not hash image", { err: error.message });
+    return null;
+  }
+  let hash = "";
+  for (let row = 0; row < 8; row++) {
+    let rowBits = 0;
+    for (let column = 0; column < 8; column++) {
+      rowBits = (rowBits << 1) | (pixels[row * 9 + column] < pixels[row * 9 + column + 1] ? 1 : 0);
+    }
+    hash += rowBits.toString(16).padStart(2, "0");
+  }
+  return hash;
+};
+
+const hammingDistance = (hashA, hashB) => {
+  let distance = 0;
+  for (let i = 0; i < hashA.length; i++) {
+    let bits = parseInt(hashA[i], 16) ^ parseInt(hashB[i], 16);
+    while (bits) {
+      distance += bits & 1;
+      bits >>= 1;
+    }
+  }
+  return distance;
+};
+
+/**
+ * Returns the cached Vision result of the image or of a near duplicate, null when there is none
+ */
+const getCachedReview = async (hash) => {
+  const redis = getRedisCommands();
+  if (!redis || !hash) {
+    return null;
+  }
+  try {
+    const exact = await redis.get(resultKey(hash));
+    if (exact) {
+      return JSON.parse(exact);
+    }
+    if (MAX_HASH_DISTANCE > 0) {
+      const bandMembers = await Promise.all([...Array(NUMBER_OF_BANDS).keys()].map(index => redis.sMembers(bandKey(index, hash))));
+      const candidates = [...new Set([].concat(...bandMembers))]
+        .map(candidate => ({ candidate, distance: hammingDistance(hash, candidate) }))
+        .filter(({ distance }) => distance <= MAX_HASH_DISTANCE)
+        .sort((a, b) => a.distance - b.distance);
+      for (const { candidate } of candidates) {
+        const nearDuplicate = await redis.get(resultKey(candidate));
+        if (nearDuplicate) {
+          return JSON.parse(nearDuplicate);
+        }
+      }
+    }
+  } catch (error) {
+    log.error("Could not read image review cache", { err: error });
+  }
+  return null;
+};
+
+const setCachedReview = async (hash, review) => {
+  const redis = getRedisCommands();
+  if (!redis || !hash) {
+    return;
+  }
+  try {
+    const multi = redis.multi().setEx(resultKey(hash), CACHE_TTL, JSON.stringify(review));
+    for (let index = 0; index < NUMBER_OF_BANDS; index++) {
+      multi.sAdd(bandKey(index, hash), hash);
+      multi.expire(bandKey(index, hash), CACHE_TTL);
+    }
+    await multi.exec();
+  } catch (error) {
+    log.error("Could not write image review cache", { err: error });
+  }
+};
+
+module.exports = {
+  computeImageHash,
+  hammingDistance,
+  getCachedReview,
+  setCachedReview
+};
@@ -0,0 +1,125 @@
+const models = require("../../../models/index.cjs");
+const log = require('../../utils/logger.cjs');
+const _ = require('lodash');
+const getRedisCommands = require('../../utils/redis_commands.cjs');
+
+// Moderation queue counts per domain, community, group and user kept in Redis.
+//
+// The counts are dropped when items are moderated or flagged through invalidateModerationCounts,
+// the TTL covers flags set from places that do not call it.
+
+const COUNT_TTL = process.env.MODERATION_COUNT_TTL ? parseInt(process.env.MODERATION_COUNT_TTL) : 60;
+
+const countKey = (scopeType, scopeId, allContent) => {
+  return `moderation:counts:${scopeType}:${scopeId}:${allContent ? 'all' : 'queue'}`;
+};
+
+const getScope = (options) => {
+  if (options.userId) {
+    return { scopeType: 'user', scopeId: options.userId };
+  } else if (options.groupId) {
+    return { scopeType: 'group', scopeId: options.groupId };
+  } else if (options.communityId) {
+    return { scopeType: 'community', scopeId: options.communityId };
+  } else if (options.domainId) {
+    return { scopeType: 'domain', scopeId: options.domainId };
+  } else {
+    return null;
+  }
+};
+
+/**
+ * Returns the cached count for the scope in options, computeCount(callback) counts in the database
+ */
+const getCachedModerationCount = (options, computeCount, callback) => {
+  const scope = getScope(options);
+  const redis = getRedisCommands();
+  if (!scope || !redis) {
+    computeCount(callback);
+    return;
+  }
+
+  const key = countKey(scope.scopeType, scope.scopeId, options.allContent);
+  redis.get(key).then(cachedCount => {
+    if (cachedCount !== null) {
+      callback(null, parseInt(cachedCount));
+    } else {
+      computeCount((error, count) => {
+        if (!error) {
+          redis.setEx(key, COUNT_TTL, count.toString()).catch(error => {
+            log.error("Could not cache moderation count", { err: error, key });
+          });
+        }
+        callback(error, count);
+      });
+    }
+  }).catch(error => {
+    log.error("Could not get moderation count from redis", { err: error, key });
+    computeCount(callback);
+  });
+};
+
+/**
+ * Drops the counts of every scope the posts or points belong to
+ */
+const invalidateModerationCounts = async (model, itemIds) => {
+  const redis = getRedisCommands();
+  if (!redis || !itemIds || itemIds.length === 0) {
+    return;
+  }
+
+  const items = await model.unscoped().findAll({
+    where: {
+      id: {
+        $in: itemIds
+      }
+    },
+    attributes: ['id', 'user_id', 'group_id'],
+    include: [
+      {
+        model: models.Group,
+        required: false,
+        attributes: ['id', 'community_id'],
+        include: [
+          {
+            model: models.Community,
+            required: false,
+            attributes: ['id', 'domain_id']
+          }
+        ]
+      }
+    ]
+  });
+
+  const scopes = [];
+  items.forEach(item => {
+    scopes.push(['user', item.user_id], ['group', item.group_id]);
+    if (item.Group) {
+      scopes.push(['community', item.Group.community_id]);
+      if (item.Group.Community) {
+        scopes.push(['domain', item.Group.Community.domain_id]);
+      }
+    }
+  });
+
+  const keys = _.uniq(_.flatten(scopes.filter(scope => scope[1]).map(([scopeType, scopeId]) => {
+    return [countKey(scopeType, scopeId, false), countKey(scopeType, scopeId, true)];
+  })));
+
+  if (keys.length > 0) {
+    await redis.del(keys);
+  }
+};
+
+// Fire and forget version for callback style code
+const invalidateModerationCountsInBackground = (model, itemIds) => {
+  invalidateModerationCounts(model, itemIds).catch(error => {
+    log.error("Could not invalidate moderation counts", { err: error, itemIds });
+  });
+};
+
+module.exports = {
+  getCachedModerationCount,
+  invalidateModerationCounts,
+  invalidateModerationCountsInBackground
+};
@@ -0,0 +1,59 @@
+'use strict';
+const farmhash = require('farmhash');
+const Perspective = require('./perspective_api_client.cjs');
+
+// Local stand-in for the Perspective API client with the same analyze() interface, used when
+// GOOGLE_PERSPECTIVE_API_KEY is "stub" and by tests and benchmarks.
+// Scores are derived from a hash of the text, so the same text always gets the same scores.
+//   latencyMs          Delay of each answer, PERSPECTIVE_STUB_LATENCY_MS by default
+//   quotaErrorRate     Share of calls answered with a 429 quota error
+//   toxicWords         Texts containing one of these get a high TOXICITY score
+
+class PerspectiveStub {
+  constructor(options) {
+    this.options = options || {};
+    this.latencyMs = this.options.latencyMs != undefined ? this.options.latencyMs :
+      (process.env.PERSPECTIVE_STUB_LATENCY_MS ? parseInt(process.env.PERSPECTIVE_STUB_LATENCY_MS) : 50);
+    this.quotaErrorRate = this.options.quotaErrorRate || 0;
+    this.toxicWords = this.options.toxicWords || ['idiot', 'stupid'];
+    this.callCount = 0;
+  }
+
+  analyze(text, options) {
+    return new Promise((resolve, reject) => {
+      let resource;
+      try {
+        resource = Perspective.prototype.getAnalyzeCommentPayload.call(this, text, options);
+      } catch (error) {
+        return reject(error);
+      }
+      this.callCount += 1;
+      setTimeout(() => {
+        if (Math.random() < this.quotaErrorRate) {
+          reject(new Perspective.ResponseError('Quota exceeded', { status: 429 }));
+        } else {
+          resolve(this.getScores(resource.comment.text, Object.keys(resource.requestedAttributes)));
+        }
+      }, this.latencyMs);
+    });
+  }
+
+  getScores(text, attributes) {
+    const lowerText = text.toLowerCase();
+    const isToxic = this.toxicWords.some(word => lowerText.indexOf(word) > -1);
+    const attributeScores = {};
+    attributes.forEach(attribute => {
+      let value = (farmhash.fingerprint32(`${attribute}:${text}`) % 1000) / 4000;
+      if (isToxic && (attribute === 'TOXICITY' || attribute === 'INSULT')) {
+        value = 0.9;
+      }
+      attributeScores[attribute] = {
+        spanScores: [{ begin: 0, end: text.length, score: { value, type: 'PROBABILITY' } }],
+        summaryScore: { value, type: 'PROBABILITY' }
+      };
+    });
+    return { attributeScores, languages: ['en'], detectedLanguages: ['en'] };
+  }
+}
+
+module.exports = PerspectiveStub;
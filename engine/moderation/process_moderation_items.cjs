@@ -8,6 +8,7 @@ const domainIncludes = require('./get_moderation_items.cjs').domainIncludes;
 const communityIncludes = require('./get_moderation_items.cjs').communityIncludes;
 const groupIncludes = require('./get_moderation_items.cjs').groupIncludes;
 const userIncludes = require('./get_moderation_items.cjs').userIncludes;
+const invalidateModerationCountsInBackground = require('./moderation_counts.cjs').invalidateModerationCountsInBackground;
 
 const recountCommunity = require('../../../utils/recount_utils.cjs').recountCommunity;
 
@@ -38,6 +39,7 @@ const moderationItemActionMaster = (req, res, options) => {
           }
           item.save().then( () => {
             log.info('Moderation Action Done', { item, options });
+            invalidateModerationCountsInBackground(options.model, [options.itemId]);
             if (options.itemType==='point') {
               if (options.actionType==='anonymize') {
                 queue.add('process-anonymization', { type: 'anonymize-point-activities', pointId: options.itemId }, 'high');
@@ -155,6 +157,7 @@ const moderationManyItemsActionMaster = (workPackage, callback) => {
                 include: workPackage.includes
               }).then((spread, other) => {
               log.info('Moderation Action Many', { spread, workPackage });
+              invalidateModerationCountsInBackground(workPackage.model, workPackage.itemIds);
               callback();
             }).catch(error => {
               callback(error);
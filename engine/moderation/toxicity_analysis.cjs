@@ -6,10 +6,16 @@ const TOXICITY_THRESHOLD = 0.5;
 const TOXICITY_EMAIL_THRESHOLD = 0.75;
 
 const Perspective = require("./perspective_api_client.cjs");
+const PerspectiveStub = require("./perspective_api_client_stub.cjs");
+const { scoreText, isUnsupportedLanguageError } = require("./toxicity_scoring.cjs");
 
 const queue = require("../../workers/queue.cjs");
+const invalidateModerationCountsInBackground =
+  require("./moderation_counts.cjs").invalidateModerationCountsInBackground;
 let perspectiveApi;
-if (process.env.GOOGLE_PERSPECTIVE_API_KEY) {
+if (process.env.GOOGLE_PERSPECTIVE_API_KEY === "stub") {
+  perspectiveApi = new PerspectiveStub();
+} else if (process.env.GOOGLE_PERSPECTIVE_API_KEY) {
   perspectiveApi = new Perspective({
     apiKey: process.env.GOOGLE_PERSPECTIVE_API_KEY,
     projectId: process.env.GOOGLE_TRANSLATE_PROJECT_ID
@@ -18,42 +24,49 @@ if (process.env.GOOGLE_PERSPECTIVE_API_KEY) {
   });
 }
 
+// Flagged items change the moderation queue counts
+const afterReport = (model, itemId, callback) => {
+  return (error) => {
+    invalidateModerationCountsInBackground(model, [itemId]);
+    callback(error);
+  };
+};
+
 const getToxicityScoreForText = (text, doNotStore, callback) => {
   log.info("getToxicityScoreForText starting", { doNotStore });
   if (text && text !== "") {
-    perspectiveApi
-      .analyze(text, {
-        doNotStore,
-        attributes: [
-          "TOXICITY",
-          "SEVERE_TOXICITY",
-          "IDENTITY_ATTACK",
-          "THREAT",
-          "INSULT",
-          "PROFANITY",
-          "SEXUALLY_EXPLICIT",
-          "FLIRTATION",
-          // New experimental attributes
-          "AFFINITY_EXPERIMENTAL",
-          "COMPASSION_EXPERIMENTAL",
-          "CURIOSITY_EXPERIMENTAL",
-          "NUANCE_EXPERIMENTAL",
-          "PERSONAL_STORY_EXPERIMENTAL",
-          "REASONING_EXPERIMENTAL",
-          "RESPECT_EXPERIMENTAL",
-        ],
-      })
+    scoreText(perspectiveApi, text, {
+      doNotStore,
+      attributes: [
+        "TOXICITY",
+        "SEVERE_TOXICITY",
+        "IDENTITY_ATTACK",
+        "THREAT",
+        "INSULT",
+        "PROFANITY",
+        "SEXUALLY_EXPLICIT",
+        "FLIRTATION",
+        // New experimental attributes
+        "AFFINITY_EXPERIMENTAL",
+        "COMPASSION_EXPERIMENTAL",
+        "CURIOSITY_EXPERIMENTAL",
+        "NUANCE_EXPERIMENTAL",
+        "PERSONAL_STORY_EXPERIMENTAL",
+        "REASONING_EXPERIMENTAL",
+        "RESPECT_EXPERIMENTAL",
+      ],
+    })
       .then((result) => {
-        log.info("getToxicityScoreForText results");
-        callback(null, result);
+        if (result) {
+          log.info("getToxicityScoreForText results");
+          callback(null, result);
+        } else {
+          log.warn("getToxicityScoreForText language not supported");
+          callback();
+        }
       })
       .catch((error) => {
-        if (
-          error &&
-          error.stack &&
-          error.stack.indexOf("ResponseError: Attribute") > -1 &&
-          error.stack.indexOf("does not support request languages") > -1
-        ) {
+        if (isUnsupportedLanguageError(error)) {
           log.warn("getToxicityScoreForText warning", { warning: error });
           callback();
         } else {
@@ -606,7 +619,7 @@ const estimateToxicityScoreForPost = (options, callback) => {
                                     ),
                                 },
                                 "perspectiveAPI",
-                                callback
+                                afterReport(models.Post, post.id, callback)
                               );
                             } else {
                               callback();
@@ -782,7 +795,7 @@ const estimateToxicityScoreForPoint = (options, callback) => {
                                     },
                                     "perspectiveAPI",
                                     post,
-                                    callback
+                                    afterReport(models.Point, point.id, callback)
                                   );
                                 })
                                 .catch((error) => {
@@ -798,7 +811,7 @@ const estimateToxicityScoreForPoint = (options, callback) => {
                                 },
                                 "perspectiveAPI",
                                 null,
-                                callback
+                                afterReport(models.Point, point.id, callback)
                               );
                             }
                           } else {
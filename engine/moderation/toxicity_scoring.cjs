@@ -0,0 +1,185 @@
+const farmhash = require('farmhash');
+const log = require('../../utils/logger.cjs');
+const getRedisCommands = require('../../utils/redis_commands.cjs');
+
+// Perspective API scoring with a result cache and a client side rate limit.
+//
+// Results are cached in Redis under the fingerprint of the normalized text and the requested
+// attributes, so re-edits without changes, copied spam and re-moderation do not score the same
+// text again. Texts in languages Perspective does not support are remembered as well.
+//
+// API calls go through a token bucket of REQUESTS_PER_SECOND with BURST tokens and at most
+// MAX_CONCURRENCY calls in flight. The limit is per process, divide the project quota by the
+// number of worker processes. Quota errors (429) are retried after a backoff.
+
+const REQUESTS_PER_SECOND = process.env.PERSPECTIVE_REQUESTS_PER_SECOND ? parseFloat(process.env.PERSPECTIVE_REQUESTS_PER_SECOND) : 1;
+const BURST = process.env.PERSPECTIVE_BURST ? parseInt(process.env.PERSPECTIVE_BURST) : 1;
+const MAX_CONCURRENCY = process.env.PERSPECTIVE_MAX_CONCURRENCY ? parseInt(process.env.PERSPECTIVE_MAX_CONCURRENCY) : 4;
+const MAX_QUOTA_RETRIES = 3;
+const CACHE_TTL = process.env.TOXICITY_CACHE_TTL_SECONDS ? parseInt(process.env.TOXICITY_CACHE_TTL_SECONDS) : 60 * 60 * 24 * 30;
+const UNSUPPORTED_CACHE_TTL = 60 * 60 * 24;
+
+const UNSUPPORTED_LANGUAGE = 'unsupported-language';
+
+const queue = [];
+const inFlightScores = new Map();
+let tokens = BURST;
+let lastRefillAt = Date.now();
+let activeCalls = 0;
+let drainTimer = null;
+
+const stats = {
+  cacheHits: 0,
+  cacheMisses: 0,
+  sharedScores: 0,
+  apiCalls: 0,
+  quotaErrors: 0,
+  maxQueueDepth: 0,
+  totalQueueWaitMs: 0
+};
+
+const normalizeText = (text) => {
+  return text.normalize('NFC').replace(/\s+/g, ' ').trim();
+};
+
+const getCacheKey = (text, attributes) => {
+  const textHash = farmhash.fingerprint64(normalizeText(text));
+  const attributesHash = farmhash.fingerprint32(attributes.slice().sort().join(','));
+  return `cache:toxicity:${textHash}:${attributesHash}`;
+};
+
+const isUnsupportedLanguageError = (error) => {
+  return error && error.stack &&
+    error.stack.indexOf("ResponseError: Attribute") > -1 &&
+    error.stack.indexOf("does not support request languages") > -1;
+};
+
+const isQuotaError = (error) => {
+  return error && error.response && error.response.status == 429;
+};
+
+const refillTokens = () => {
+  const now = Date.now();
+  tokens = Math.min(BURST, tokens + (now - lastRefillAt) / 1000 * REQUESTS_PER_SECOND);
+  lastRefillAt = now;
+};
+
+// Starts queued calls while tokens and concurrency allow, otherwise waits for the next token
+const drainQueue = () => {
+  refillTokens();
+  while (queue.length > 0 && activeCalls < MAX_CONCURRENCY && tokens >= 1) {
+    const job = queue.shift();
+    tokens -= 1;
+    activeCalls += 1;
+    stats.apiCalls += 1;
+    stats.totalQueueWaitMs += Date.now() - job.queuedAt;
+    job.run().then(job.resolve, job.reject).finally(() => {
+      activeCalls -= 1;
+      drainQueue();
+    });
+  }
+  if (queue.length > 0 && !drainTimer && activeCalls < MAX_CONCURRENCY) {
+    const waitMs = Math.max(1, Math.ceil((1 - tokens) / REQUESTS_PER_SECOND * 1000));
+    drainTimer = setTimeout(() => {
+      drainTimer = null;
+      drainQueue();
+    }, waitMs);
+  }
+};
+
+const schedule = (run) => {
+  return new Promise((resolve, reject) => {
+    queue.push({ run, resolve, reject, queuedAt: Date.now() });
+    stats.maxQueueDepth = Math.max(stats.maxQueueDepth, queue.length);
+    drainQueue();
+  });
+};
+
+const analyzeWithRetries = async (client, text, options) => {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await schedule(() => client.analyze(text, options));
+    } catch (error) {
+      if (isQuotaError(error) && attempt < MAX_QUOTA_RETRIES) {
+        stats.quotaErrors += 1;
+        log.warn("Perspective quota exceeded, retrying", { attempt });
+        await new Promise(resolve => setTimeout(resolve, 1000 * Math.pow(2, attempt)));
+      } else {
+        throw error;
+      }
+    }
+  }
+};
+
+const getCachedResult = async (key) => {
+  const redis = getRedisCommands();
+  if (redis) {
+    try {
+      const cached = await redis.get(key);
+      if (cached) {
+        return JSON.parse(cached);
+      }
+    } catch (error) {
+      log.error("Could not read toxicity cache", { err: error });
+    }
+  }
+  return null;
+};
+
+const setCachedResult = (key, value, ttl) => {
+  const redis = getRedisCommands();
+  if (redis) {
+    redis.setEx(key, ttl, JSON.stringify(value)).catch(error => {
+      log.error("Could not write toxicity cache", { err: error });
+    });
+  }
+};
+
+const scoreUncached = async (client, key, text, options) => {
+  const cached = await getCachedResult(key);
+  if (cached) {
+    stats.cacheHits += 1;
+    return cached === UNSUPPORTED_LANGUAGE ? null : cached;
+  }
+  stats.cacheMisses += 1;
+  try {
+    const result = await analyzeWithRetries(client, text, options);
+    setCachedResult(key, result, CACHE_TTL);
+    return result;
+  } catch (error) {
+    if (isUnsupportedLanguageError(error)) {
+      setCachedResult(key, UNSUPPORTED_LANGUAGE, UNSUPPORTED_CACHE_TTL);
+    }
+    throw error;
+  }
+};
+
+/**
+ * Scores the text with client.analyze(text, options), options.attributes lists the requested
+ * attributes. Resolves to the Perspective response, rejects with the client's errors.
+ * Resolves to null for a cached unsupported language.
+ */
+const scoreText = (client, text, options) => {
+  const key = getCacheKey(text, options.attributes);
+  if (inFlightScores.has(key)) {
+    stats.sharedScores += 1;
+    return inFlightScores.get(key);
+  }
+  const promise = scoreUncached(client, key, text, options).finally(() => {
+    inFlightScores.delete(key);
+  });
+  inFlightScores.set(key, promise);
+  return promise;
+};
+
+const getStats = () => Object.assign({
+  queueDepth: queue.length,
+  activeCalls,
+  averageQueueWaitMs: stats.apiCalls > 0 ? Math.round(stats.totalQueueWaitMs / stats.apiCalls) : 0
+}, stats);
+
+module.exports = {
+  scoreText,
+  isUnsupportedLanguageError,
+  getStats
+};
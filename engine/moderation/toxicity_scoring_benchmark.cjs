@@ -0,0 +1,27 @@
+const PerspectiveStub = require('./perspective_api_client_stub.cjs');
+const toxicityScoring = require('./toxicity_scoring.cjs');
+
+// Scores a burst of texts, a share of them repeated, through the scheduler with the local stub
+// client and prints the queue metrics. Set PERSPECTIVE_REQUESTS_PER_SECOND and friends to try
+// other limits, with Redis running repeated texts are also answered from the cache.
+//   node toxicity_scoring_benchmark.cjs [numberOfTexts] [uniqueTexts]
+
+const NUMBER_OF_TEXTS = process.argv[2] ? parseInt(process.argv[2]) : 50;
+const UNIQUE_TEXTS = process.argv[3] ? parseInt(process.argv[3]) : 20;
+
+const client = new PerspectiveStub({ latencyMs: 100, quotaErrorRate: 0.05 });
+const options = { doNotStore: true, attributes: ['TOXICITY', 'SEVERE_TOXICITY', 'INSULT'] };
+
+const start = Date.now();
+const texts = [];
+for (let i = 0; i < NUMBER_OF_TEXTS; i++) {
+  texts.push(`Comment number ${i % UNIQUE_TEXTS} about the  proposal`);
+}
+
+Promise.all(texts.map(text => toxicityScoring.scoreText(client, text, options).catch(error => error))).then(results => {
+  const errors = results.filter(result => result instanceof Error).length;
+  console.log(`Scored ${texts.length} texts (${UNIQUE_TEXTS} unique) in ${Date.now() - start}ms, ${errors} errors`);
+  console.log(`Stub API calls: ${client.callCount}`);
+  console.log(toxicityScoring.getStats());
+  process.exit();
+});
@@ -10,6 +10,9 @@ var activitiesDefaultIncludes = require('./news_feeds_utils.cjs').activitiesDefa
 var getCommonWhereOptions = require('./news_feeds_utils.cjs').getCommonWhereOptions;
 var defaultKeyActivities = require('./news_feeds_utils.cjs').defaultKeyActivities;
 var getActivityDate = require('./news_feeds_utils.cjs').getActivityDate;
+var selectRecommendedActivities = require('./news_feed_filters.cjs').selectRecommendedActivities;
+var removeSavedActivities = require('./news_feed_filters.cjs').removeSavedActivities;
+var RECOMMENDATION_FILTER_THRESHOLD = require('./news_feed_filters.cjs').RECOMMENDATION_FILTER_THRESHOLD;
 
 var airbrake = null;
 if(process.env.AIRBRAKE_PROJECT_ID) {
@@ -21,9 +24,13 @@ if(process.env.AIRBRAKE_PROJECT_ID) {
 // Get promotions to add to the news feed
 // Create critical priority job to insert recommendation and promotions to postgres
 // Send data back to user
+//
+// The latest AcNewsFeedProcessedRange is the watermark, only activities created after it are
+// fetched and the new items are written together with the next range in one transaction.
 
 var GENERAL_NEWS_FEED_LIMIT = 20;
-var RECOMMENDATION_FILTER_THRESHOLD = 14;
+
+var SCOPE_OPTIONS = ['user_id', 'domain_id', 'community_id', 'group_id', 'post_id'];
 
 var getNewsFeedItems = function(options, callback) {
   var where = getCommonWhereOptions(options);
@@ -51,7 +58,7 @@ var getNewsFeedItems = function(options, callback) {
 };
 
 var getAllActivities = function (options, callback) {
-  var where = getCommonWhereOptions(_.merge(options, { dateColumn: 'created_at' }));
+  var where = getCommonWhereOptions(_.assign({}, options, { dateColumn: 'created_at' }));
   where = _.merge(where, {
     type: {
       $in: defaultKeyActivities
@@ -82,20 +89,6 @@ var filterRecommendations = function (allActivities, options, callback) {
     allActivitiesLength: allActivities.length, threshold: RECOMMENDATION_FILTER_THRESHOLD
   });
 
-  // Add my own activities
-  var myActivities = _.filter(allActivities, function (activity) { return activity.user_id == options.user_id});
-  allActivities = _.filter(allActivities, function (activity) { return activity.user_id != options.user_id});
-
-  // Add non post activities
-  var noPostActivities = _.filter(allActivities, function (activity) { return !activity.post_id });
-  allActivities = _.filter(allActivities, function (activity) { return activity.post_id });
-
-  var currentPostIds = _.map(allActivities, function (item) { return item.post_id ? item.post_id.toString() : null; });
-  // There can be more than one instance of a post_id from a group of activities
-
-  // Get all status updates and make sure they are not removed due to lack of recommendations
-  currentPostIds =_.uniq(currentPostIds);
-  currentPostIds = _.without(currentPostIds, null);
   var dateRange = {};
   if (options.afterDate && options.beforeDate) {
     dateRange = { name: 'date', after: options.afterDate, before: options.beforeDate }
@@ -117,73 +110,65 @@ var filterRecommendations = function (allActivities, options, callback) {
       }
     }
 
-    var recommendedPostIds = _.filter(currentPostIds, function (activity) { return _.includes(recommendedItemIds, activity) });
-    var notRecommendedPostIds = _.filter(currentPostIds, function (activity) { return !_.includes(recommendedItemIds, activity)});
-
+    var selected = selectRecommendedActivities(allActivities, recommendedItemIds, options.user_id);
     log.info("Generate News Feed Dynamically Recommendation status", {
-      recommendedPostIdsLength: recommendedPostIds.length, notRecommendedPostIdsLength: notRecommendedPostIds.length
+      recommendedPostIdsLength: selected.recommendedCount, notRecommendedPostIdsLength: selected.notRecommendedCount
     });
-    var finalPostIds;
-    if (recommendedPostIds.length<RECOMMENDATION_FILTER_THRESHOLD) {
-      // Randomize the remaining not recommended activities
-      notRecommendedPostIds = _.shuffle(notRecommendedPostIds);
-      // Merge the recommended activities using the not recommended ones and drop the rest
-      finalPostIds = _.concat(recommendedPostIds, _.dropRight(notRecommendedPostIds, notRecommendedPostIds.length-(RECOMMENDATION_FILTER_THRESHOLD-recommendedPostIds.length)));
-    } else {
-      finalPostIds = recommendedPostIds;
-    }
-    allActivities = _.filter(allActivities, function (activity) { return (activity.post_id && _.includes(finalPostIds, activity.post_id.toString()))});
-    allActivities = _.concat(allActivities, myActivities);
-    allActivities = _.concat(allActivities, noPostActivities);
-    callback(null, allActivities);
+    callback(null, selected.activities);
   });
 };
 
 var removeDuplicates = function(allActivities, options, callback) {
-  allActivities =_.uniq(allActivities);
-  var currentActivityIds = _.map(allActivities, function (item) { return item.id; });
-  var where = _.merge(getCommonWhereOptions(options), {
+  var where = _.merge(getCommonWhereOptions(_.pick(options, SCOPE_OPTIONS)), {
     ac_activity_id: {
-      $in: currentActivityIds
+      $in: _.map(allActivities, function (item) { return item.id; })
     }
   });
   models.AcNewsFeedItem.findAll({
-    where: where
-  }).then(function(alreadySavedActivities) {
+    where: where,
+    attributes: ['ac_activity_id']
+  }).then(function(alreadySavedItems) {
     log.info("Generate News Feed Dynamically Found already saved", {
-      alreadySavedActivitiesLength: alreadySavedActivities.length
+      alreadySavedActivitiesLength: alreadySavedItems.length
     });
-    var alreadySavedActivitiesIds = _.map(alreadySavedActivities, function (item) { return item.id; });
     // Filter out activities already in this newsfeed
-    allActivities = _.filter(allActivities, function (activity) { return !_.includes(alreadySavedActivities, activity.id)});
-    callback(null, allActivities);
+    callback(null, removeSavedActivities(allActivities, _.map(alreadySavedItems, 'ac_activity_id')));
   }).catch(function(error) {
     callback(error);
   });
 };
 
-var createNewsFeedItemsFromActivities = function(allActivities, options, callback) {
+// Writes the new items with one bulk insert and records the processed range in the same
+// transaction, so the watermark only moves when its items are saved. ignoreDuplicates skips
+// items that are already there through the unique index from
+// scripts/news_feed_items_add_unique_index.js
+var saveNewsFeedItemsAndProcessedRange = function(allActivities, latestActivity, oldestActivity, options, callback) {
   log.info("Generate News Feed Dynamically Saving new news items", { allActivitiesLength: allActivities.length });
+  var scope = _.pick(options, SCOPE_OPTIONS);
   models.sequelize.transaction(function (t1) {
-    allInserts = [];
-    _.forEach(allActivities, function (activity) {
-      allInserts.push(models.AcNewsFeedItem.create({ ac_activity_id: activity.id, latest_activity_at: activity.created_at,
-        type: 'newsFeed.dynamic.recommendation', user_id: options.user_id,
-        domain_id: options.domain_id, community_id: options.community_id,
-        group_id: options.group_id, post_id: options.post_id }, { transaction: t1 }));
-
+    return models.AcNewsFeedItem.bulkCreate(_.map(allActivities, function (activity) {
+      return _.assign({ ac_activity_id: activity.id, latest_activity_at: activity.created_at,
+        type: 'newsFeed.dynamic.recommendation' }, scope);
+    }), { transaction: t1, ignoreDuplicates: true }).then(function () {
+      if (latestActivity && oldestActivity) {
+        return models.AcNewsFeedProcessedRange.create(_.assign({
+          latest_activity_at: latestActivity.created_at,
+          oldest_activity_at: oldestActivity.created_at
+        }, scope), { transaction: t1 });
+      } else {
+        return null;
+      }
     });
-    return Promise.all(allInserts);
-  }).then(function (result) {
-    log.info("Generate News Feed Dynamically Saved", { result: result });
-    callback(null, result);
+  }).then(function (processedRange) {
+    log.info("Generate News Feed Dynamically Saved", { itemsLength: allActivities.length });
+    callback(null, processedRange);
   }).catch(function (error) {
     callback(error);
   });
 };
 
 var loadOtherNewsItemsInRange = function(latestActivity, oldestActivity, options, callback) {
-  getNewsFeedItems(_.merge(options, {
+  getNewsFeedItems(_.assign(_.omit(options, ['afterFilter', 'beforeFilter']), {
     afterOrEqualFilter: oldestActivity.created_at,
     beforeOrEqualFilter: latestActivity.created_at,
     type: 'newsFeed.from.notification.recommendation',
@@ -191,19 +176,6 @@ var loadOtherNewsItemsInRange = function(latestActivity, oldestActivity, options
   }), callback);
 };
 
-var createProcessedRange = function (latestActivity, oldestActivity, options, callback) {
-  models.AcNewsFeedProcessedRange.create({
-    latest_activity_at: latestActivity.created_at,
-    oldest_activity_at: oldestActivity.created_at,
-    user_id: options.user_id, domain_id: options.domain_id, community_id: options.community_id,
-    group_id: options.group_id, post_id: options.post_id
-  }).then(function (results) {
-    callback(null, results);
-  }).catch(function (error) {
-    callback(error);
-  });
-};
-
 var generateNewsFeedFromActivities = function(options, callback) {
   var allActivities, finalActivities, latestActivity, oldestActivity, otherNewsItems, processedRange;
 
@@ -248,11 +220,12 @@ var generateNewsFeedFromActivities = function(options, callback) {
         if (error) {
           seriesCallback(error);
         } else {
-          // Save all new news feed items
-          createNewsFeedItemsFromActivities(activities, options, function (error, results) {
+          // Save all new news feed items and move the watermark
+          saveNewsFeedItemsAndProcessedRange(activities, latestActivity, oldestActivity, options, function (error, processedRangeIn) {
             if (error) {
               seriesCallback(error);
             } else {
+              processedRange = processedRangeIn;
               seriesCallback();
             }
           });
@@ -284,22 +257,6 @@ var generateNewsFeedFromActivities = function(options, callback) {
       finalActivities = _.orderBy(finalActivities, ['created_at'], ['desc']);
       log.info("Generate News Feed Dynamically Have created the final activities to deliver", { finalActivitiesLength: finalActivities.length });
       seriesCallback();
-    },
-
-    // Create the News Feed Processed Range
-    function (seriesCallback) {
-      if (latestActivity && oldestActivity) {
-        createProcessedRange(latestActivity, oldestActivity, options, function(error, processedRangeIn) {
-          if (error) {
-            seriesCallback(error);
-          } else {
-            processedRange = processedRangeIn;
-            seriesCallback();
-          }
-        });
-      } else {
-        seriesCallback();
-      }
     }
   ], function (error) {
     // Return all
@@ -308,7 +265,7 @@ var generateNewsFeedFromActivities = function(options, callback) {
 };
 
 var getNewsFeedItemsFromProcessedRange = function (processedRange, options, callback) {
-  getNewsFeedItems(_.merge(options, {
+  getNewsFeedItems(_.assign({}, options, {
     afterOrEqualFilter: processedRange.oldest_activity_at,
     beforeOrEqualFilter: processedRange.latest_activity_at,
     dateColumn: 'latest_activity_at'
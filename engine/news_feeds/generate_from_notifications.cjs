@@ -2,262 +2,322 @@ var models = require("../../../models/index.cjs");
 var async = require('async');
 var log = require('../../utils/logger.cjs');
 var _ = require('lodash');
-var toJson = require('../../utils/to_json.cjs');
 
 var airbrake = null;
 if(process.env.AIRBRAKE_PROJECT_ID) {
   airbrake = require('../../utils/airbrake.cjs');
 }
 
-var isItemRecommended = require('../recommendations/events_manager.cjs').isItemRecommended;
+var getRecommendationFor = require('../recommendations/events_manager.cjs').getRecommendationFor;
 var getNewsFeedDate = require('./news_feeds_utils.cjs').getNewsFeedDate;
 
-var createItemFromNotification = function (notification, options, callback) {
-  var detail = {};
-  detail.ac_notification_id = notification.id;
-  detail.ac_activity_id = _.last(notification.AcActivities).id;
-  detail.user_id = notification.user_id;
-  detail.latest_activity_at = _.last(notification.AcActivities).created_at;
+// Notifications are processed in batches, jobs arriving within BATCH_WINDOW_MS are collected
+// and their followings, endorsements, recommendations and news feed items are handled with a
+// few set based queries instead of several queries per notification. Each job waits for its
+// batch, so the process-notification-news-feed queue runs with MAX_BATCH_SIZE concurrency.
+// When a batch fails its notifications are processed again one at a time.
+var BATCH_WINDOW_MS = process.env.NEWS_FEED_BATCH_WINDOW_MS ? parseInt(process.env.NEWS_FEED_BATCH_WINDOW_MS) : 100;
+var MAX_BATCH_SIZE = process.env.NEWS_FEED_MAX_BATCH_SIZE ? parseInt(process.env.NEWS_FEED_MAX_BATCH_SIZE) : 50;
+var RECOMMENDATION_REQUEST_CONCURRENCY = 5;
+var FALLBACK_CONCURRENCY = 5;
 
-  models.AcNewsFeedItem.findOne({where: { ac_activity_id: detail.ac_activity_id }}).then(function(results){
-    if (!results) {
-      models.AcNewsFeedItem.create(_.merge(detail, options)).then(function (item) {
-        if (item) {
-          log.info("Generate News Feed Notifications Created item", { item: toJson(item) });
-          callback();
-        } else {
-          callback('Could not created item');
-        }
+// Recommendation scopes in the order they are tried, an activity only gets one news feed item
+var RECOMMENDATION_SCOPES = [
+  { column: 'domain_id', limit: 15 },
+  { column: 'community_id' },
+  { column: 'group_id' },
+  { column: 'post_id' }
+];
+
+var workerRequest = { useragent: { source: 'news-feed-worker' }, clientIp: null };
+
+var pairKey = function (a, b) {
+  return a + ':' + b;
+};
+
+// Updates latest_activity_at of items that already exist for the notifications and returns
+// the ids of those notifications
+var touchExistingItems = function (notifications, callback) {
+  var lastActivityByNotificationId = {};
+  notifications.forEach(function (notification) {
+    lastActivityByNotificationId[notification.id] = _.last(notification.AcActivities);
+  });
+
+  models.AcNewsFeedItem.findAll({
+    where: {
+      ac_notification_id: {
+        $in: _.keys(lastActivityByNotificationId)
+      }
+    },
+    attributes: ['id', 'ac_notification_id']
+  }).then(function (oldItems) {
+    if (oldItems.length === 0) {
+      callback(null, new Set());
+    } else {
+      log.info("Generate News Feed Notifications found old items and updating timestamps", { oldItemsLength: oldItems.length });
+      var values = _.map(oldItems, function (item) {
+        return [item.id, lastActivityByNotificationId[item.ac_notification_id].created_at];
+      });
+      models.sequelize.query(
+        "UPDATE ac_news_feed_items SET latest_activity_at = CAST(updates.latest_activity_at AS TIMESTAMP WITH TIME ZONE), updated_at = now() " +
+        "FROM (VALUES :values) AS updates (id, latest_activity_at) WHERE ac_news_feed_items.id = updates.id",
+        { replacements: { values: values } }
+      ).then(function () {
+        callback(null, new Set(_.map(oldItems, function (item) { return item.ac_notification_id.toString() })));
       }).catch(function (error) {
         callback(error);
-      })
+      });
+    }
+  }).catch(function (error) {
+    callback(error);
+  });
+};
+
+// Loads the existing (user_id, other column) pairs of a model in one query
+var loadPairs = function (model, otherColumn, pairs, callback) {
+  if (pairs.length === 0) {
+    callback(null, new Set());
+  } else {
+    var where = {
+      user_id: { $in: _.uniq(_.map(pairs, 0)) }
+    };
+    where[otherColumn] = { $in: _.uniq(_.map(pairs, 1)) };
+    model.findAll({
+      where: where,
+      attributes: ['user_id', otherColumn]
+    }).then(function (rows) {
+      callback(null, new Set(_.map(rows, function (row) { return pairKey(row.user_id, row[otherColumn]) })));
+    }).catch(function (error) {
+      callback(error);
+    });
+  }
+};
+
+var isDirectlyIncluded = function (notification, activity) {
+  return notification.user_id == activity.user_id ||
+    activity.type == 'activity.post.new' ||
+    (activity.Post && activity.Post.user_id == notification.user_id);
+};
+
+// Splits the notifications into those the user should see because of their own activity,
+// a following or an endorsement and those that depend on recommendations
+var partitionShouldInclude = function (notifications, callback) {
+  var followingPairs = [];
+  var endorsementPairs = [];
+  notifications.forEach(function (notification) {
+    var activity = _.last(notification.AcActivities);
+    if (!isDirectlyIncluded(notification, activity)) {
+      followingPairs.push([notification.user_id, activity.user_id]);
+      if (activity.Post) {
+        endorsementPairs.push([notification.user_id, activity.Post.id]);
+      }
+    }
+  });
+
+  async.parallel({
+    followings: function (parallelCallback) {
+      loadPairs(models.AcFollowing, 'other_user_id', followingPairs, parallelCallback);
+    },
+    endorsements: function (parallelCallback) {
+      loadPairs(models.Endorsement, 'post_id', endorsementPairs, parallelCallback);
+    }
+  }, function (error, results) {
+    if (error) {
+      callback(error);
     } else {
-      log.warn("Not creating news feed item for activitity that is already there", {acActivityId: detail.ac_activity_id, userId: detail.user_id });
-      callback();
+      var should = [], other = [];
+      notifications.forEach(function (notification) {
+        var activity = _.last(notification.AcActivities);
+        if (isDirectlyIncluded(notification, activity) ||
+            results.followings.has(pairKey(notification.user_id, activity.user_id)) ||
+            (activity.Post && results.endorsements.has(pairKey(notification.user_id, activity.Post.id)))) {
+          should.push(notification);
+        } else {
+          other.push(notification);
+        }
+      });
+      callback(null, should, other);
     }
-  })
+  });
 };
 
-var buildNewsFeedItems = function (notification, callback) {
-  var shouldInclude = false;
-  var activity = _.last(notification.AcActivities);
-  var lastNewsItem;
+// Finds the first scope each notification's post is recommended in. The latest recommendation
+// item date per scope and the recommendations per (user, scope, date) are fetched once per batch.
+var findRecommendedScopes = function (notifications, callback) {
+  var feedDates = {};
+  var recommendations = {};
+  var candidates = _.filter(notifications, function (notification) {
+    return _.last(notification.AcActivities).post_id && notification.User;
+  });
+
+  var scopeKey = function (scope, activity) {
+    return scope.column + ':' + activity[scope.column];
+  };
+
+  var recommendationKey = function (scope, activity, notification) {
+    var feedDate = feedDates[scopeKey(scope, activity)];
+    return pairKey(notification.User.id, scopeKey(scope, activity)) + ':' + (feedDate ? feedDate.toISOString() : '');
+  };
 
   async.series([
-    // If my activity, new post, my post or some of my followings mark it as should include
     function (seriesCallback) {
-      if (notification.user_id == activity.user_id ||
-          activity.type == 'activity.post.new' ||
-          (activity.Post && activity.Post.user_id == notification.user_id) ) {
-        shouldInclude = true;
-        seriesCallback();
-      } else {
-        models.AcFollowing.findOne({
-          where: {
-            user_id: notification.user_id,
-            other_user_id: activity.user_id
-          }
-        }).then(function (following) {
-          if (following) {
-            shouldInclude = true;
-          }
-          seriesCallback();
-        }).catch(function (error) {
-          seriesCallback(error)
+      var scopes = {};
+      candidates.forEach(function (notification) {
+        var activity = _.last(notification.AcActivities);
+        RECOMMENDATION_SCOPES.forEach(function (scope) {
+          scopes[scopeKey(scope, activity)] = { scope: scope, activity: activity };
         });
-      }
+      });
+      async.eachOfLimit(scopes, RECOMMENDATION_REQUEST_CONCURRENCY, function (item, key, eachCallback) {
+        var options = {};
+        options[item.scope.column] = item.activity[item.scope.column];
+        getNewsFeedDate(options, 'newsFeed.from.notification.recommendation', function (error, itemUpdatedAt) {
+          feedDates[key] = itemUpdatedAt;
+          eachCallback(error);
+        });
+      }, seriesCallback);
     },
     function (seriesCallback) {
-      if (shouldInclude || !activity.Post) {
-        seriesCallback()
-      } else {
-        models.Endorsement.findOne({
-          where: {
-            user_id: notification.user_id,
-            post_id: activity.Post.id
-          }
-        }).then(function (endorsement) {
-          if (endorsement) {
-            shouldInclude = true;
+      var requests = {};
+      candidates.forEach(function (notification) {
+        var activity = _.last(notification.AcActivities);
+        RECOMMENDATION_SCOPES.forEach(function (scope) {
+          requests[recommendationKey(scope, activity, notification)] = { scope: scope, activity: activity, notification: notification };
+        });
+      });
+      async.eachOfLimit(requests, RECOMMENDATION_REQUEST_CONCURRENCY, function (item, key, eachCallback) {
+        var feedDate = feedDates[scopeKey(item.scope, item.activity)];
+        var dateRange = { after: feedDate ? feedDate.toISOString() : null };
+        if (item.scope.limit) {
+          dateRange.limit = item.scope.limit;
+        }
+        var options = {};
+        options[item.scope.column] = item.activity[item.scope.column];
+        getRecommendationFor(workerRequest, item.notification.User.id, dateRange, options, function (error, items) {
+          if (error) {
+            log.error("Recommendation Events Manager Error", { userId: item.notification.User.id, err: error });
+            items = [];
           }
-          seriesCallback();
-        }).catch(function (error) {
-          seriesCallback(error)
+          recommendations[key] = new Set(_.map(items, function (id) { return id.toString() }));
+          eachCallback();
         });
-      }
-    },
-    function (seriesCallback) {
-      // Create newsFeed item if needed
-      if (shouldInclude) {
-        createItemFromNotification(notification, {
-          type: 'newsFeed.from.notification.should',
-          domain_id: activity.domain_id,
-          group_id: activity.group_id,
-          post_id: activity.post_id,
-          community_id: activity.community_id,
-          latest_activity_at: activity.created_at },
-          seriesCallback);
-      } else {
-        var lastNewsItemUpdatedAt;
-        async.series([
-          // Domain news feed from recommendations
-          function (innerSeriesCallback) {
-            lastNewsItemUpdatedAt = null;
-            getNewsFeedDate({domain_id: activity.domain_id}, 'newsFeed.from.notification.recommendation', function(error, itemUpdatedAt) {
-              lastNewsItemUpdatedAt = itemUpdatedAt;
-              innerSeriesCallback(error);
-            });
-          },
-          function (innerSeriesCallback) {
-            isItemRecommended({}, activity.post_id, notification.User.id, {
-              limit: 15,
-              after: lastNewsItemUpdatedAt ? lastNewsItemUpdatedAt.toISOString() : null
-            }, {
-              domain_id: activity.domain_id
-            }, function (isRecommended) {
-              if (isRecommended) {
-                createItemFromNotification(notification, {
-                  type: 'newsFeed.from.notification.recommendation',
-                  domain_id: activity.domain_id
-                }, function (error) {
-                  innerSeriesCallback(error)
-                });
-              } else {
-                innerSeriesCallback();
-              }
-            });
-          },
-          // Community news feed from recommendations
-          function (innerSeriesCallback) {
-            lastNewsItemUpdatedAt = null;
-            getNewsFeedDate({community_id: activity.community_id}, 'newsFeed.from.notification.recommendation', function(error, itemUpdatedAt) {
-              lastNewsItemUpdatedAt = itemUpdatedAt;
-              innerSeriesCallback(error);
-            });
-          },
-          function (innerSeriesCallback) {
-            isItemRecommended({}, activity.post_id, notification.User.id, {
-              after: lastNewsItemUpdatedAt ? lastNewsItemUpdatedAt.toISOString() : null
-            }, {
-              community_id: activity.community_id
-            }, function (isRecommended) {
-              if (isRecommended) {
-                createItemFromNotification(notification, {
-                  type: 'newsFeed.from.notification.recommendation',
-                  community_id: activity.community_id
-                }, function (error) {
-                  innerSeriesCallback(error)
-                });
-              } else {
-                innerSeriesCallback();
-              }
-            });
-          },
-          // Group news feed from recommendations
-          function (innerSeriesCallback) {
-            lastNewsItemUpdatedAt = null;
-            getNewsFeedDate({group_id: activity.group_id}, 'newsFeed.from.notification.recommendation', function(error, itemUpdatedAt) {
-              lastNewsItemUpdatedAt = itemUpdatedAt;
-              innerSeriesCallback(error);
-            });
-          },
-          function (innerSeriesCallback) {
-            isItemRecommended({}, activity.post_id, notification.User.id, {
-              after: lastNewsItemUpdatedAt ? lastNewsItemUpdatedAt.toISOString() : null
-            }, {
-              group_id: activity.group_id
-            }, function (isRecommended) {
-              if (isRecommended) {
-                createItemFromNotification(notification, {
-                  type: 'newsFeed.from.notification.recommendation',
-                  group_id: activity.group_id
-                }, function (error) {
-                  innerSeriesCallback(error)
-                });
-              } else {
-                innerSeriesCallback();
-              }
-            });
-          },
+      }, seriesCallback);
+    }
+  ], function (error) {
+    if (error) {
+      callback(error);
+    } else {
+      var recommended = [];
+      candidates.forEach(function (notification) {
+        var activity = _.last(notification.AcActivities);
+        var scope = _.find(RECOMMENDATION_SCOPES, function (scope) {
+          return recommendations[recommendationKey(scope, activity, notification)].has(activity.post_id.toString());
+        });
+        if (scope) {
+          recommended.push({ notification: notification, scope: scope });
+        }
+      });
+      callback(null, recommended);
+    }
+  });
+};
 
-          // Post news feed from recommendations
-          function (innerSeriesCallback) {
-            lastNewsItemUpdatedAt = null;
-            getNewsFeedDate({post_id: activity.post_id}, 'newsFeed.from.notification.recommendation', function(error, itemUpdatedAt) {
-              lastNewsItemUpdatedAt = itemUpdatedAt;
-              innerSeriesCallback(error);
-            });
-          },
+var itemFromNotification = function (notification, options) {
+  var activity = _.last(notification.AcActivities);
+  return _.merge({
+    ac_notification_id: notification.id,
+    ac_activity_id: activity.id,
+    user_id: notification.user_id,
+    latest_activity_at: activity.created_at
+  }, options);
+};
 
-          // Create item if recommended
-          function (innerSeriesCallback) {
-            isItemRecommended({}, activity.post_id, notification.User.id, {
-              after: lastNewsItemUpdatedAt ? lastNewsItemUpdatedAt.toISOString() : null
-            }, {
-              post_id: activity.post_id
-            }, function (isRecommended) {
-              if (isRecommended) {
-                createItemFromNotification(notification, {
-                  type: 'newsFeed.from.notification.recommendation',
-                  post_id: activity.post_id
-                }, function (error) {
-                  innerSeriesCallback(error)
-                });
-              } else {
-                innerSeriesCallback();
-              }
-            });
-          }
-        ], seriesCallback);
+// Inserts the items with one statement, skipping activities that already have an item.
+// ignoreDuplicates covers items added concurrently through the unique index from
+// scripts/news_feed_items_add_unique_index.js
+var createItems = function (items, callback) {
+  items = _.uniqBy(items, 'ac_activity_id');
+  if (items.length === 0) {
+    callback();
+  } else {
+    models.AcNewsFeedItem.findAll({
+      where: {
+        ac_activity_id: {
+          $in: _.map(items, 'ac_activity_id')
+        }
+      },
+      attributes: ['ac_activity_id']
+    }).then(function (existingItems) {
+      var existing = new Set(_.map(existingItems, function (item) { return item.ac_activity_id.toString() }));
+      var newItems = _.filter(items, function (item) { return !existing.has(item.ac_activity_id.toString()) });
+      if (existingItems.length > 0) {
+        log.warn("Not creating news feed items for activities that are already there", { existingLength: existingItems.length });
       }
-    }
-  ], callback);
+      return models.AcNewsFeedItem.bulkCreate(newItems, { ignoreDuplicates: true }).then(function () {
+        log.info("Generate News Feed Notifications Created items", { itemsLength: newItems.length });
+        callback();
+      });
+    }).catch(function (error) {
+      callback(error);
+    });
+  }
 };
 
-module.exports = function (notification, user, callback) {
-
-  var news_feed_item;
-  var activity = _.last(notification.AcActivities);
+var generateNewsFeedItemsFromNotifications = function (notifications, callback) {
+  var notificationsToBuild, items = [];
 
   async.series([
-    // See if news item for same notification exists and set updated time if needed
     function (seriesCallback) {
-      models.AcNewsFeedItem.findOne({
-        where: {
-          ac_notification_id: notification.id
-        }
-      }).then(function (oldNewsFeedItem) {
-        if (oldNewsFeedItem) {
-          log.info("Generate News Feed Notifications found old item and updating timestamp", { oldNewsFeedItemId: oldNewsFeedItem.id });
-          news_feed_item = oldNewsFeedItem;
-          news_feed_item.latest_activity_at = activity.created_at;
-          news_feed_item.save().then(function (updateResults) {
-            if (!updateResults) {
-              log.error("Filtering News Feed Notifications Error", { err: "Could not update timestamp" });
-            }
-            seriesCallback();
-          });
+      touchExistingItems(notifications, function (error, touchedNotificationIds) {
+        notificationsToBuild = _.filter(notifications, function (notification) {
+          return touchedNotificationIds && !touchedNotificationIds.has(notification.id.toString());
+        });
+        seriesCallback(error);
+      });
+    },
+    function (seriesCallback) {
+      partitionShouldInclude(notificationsToBuild, function (error, should, other) {
+        if (error) {
+          seriesCallback(error);
         } else {
+          should.forEach(function (notification) {
+            var activity = _.last(notification.AcActivities);
+            items.push(itemFromNotification(notification, {
+              type: 'newsFeed.from.notification.should',
+              domain_id: activity.domain_id,
+              group_id: activity.group_id,
+              post_id: activity.post_id,
+              community_id: activity.community_id,
+              latest_activity_at: activity.created_at
+            }));
+          });
+          notificationsToBuild = other;
           seriesCallback();
         }
-      }).catch(function (error) {
+      });
+    },
+    function (seriesCallback) {
+      findRecommendedScopes(notificationsToBuild, function (error, recommended) {
+        if (!error) {
+          recommended.forEach(function (item) {
+            var options = { type: 'newsFeed.from.notification.recommendation' };
+            options[item.scope.column] = _.last(item.notification.AcActivities)[item.scope.column];
+            items.push(itemFromNotification(item.notification, options));
+          });
+        }
         seriesCallback(error);
       });
     },
     function (seriesCallback) {
-      if (news_feed_item) {
-        seriesCallback();
-      } else {
-        buildNewsFeedItems(notification, seriesCallback);
-      }
+      createItems(items, seriesCallback);
     }
   ], function (error) {
     if (error) {
-      log.error("Generate News Feed Notifications Error", { err: error });
+      log.error("Generate News Feed Notifications Error", { err: error, notificationsLength: notifications.length });
       if(airbrake) {
         airbrake.notify(error).then((airbrakeErr)=> {
           if (airbrakeErr.error) {
-            log.error("AirBrake Error", { context: 'airbrake', user: toJson(req.user), err: airbrakeErr.error, errorStatus: 500 });
+            log.error("AirBrake Error", { context: 'airbrake', err: airbrakeErr.error, errorStatus: 500 });
           }
         });
       }
@@ -265,3 +325,74 @@ module.exports = function (notification, user, callback) {
     callback(error);
   });
 };
+
+var pendingBatch = [];
+var pendingTimer = null;
+
+// Notifications without an activity can not be batched, they would fail the whole batch
+var validateNotification = function (notification) {
+  if (!notification || !notification.id) {
+    return "News feed notification is missing";
+  } else if (_.isEmpty(notification.AcActivities) || !_.last(notification.AcActivities)) {
+    return "News feed notification " + notification.id + " has no activities";
+  } else {
+    return null;
+  }
+};
+
+// Processes the notifications of a failed batch one by one, so the error only reaches the jobs
+// that caused it
+var processOneByOne = function (batch) {
+  async.eachLimit(batch, FALLBACK_CONCURRENCY, function (item, eachCallback) {
+    var done = _.once(function (error) {
+      item.callback(error);
+      eachCallback();
+    });
+    try {
+      generateNewsFeedItemsFromNotifications([item.notification], done);
+    } catch (error) {
+      done(error);
+    }
+  });
+};
+
+var flushPendingBatch = function () {
+  var batch = pendingBatch;
+  pendingBatch = [];
+  clearTimeout(pendingTimer);
+  pendingTimer = null;
+  var done = _.once(function (error) {
+    if (error && batch.length > 1) {
+      log.warn("Generate News Feed Notifications batch failed, processing one by one", { batchLength: batch.length });
+      processOneByOne(batch);
+    } else {
+      batch.forEach(function (item) {
+        item.callback(error);
+      });
+    }
+  });
+  try {
+    generateNewsFeedItemsFromNotifications(_.map(batch, 'notification'), done);
+  } catch (error) {
+    done(error);
+  }
+};
+
+// Per job entry point, the notification joins the current batch
+module.exports = function (notification, user, callback) {
+  var validationError = validateNotification(notification);
+  if (validationError) {
+    log.error("Generate News Feed Notifications Error", { err: validationError });
+    callback(validationError);
+    return;
+  }
+  pendingBatch.push({ notification: notification, callback: callback });
+  if (pendingBatch.length >= MAX_BATCH_SIZE) {
+    flushPendingBatch();
+  } else if (!pendingTimer) {
+    pendingTimer = setTimeout(flushPendingBatch, BATCH_WINDOW_MS);
+  }
+};
+
+module.exports.generateNewsFeedItemsFromNotifications = generateNewsFeedItemsFromNotifications;
+module.exports.MAX_BATCH_SIZE = MAX_BATCH_SIZE;
@@ -0,0 +1,76 @@
+var _ = require('lodash');
+
+// Set based filters used when generating news feeds dynamically, kept free of the models so
+// they can be benchmarked on synthetic activities
+
+var RECOMMENDATION_FILTER_THRESHOLD = 14;
+
+// Keeps the activities of recommended posts, topped up with random not recommended posts up to
+// RECOMMENDATION_FILTER_THRESHOLD, plus the user's own activities and activities without a post
+var selectRecommendedActivities = function (allActivities, recommendedItemIds, userId) {
+  var myActivities = [];
+  var noPostActivities = [];
+  var postActivities = [];
+  var currentPostIds = new Set();
+
+  allActivities.forEach(function (activity) {
+    if (activity.user_id == userId) {
+      myActivities.push(activity);
+    } else if (!activity.post_id) {
+      noPostActivities.push(activity);
+    } else {
+      postActivities.push(activity);
+      currentPostIds.add(activity.post_id.toString());
+    }
+  });
+
+  var recommendedSet = new Set(_.map(recommendedItemIds, function (id) { return id.toString() }));
+  var recommendedPostIds = [];
+  var notRecommendedPostIds = [];
+  currentPostIds.forEach(function (postId) {
+    if (recommendedSet.has(postId)) {
+      recommendedPostIds.push(postId);
+    } else {
+      notRecommendedPostIds.push(postId);
+    }
+  });
+
+  var finalPostIds;
+  if (recommendedPostIds.length<RECOMMENDATION_FILTER_THRESHOLD) {
+    // Fill up with random not recommended posts
+    finalPostIds = _.concat(recommendedPostIds,
+      _.sampleSize(notRecommendedPostIds, RECOMMENDATION_FILTER_THRESHOLD-recommendedPostIds.length));
+  } else {
+    finalPostIds = recommendedPostIds;
+  }
+
+  var finalPostIdSet = new Set(finalPostIds);
+  return {
+    activities: _.concat(_.filter(postActivities, function (activity) {
+      return finalPostIdSet.has(activity.post_id.toString());
+    }), myActivities, noPostActivities),
+    recommendedCount: recommendedPostIds.length,
+    notRecommendedCount: notRecommendedPostIds.length
+  };
+};
+
+// Drops repeated activities and those already in the news feed, savedActivityIds are the
+// ac_activity_id values of the existing news feed items
+var removeSavedActivities = function (allActivities, savedActivityIds) {
+  var seen = new Set(_.map(savedActivityIds, function (id) { return id.toString() }));
+  return _.filter(allActivities, function (activity) {
+    var id = activity.id.toString();
+    if (seen.has(id)) {
+      return false;
+    } else {
+      seen.add(id);
+      return true;
+    }
+  });
+};
+
+module.exports = {
+  RECOMMENDATION_FILTER_THRESHOLD: RECOMMENDATION_FILTER_THRESHOLD,
+  selectRecommendedActivities: selectRecommendedActivities,
+  removeSavedActivities: removeSavedActivities
+};
@@ -0,0 +1,82 @@
+var _ = require('lodash');
+var filters = require('./news_feed_filters.cjs');
+
+// Compares the set based news feed filters with the previous _.includes based ones on a
+// synthetic user with many activities and recommendations
+//   node news_feed_filters_benchmark.cjs [numberOfActivities]
+
+var NUMBER_OF_ACTIVITIES = process.argv[2] ? parseInt(process.argv[2]) : 10000;
+var USER_ID = 1;
+
+var makeActivities = function (count) {
+  var activities = [];
+  for (var i = 0; i < count; i++) {
+    activities.push({
+      id: i + 1,
+      user_id: i % 50 === 0 ? USER_ID : 2 + (i % 997),
+      post_id: i % 20 === 0 ? null : 1 + (i % Math.floor(count / 2)),
+      created_at: new Date(Date.now() - i * 1000)
+    });
+  }
+  return activities;
+};
+
+var previousFilterRecommendations = function (allActivities, recommendedItemIds, userId) {
+  var myActivities = _.filter(allActivities, function (activity) { return activity.user_id == userId});
+  allActivities = _.filter(allActivities, function (activity) { return activity.user_id != userId});
+  var noPostActivities = _.filter(allActivities, function (activity) { return !activity.post_id });
+  allActivities = _.filter(allActivities, function (activity) { return activity.post_id });
+  var currentPostIds = _.map(allActivities, function (item) { return item.post_id ? item.post_id.toString() : null; });
+  currentPostIds =_.uniq(currentPostIds);
+  currentPostIds = _.without(currentPostIds, null);
+  var recommendedPostIds = _.filter(currentPostIds, function (activity) { return _.includes(recommendedItemIds, activity) });
+  var notRecommendedPostIds = _.filter(currentPostIds, function (activity) { return !_.includes(recommendedItemIds, activity)});
+  var finalPostIds;
+  if (recommendedPostIds.length<filters.RECOMMENDATION_FILTER_THRESHOLD) {
+    notRecommendedPostIds = _.shuffle(notRecommendedPostIds);
+    finalPostIds = _.concat(recommendedPostIds, _.dropRight(notRecommendedPostIds, notRecommendedPostIds.length-(filters.RECOMMENDATION_FILTER_THRESHOLD-recommendedPostIds.length)));
+  } else {
+    finalPostIds = recommendedPostIds;
+  }
+  allActivities = _.filter(allActivities, function (activity) { return (activity.post_id && _.includes(finalPostIds, activity.post_id.toString()))});
+  return _.concat(allActivities, myActivities, noPostActivities);
+};
+
+var previousRemoveDuplicates = function (allActivities, savedActivityIds) {
+  allActivities =_.uniq(allActivities);
+  return _.filter(allActivities, function (activity) { return !_.includes(savedActivityIds, activity.id)});
+};
+
+var time = function (name, fn) {
+  var start = process.hrtime.bigint();
+  var result = fn();
+  var ms = Number(process.hrtime.bigint() - start) / 1e6;
+  console.log(name + ": " + ms.toFixed(1) + "ms, " + result.length + " activities");
+  return ms;
+};
+
+var activities = makeActivities(NUMBER_OF_ACTIVITIES);
+var recommendedItemIds = _.map(_.sampleSize(_.uniq(_.compact(_.map(activities, 'post_id'))), Math.floor(NUMBER_OF_ACTIVITIES / 4)),
+  function (id) { return id.toString() });
+var savedActivityIds = _.map(_.sampleSize(activities, Math.floor(NUMBER_OF_ACTIVITIES / 2)), 'id');
+
+console.log("Synthetic user with " + activities.length + " activities, " + recommendedItemIds.length +
+  " recommended posts and " + savedActivityIds.length + " saved items");
+
+var before = time("Previous filterRecommendations", function () {
+  return previousFilterRecommendations(activities, recommendedItemIds, USER_ID);
+});
+var after = time("Set based selectRecommendedActivities", function () {
+  return filters.selectRecommendedActivities(activities, recommendedItemIds, USER_ID).activities;
+});
+console.log("Speedup " + (before / after).toFixed(1) + "x\n");
+
+// The previous version also compared the ids with model objects and removed nothing,
+// here it is timed with plain ids
+before = time("Previous removeDuplicates", function () {
+  return previousRemoveDuplicates(activities, savedActivityIds);
+});
+after = time("Set based removeSavedActivities", function () {
+  return filters.removeSavedActivities(activities, savedActivityIds);
+});
+console.log("Speedup " + (before / after).toFixed(1) + "x");
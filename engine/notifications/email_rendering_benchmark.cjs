@@ -0,0 +1,95 @@
+const path = require('path');
+const ejs = require('ejs');
+const Backend = require('i18next-fs-backend');
+const i18n = require('../../utils/i18n.cjs');
+const emailTemplates = require('./email_templates.cjs');
+
+// Renders welcome emails in mixed locales with 20 concurrent jobs, like the send-one-email queue,
+// once the old way (renderFile without a cache after the shared i18n.changeLanguage) and once with
+// the compiled templates and per locale translators. Prints emails per second and how many emails
+// came out in another language than their own.
+//   node email_rendering_benchmark.cjs [numberOfEmails]
+
+const NUMBER_OF_EMAILS = process.argv[2] ? parseInt(process.argv[2]) : 1000;
+const CONCURRENCY = 20;
+const LOCALES = ['en', 'is', 'fr', 'es', 'de', 'pl'];
+const TEMPLATE_PATH = path.join(emailTemplates.templatesDir, 'welcome');
+
+const getLocals = (locale) => ({
+  user: { id: 1, name: 'Benchmark User', email: 'benchmark@example.com', default_locale: locale },
+  domain: { domain_name: 'example.com', name: 'Example' },
+  community: { name: 'Example community', hostname: 'app' },
+  envValues: null,
+  headerImageUrl: '',
+  linkTo: (url) => '<a href="' + url + '">' + url + '</a>',
+  simpleFormat: (text) => text ? text.replace(/(\n)/g, '<br>') : ''
+});
+
+const renderFileAsync = (fileName, locals) => {
+  return new Promise((resolve, reject) => {
+    ejs.renderFile(path.join(TEMPLATE_PATH, fileName), locals, {}, (error, rendered) => error ? reject(error) : resolve(rendered));
+  });
+};
+
+const renderOld = async (locale) => {
+  await new Promise((resolve, reject) => i18n.changeLanguage(locale, error => error ? reject(error) : resolve()));
+  const locals = Object.assign(getLocals(locale), { t: (text) => i18n.t(text) });
+  const [html, text] = await Promise.all([renderFileAsync('html.ejs', locals), renderFileAsync('text.ejs', locals)]);
+  return { html, text };
+};
+
+const renderNew = async (locale) => {
+  const t = await new Promise((resolve, reject) => emailTemplates.getEmailTranslator(locale, (error, fixedT) => error ? reject(error) : resolve(fixedT)));
+  const locals = Object.assign(getLocals(locale), { t: (text) => t(text) });
+  return await new Promise((resolve, reject) => {
+    emailTemplates.renderTemplateWithLocals(TEMPLATE_PATH, locals, (error, results) => error ? reject(error) : resolve(results));
+  });
+};
+
+const run = async (name, render, expected) => {
+  const locales = [];
+  for (let i = 0; i < NUMBER_OF_EMAILS; i++) {
+    locales.push(LOCALES[i % LOCALES.length]);
+  }
+  let nextIndex = 0;
+  let wrongLanguage = 0;
+  const start = Date.now();
+  await Promise.all([...Array(CONCURRENCY).keys()].map(async () => {
+    while (nextIndex < locales.length) {
+      const locale = locales[nextIndex++];
+      const results = await render(locale);
+      if (expected && results.html !== expected[locale]) {
+        wrongLanguage += 1;
+      }
+    }
+  }));
+  const seconds = (Date.now() - start) / 1000;
+  console.log(`${name}: ${NUMBER_OF_EMAILS} emails in ${seconds.toFixed(2)}s, ${Math.round(NUMBER_OF_EMAILS / seconds)} emails/s, ${wrongLanguage} in the wrong language`);
+};
+
+i18n.use(Backend).init({
+  preload: LOCALES,
+  fallbackLng: 'en',
+  lowerCaseLng: true,
+  backend: {
+    loadPath: path.resolve(__dirname, '../../locales') + '/{{lng}}/translation.json'
+  }
+}, async (error) => {
+  try {
+    const compileStart = Date.now();
+    const count = emailTemplates.compileEmailTemplates();
+    console.log(`Compiled ${count} templates in ${Date.now() - compileStart}ms`);
+
+    // The old way is correct when only one email is rendered at a time
+    const expected = {};
+    for (const locale of LOCALES) {
+      expected[locale] = (await renderOld(locale)).html;
+    }
+
+    await run('renderFile and changeLanguage', renderOld, expected);
+    await run('Compiled templates and getFixedT', renderNew, expected);
+  } catch (error) {
+    console.error(error);
+  }
+  process.exit();
+});
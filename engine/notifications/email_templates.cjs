@@ -0,0 +1,95 @@
+var log = require("../../utils/logger.cjs");
+var path = require("path");
+var fs = require("fs");
+var ejs = require("ejs");
+var i18n = require("../../utils/i18n.cjs");
+
+// Compiled email templates and per locale translators for sendOneEmail.
+// Each html.ejs and text.ejs is compiled once per process, the header and footer includes are
+// kept in the ejs cache. Emails are translated with a translator fixed to their locale, so
+// concurrent send-one-email jobs do not switch the shared i18n language under each other.
+
+var templatesDir = path.resolve(
+  __dirname,
+  "..",
+  "..",
+  "email_templates",
+  "notifications"
+);
+
+var compiledTemplates = new Map();
+var translators = new Map();
+
+var compileTemplateFile = function (filePath) {
+  var compiled = ejs.compile(fs.readFileSync(filePath, "utf8"), {
+    filename: filePath,
+    cache: true,
+  });
+  compiledTemplates.set(filePath, compiled);
+  return compiled;
+};
+
+var getCompiledTemplate = function (filePath) {
+  return compiledTemplates.get(filePath) || compileTemplateFile(filePath);
+};
+
+/**
+ * Compiles all notification templates, called at worker start so the first emails do not
+ * compile them. Returns the number of compiled templates.
+ */
+var compileEmailTemplates = function () {
+  fs.readdirSync(templatesDir, { withFileTypes: true }).forEach(function (entry) {
+    if (entry.isDirectory()) {
+      ["html.ejs", "text.ejs"].forEach(function (fileName) {
+        var filePath = path.join(templatesDir, entry.name, fileName);
+        if (fs.existsSync(filePath)) {
+          try {
+            compileTemplateFile(filePath);
+          } catch (error) {
+            log.error("Could not compile email template", { filePath: filePath, err: error });
+          }
+        }
+      });
+    }
+  });
+  log.info("Compiled email templates", { count: compiledTemplates.size });
+  return compiledTemplates.size;
+};
+
+var renderTemplateWithLocals = function (templatePath, locals, done) {
+  var results;
+  try {
+    results = {
+      html: getCompiledTemplate(path.join(templatePath, "html.ejs"))(locals),
+      text: getCompiledTemplate(path.join(templatePath, "text.ejs"))(locals),
+    };
+  } catch (error) {
+    return done(error);
+  }
+  done(null, results);
+};
+
+/**
+ * Calls back with a t function fixed to the locale, the locale's translations are loaded first
+ * when they were not preloaded
+ */
+var getEmailTranslator = function (locale, callback) {
+  if (translators.has(locale)) {
+    return callback(null, translators.get(locale));
+  }
+  i18n.loadLanguages(locale, function (error) {
+    if (error) {
+      return callback(error);
+    }
+    var t = i18n.getFixedT(locale);
+    translators.set(locale, t);
+    callback(null, t);
+  });
+};
+
+module.exports = {
+  templatesDir: templatesDir,
+  compileEmailTemplates: compileEmailTemplates,
+  renderTemplateWithLocals: renderTemplateWithLocals,
+  getEmailTranslator: getEmailTranslator,
+};
@@ -4,8 +4,7 @@ var log = require("../../utils/logger.cjs");
 var async = require("async");
 var path = require("path");
 var nodemailer = require("nodemailer");
-var ejs = require("ejs");
-var i18n = require("../../utils/i18n.cjs");
+var emailTemplates = require("./email_templates.cjs");
 var airbrake = null;
 
 const redisConnection = require("../../utils/redisConnection.cjs");
@@ -16,21 +15,9 @@ if (process.env.AIRBRAKE_PROJECT_ID) {
 
 var fs = require("fs");
 
-var templatesDir = path.resolve(
-  __dirname,
-  "..",
-  "..",
-  "email_templates",
-  "notifications"
-);
-
 var queue = require("../../workers/queue.cjs");
 var models = require("../../../models/index.cjs");
 
-var i18nFilter = function (text) {
-  return i18n.t(text);
-};
-
 var transport = null;
 
 if (process.env.SENDGRID_API_KEY) {
@@ -94,52 +81,12 @@ if (process.env.SENDGRID_API_KEY) {
   });
 }
 
-const renderTemplateWithLocals = (templatePath, locals, done) => {
-  let html;
-  let text;
-
-  async.parallel([
-    (callback) => {
-      ejs.renderFile(
-        path.join(templatePath, "html.ejs"),
-        locals,
-        {},
-        (err, rendered) => {
-          if (err) {
-            callback(err);
-          } else {
-            html = rendered;
-            callback();
-          }
-        }
-      );
-    },
-    (callback) => {
-      ejs.renderFile(
-        path.join(templatePath, "text.ejs"),
-        locals,
-        {},
-        (err, rendered) => {
-          if (err) {
-            callback(err);
-          } else {
-            text = rendered;
-            callback();
-          }
-        }
-      );
-    }
-  ], (error) => {
-    done(error, { html, text });
-  })
-};
-
-const translateSubject = function (subjectHash) {
+const translateSubject = function (subjectHash, t) {
   if (typeof subjectHash === 'string') {
-    return i18n.t(subjectHash);
+    return t(subjectHash);
   }
 
-  var subject = i18n.t(subjectHash.translateToken);
+  var subject = t(subjectHash.translateToken);
   if (subjectHash.contentName) {
     subject += ": " + subjectHash.contentName;
   }
@@ -327,6 +274,8 @@ var sendOneEmail = function (emailLocals, callback) {
     let fromEmail = null;
     let sender = null;
     let replyTo = null;
+    let locale = null;
+    let t = null;
 
     let envValues = null;
 
@@ -375,7 +324,6 @@ var sendOneEmail = function (emailLocals, callback) {
           },
 
           function (seriesCallback) {
-            emailLocals["t"] = i18nFilter;
             emailLocals["linkTo"] = linkTo;
             emailLocals["simpleFormat"] = function (text) {
               if (text) {
@@ -495,8 +443,6 @@ var sendOneEmail = function (emailLocals, callback) {
           },
 
           function (seriesCallback) {
-            var locale;
-
             if (
               emailLocals.post &&
               emailLocals.point &&
@@ -530,15 +476,21 @@ var sendOneEmail = function (emailLocals, callback) {
               locale = locale.toLowerCase();
             }
 
-            i18n.changeLanguage(locale, function (err, t) {
+            emailTemplates.getEmailTranslator(locale, function (err, fixedT) {
+              if (!err) {
+                t = fixedT;
+                emailLocals["t"] = function (text) {
+                  return t(text);
+                };
+              }
               seriesCallback(err);
             });
           },
 
           function (seriesCallback) {
-            log.info("EmailWorker Started Sending", { locale: i18n.language });
+            log.info("EmailWorker Started Sending", { locale: locale });
 
-            renderTemplateWithLocals(path.join(templatesDir, emailLocals.template), emailLocals, (error, results) => {
+            emailTemplates.renderTemplateWithLocals(path.join(emailTemplates.templatesDir, emailLocals.template), emailLocals, (error, results) => {
               if (error) {
                 log.error("EmailWorker Error", {
                   err: error,
@@ -546,7 +498,7 @@ var sendOneEmail = function (emailLocals, callback) {
                 });
                 seriesCallback(error);
               } else {
-                var translatedSubject = translateSubject(emailLocals.subject);
+                var translatedSubject = translateSubject(emailLocals.subject, t);
 
                 if (transport) {
                   if (
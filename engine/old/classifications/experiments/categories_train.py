@@ -3,10 +3,12 @@
 import tensorflow as tf
 import numpy as np
 import os
+import json
 import time
 import datetime
 import categories_data_helpers
 from text_cnn import TextCNN
+from step_profiler import StepProfiler
 
 # Parameters
 # ==================================================
@@ -23,10 +25,21 @@ tf.flags.DEFINE_integer("batch_size", 64, "Batch Size (default: 64)")
 tf.flags.DEFINE_integer("num_epochs", 200, "Number of training epochs (default: 200)")
 tf.flags.DEFINE_integer("evaluate_every", 100, "Evaluate model on dev set after this many steps (default: 100)")
 tf.flags.DEFINE_integer("checkpoint_every", 100, "Save model after this many steps (default: 100)")
+tf.flags.DEFINE_boolean("bucket_batches", True, "Group batches by sentence length and pad them per bucket (default: True)")
+tf.flags.DEFINE_integer("num_buckets", 8, "Number of sentence length buckets (default: 8)")
+tf.flags.DEFINE_integer("profile_every", 100, "Print a step timing summary after this many steps (default: 100)")
+
+# Data Parameters
+tf.flags.DEFINE_string("data_cache_dir", categories_data_helpers.DATA_CACHE_DIR, "Directory for the preprocessed dataset cache, empty to disable")
+tf.flags.DEFINE_float("dedupe_threshold", categories_data_helpers.DEDUPE_THRESHOLD, "Drop near-duplicate texts above this similarity, 0 to keep all (default: 0.8)")
+tf.flags.DEFINE_integer("num_folds", 0, "Number of cross-validation folds, 0 holds out the last 1000 examples (default: 0)")
+tf.flags.DEFINE_integer("fold", 0, "Fold used as dev set when num_folds is set (default: 0)")
 
 # Misc Parameters
 tf.flags.DEFINE_boolean("allow_soft_placement", True, "Allow device soft device placement")
 tf.flags.DEFINE_boolean("log_device_placement", False, "Log placement of ops on devices")
+tf.flags.DEFINE_integer("num_threads", 0, "Threads per TensorFlow op pool, 0 lets TensorFlow decide (default: 0)")
+tf.flags.DEFINE_string("out_dir", "", "Output directory for summaries and checkpoints (default: runs/<timestamp>)")
 
 FLAGS = tf.flags.FLAGS
 FLAGS.batch_size
@@ -41,16 +54,21 @@ print("")
 
 # Load data
 print("Loading data...")
-x, y, vocabulary, vocabulary_inv = categories_data_helpers.load_data()
-# Randomly shuffle data
-np.random.seed(10)
-shuffle_indices = np.random.permutation(np.arange(len(y)))
-x_shuffled = x[shuffle_indices]
-y_shuffled = y[shuffle_indices]
-# Split train/test set
-# TODO: This is very crude, should use cross-validation
-x_train, x_dev = x_shuffled[:-1000], x_shuffled[-1000:]
-y_train, y_dev = y_shuffled[:-1000], y_shuffled[-1000:]
+x, y, vocabulary, vocabulary_inv = categories_data_helpers.load_data(cache_dir=FLAGS.data_cache_dir, dedupe_threshold=FLAGS.dedupe_threshold)
+if FLAGS.num_folds:
+    # Cross-validation fold, sweep.py runs every fold
+    train_indices, dev_indices = categories_data_helpers.kfold_indices(len(y), FLAGS.num_folds, FLAGS.fold)
+    x_train, x_dev = x[train_indices], x[dev_indices]
+    y_train, y_dev = y[train_indices], y[dev_indices]
+else:
+    # Randomly shuffle data
+    np.random.seed(10)
+    shuffle_indices = np.random.permutation(np.arange(len(y)))
+    x_shuffled = x[shuffle_indices]
+    y_shuffled = y[shuffle_indices]
+    # Split train/test set
+    x_train, x_dev = x_shuffled[:-1000], x_shuffled[-1000:]
+    y_train, y_dev = y_shuffled[:-1000], y_shuffled[-1000:]
 print("Vocabulary Size: {:d}".format(len(vocabulary)))
 print("Train/Dev split: {:d}/{:d}".format(len(y_train), len(y_dev)))
 
@@ -61,11 +79,13 @@ print("Train/Dev split: {:d}/{:d}".format(len(y_train), len(y_dev)))
 with tf.Graph().as_default():
     session_conf = tf.ConfigProto(
       allow_soft_placement=FLAGS.allow_soft_placement,
-      log_device_placement=FLAGS.log_device_placement)
+      log_device_placement=FLAGS.log_device_placement,
+      intra_op_parallelism_threads=FLAGS.num_threads,
+      inter_op_parallelism_threads=FLAGS.num_threads)
     sess = tf.Session(config=session_conf)
     with sess.as_default():
         cnn = TextCNN(
-            sequence_length=x_train.shape[1],
+            sequence_length=None if FLAGS.bucket_batches else x_train.shape[1],
             num_classes=2,
             vocab_size=len(vocabulary),
             embedding_size=FLAGS.embedding_dim,
@@ -91,9 +111,14 @@ with tf.Graph().as_default():
 
         # Output directory for models and summaries
         timestamp = str(int(time.time()))
-        out_dir = os.path.abspath(os.path.join(os.path.curdir, "runs", timestamp))
+        out_dir = os.path.abspath(FLAGS.out_dir or os.path.join(os.path.curdir, "runs", timestamp))
         print("Writing to {}\n".format(out_dir))
 
+        # Vocabulary, needed to map new text to ids when scoring with score.py
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        categories_data_helpers.save_vocabulary(os.path.join(out_dir, "vocabulary.json"), vocabulary_inv)
+
         # Summaries for loss and accuracy
         loss_summary = tf.scalar_summary("loss", cnn.loss)
         acc_summary = tf.scalar_summary("accuracy", cnn.accuracy)
@@ -127,12 +152,14 @@ with tf.Graph().as_default():
               cnn.input_y: y_batch,
               cnn.dropout_keep_prob: FLAGS.dropout_keep_prob
             }
-            _, step, summaries, loss, accuracy = sess.run(
-                [train_op, global_step, train_summary_op, cnn.loss, cnn.accuracy],
-                feed_dict)
+            with profiler.phase("compute"):
+                _, step, summaries, loss, accuracy = sess.run(
+                    [train_op, global_step, train_summary_op, cnn.loss, cnn.accuracy],
+                    feed_dict)
             time_str = datetime.datetime.now().isoformat()
             print("{}: step {}, loss {:g}, acc {:g}".format(time_str, step, loss, accuracy))
-            train_summary_writer.add_summary(summaries, step)
+            with profiler.phase("summary"):
+                train_summary_writer.add_summary(summaries, step)
 
         def dev_step(x_batch, y_batch, writer=None):
             """
@@ -150,19 +177,53 @@ with tf.Graph().as_default():
             print("{}: step {}, loss {:g}, acc {:g}".format(time_str, step, loss, accuracy))
             if writer:
                 writer.add_summary(summaries, step)
+            return loss, accuracy
 
         # Generate batches
-        batches = categories_data_helpers.batch_iter(
-            zip(x_train, y_train), FLAGS.batch_size, FLAGS.num_epochs)
+        if FLAGS.bucket_batches:
+            batches = categories_data_helpers.bucket_batch_iter(
+                x_train, y_train, FLAGS.batch_size, FLAGS.num_epochs,
+                categories_data_helpers.sentence_lengths(x_train, vocabulary[categories_data_helpers.PADDING_WORD]),
+                num_buckets=FLAGS.num_buckets,
+                min_length=max(map(int, FLAGS.filter_sizes.split(","))))
+        else:
+            batches = (zip(*batch) for batch in categories_data_helpers.batch_iter(
+                zip(x_train, y_train), FLAGS.batch_size, FLAGS.num_epochs))
+        # Per step timing of data, compute, summary, checkpoint and eval work
+        profiler = StepProfiler(os.path.join(out_dir, "steps.csv"), FLAGS.profile_every)
+        batches = iter(batches)
         # Training loop. For each batch...
-        for batch in batches:
-            x_batch, y_batch = zip(*batch)
+        train_start = time.time()
+        train_examples = 0
+        while True:
+            with profiler.phase("data"):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            x_batch, y_batch = batch
             train_step(x_batch, y_batch)
+            train_examples += len(y_batch)
             current_step = tf.train.global_step(sess, global_step)
             if current_step % FLAGS.evaluate_every == 0:
                 print("\nEvaluation:")
-                dev_step(x_dev, y_dev, writer=dev_summary_writer)
+                with profiler.phase("eval"):
+                    dev_step(x_dev, y_dev, writer=dev_summary_writer)
                 print("")
             if current_step % FLAGS.checkpoint_every == 0:
-                path = saver.save(sess, checkpoint_prefix, global_step=current_step)
-                print("Saved model checkpoint to {}\n".format(path))
\ No newline at end of file
+                with profiler.phase("checkpoint"):
+                    path = saver.save(sess, checkpoint_prefix, global_step=current_step)
+                print("Saved model checkpoint to {}\n".format(path))
+            profiler.end_step(current_step, len(y_batch))
+        profiler.close(os.path.join(out_dir, "profile.json"))
+
+        # Final evaluation, read by sweep.py
+        train_time = time.time() - train_start
+        print("\nFinal evaluation:")
+        dev_loss, dev_accuracy = dev_step(x_dev, y_dev, writer=dev_summary_writer)
+        with open(os.path.join(out_dir, "results.json"), "w") as results_file:
+            json.dump({
+                "dev_loss": float(dev_loss),
+                "dev_accuracy": float(dev_accuracy),
+                "train_time": train_time,
+                "examples_per_sec": train_examples / train_time if train_time else 0.0
+            }, results_file)
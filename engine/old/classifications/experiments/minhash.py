@@ -0,0 +1,131 @@
+import zlib
+import numpy as np
+
+MAX_HASH = np.uint64(0xFFFFFFFF)
+
+
+class MinHashLSHIndex(object):
+    """
+    Near-duplicate index over token lists, such as the output of clean_str().split(" ").
+    Every text gets a MinHash signature of num_perm values over its token shingles. The
+    signature is split into bands and texts sharing any band are candidates. Candidates are
+    then checked against the estimated Jaccard similarity, so query cost depends on the number
+    of near-duplicates and not on the size of the index. Texts can be added one at a time and
+    the index can be saved and loaded, so it can be grown across exports.
+    """
+    def __init__(self, threshold=0.8, num_perm=64, bands=8, shingle_size=2, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm has to be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        # Multiply-shift hashing, the high 32 bits of a * x + b with odd a are a universal hash
+        random_state = np.random.RandomState(seed)
+        self.a = random_state.randint(0, 2 ** 62, num_perm, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = random_state.randint(0, 2 ** 62, num_perm, dtype=np.int64).astype(np.uint64)
+        self.keys = []
+        self.signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._size = 0
+        self.buckets = [{} for _ in range(bands)]
+
+    def __len__(self):
+        return self._size
+
+    def shingles(self, tokens):
+        """
+        Hashes the token n-grams of a text, texts shorter than shingle_size use their tokens.
+        """
+        tokens = [token for token in tokens if token]
+        n = self.shingle_size if len(tokens) >= self.shingle_size else 1
+        grams = set(u" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return np.array([zlib.crc32(gram.encode("utf-8")) & 0xFFFFFFFF for gram in grams], dtype=np.uint64)
+
+    def signature(self, tokens):
+        """
+        Returns the MinHash signature of a token list, or None when it has no tokens.
+        """
+        hashes = self.shingles(tokens)
+        if len(hashes) == 0:
+            return None
+        with np.errstate(over="ignore"):
+            permuted = (self.a[:, None] * hashes[None, :] + self.b[:, None]) >> np.uint64(32)
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def _grow(self):
+        capacity = max(1024, 2 * len(self.signatures))
+        signatures = np.empty((capacity, self.num_perm), dtype=np.uint32)
+        signatures[:self._size] = self.signatures[:self._size]
+        self.signatures = signatures
+
+    def add(self, key, tokens=None, signature=None):
+        """
+        Adds a text under key, returns False when it has no tokens and was not indexed.
+        """
+        if signature is None:
+            signature = self.signature(tokens)
+        if signature is None:
+            return False
+        if self._size == len(self.signatures):
+            self._grow()
+        position = self._size
+        self.signatures[position] = signature
+        self.keys.append(key)
+        self._size += 1
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self.buckets[band].setdefault(band_key, []).append(position)
+        return True
+
+    def query(self, tokens=None, signature=None):
+        """
+        Returns (key, estimated Jaccard similarity) of the indexed near-duplicates of a text,
+        most similar first.
+        """
+        if signature is None:
+            signature = self.signature(tokens)
+        if signature is None:
+            return []
+        candidates = set()
+        for band, band_key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(band_key, ()))
+        if not candidates:
+            return []
+        positions = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarities = (self.signatures[positions] == signature).mean(axis=1)
+        matches = np.flatnonzero(similarities >= self.threshold)
+        matches = matches[np.argsort(-similarities[matches], kind="mergesort")]
+        return [(self.keys[positions[i]], float(similarities[i])) for i in matches]
+
+    def save(self, filename):
+        np.savez(filename, signatures=self.signatures[:self._size], keys=np.array(self.keys),
+                 params=np.array([self.threshold, self.num_perm, self.bands, self.shingle_size, self.seed]))
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        threshold, num_perm, bands, shingle_size, seed = data["params"]
+        index = cls(float(threshold), int(num_perm), int(bands), int(shingle_size), int(seed))
+        for key, signature in zip(data["keys"].tolist(), data["signatures"]):
+            index.add(key, signature=signature)
+        return index
+
+
+def deduplicate(sentences, threshold=0.8, **index_options):
+    """
+    Returns the indices of the sentences to keep, dropping every sentence that is a
+    near-duplicate of an earlier one. Sentences are token lists.
+    """
+    index = MinHashLSHIndex(threshold=threshold, **index_options)
+    keep = []
+    for i, sentence in enumerate(sentences):
+        signature = index.signature(sentence)
+        if signature is None or not index.query(signature=signature):
+            keep.append(i)
+            if signature is not None:
+                index.add(i, signature=signature)
+    return keep
@@ -5,6 +5,8 @@ class TextCNN(object):
     """
     A CNN for text classification.
     Uses an embedding layer, followed by a convolutional, max-pooling and softmax layer.
+    Pass sequence_length=None for variable length mode where every batch can have its own
+    width, as produced by data_helpers.bucket_batch_iter.
     """
     def __init__(
       self, sequence_length, num_classes, vocab_size,
@@ -43,12 +45,15 @@ class TextCNN(object):
                 # Apply nonlinearity
                 h = tf.nn.relu(tf.nn.bias_add(conv, b), name="relu")
                 # Maxpooling over the outputs
-                pooled = tf.nn.max_pool(
-                    h,
-                    ksize=[1, sequence_length - filter_size + 1, 1, 1],
-                    strides=[1, 1, 1, 1],
-                    padding='VALID',
-                    name="pool")
+                if sequence_length is None:
+                    pooled = tf.reduce_max(h, reduction_indices=[1], keep_dims=True, name="pool")
+                else:
+                    pooled = tf.nn.max_pool(
+                        h,
+                        ksize=[1, sequence_length - filter_size + 1, 1, 1],
+                        strides=[1, 1, 1, 1],
+                        padding='VALID',
+                        name="pool")
                 pooled_outputs.append(pooled)
 
         # Combine all the pooled features
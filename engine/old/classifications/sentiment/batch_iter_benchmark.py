@@ -0,0 +1,39 @@
+#! /usr/bin/env python
+
+# Compares examples/sec and padded tokens per example of batch_iter and bucket_batch_iter.
+# Tokens per example is what every convolution in TextCNN pays for, so it is the number
+# that tracks training speed once the iterator itself is no longer the bottleneck.
+#
+# Usage: python batch_iter_benchmark.py [batch_size] [num_epochs]
+
+import sys
+import time
+import numpy as np
+import data_helpers
+
+batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+num_epochs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+print("Loading data...")
+x, y, vocabulary, vocabulary_inv = data_helpers.load_data()
+lengths = data_helpers.sentence_lengths(x, vocabulary[data_helpers.PADDING_WORD])
+print("Examples: {:d}, max length: {:d}, mean length: {:.1f}".format(len(y), x.shape[1], lengths.mean()))
+
+
+def run(name, batches):
+    examples = 0
+    tokens = 0
+    start = time.time()
+    for x_batch, y_batch in batches:
+        x_batch = np.asarray(x_batch)
+        examples += len(x_batch)
+        tokens += x_batch.size
+    elapsed = time.time() - start
+    print("{:>18}: {:>12.0f} examples/sec, {:>6.1f} padded tokens/example".format(
+        name, examples / elapsed, float(tokens) / examples))
+
+
+run("batch_iter", (zip(*batch) for batch in data_helpers.batch_iter(
+    list(zip(x, y)), batch_size, num_epochs) if len(batch)))
+run("bucket_batch_iter", data_helpers.bucket_batch_iter(
+    x, y, batch_size, num_epochs, lengths, min_length=5))
@@ -2,9 +2,23 @@
 
 import numpy as np
 import re
+import os
+import json
+import shutil
+import hashlib
 import itertools
 from collections import Counter
 import unicodedata
+import minhash
+
+POSITIVE_DATA_FILE = "../../../exporters/datasets/better_reykjavik/sentiment/positive.polarity"
+NEGATIVE_DATA_FILE = "../../../exporters/datasets/better_reykjavik/sentiment/negative.polarity"
+DATA_CACHE_DIR = "data_cache"
+# Bump when the tokenization or the cached layout changes so old caches are ignored
+DATA_CACHE_VERSION = "2"
+PADDING_WORD = "<PAD/>"
+# Texts with at least this estimated Jaccard similarity to an earlier text are dropped
+DEDUPE_THRESHOLD = 0.8
 
 def strip_accents(text):
     """
@@ -25,41 +39,72 @@ def strip_accents(text):
     text = text.decode("utf-8")
     return str(text)
 
+# Text normalization spec, shared with clean() in engine/old/exporters/dataset_tools.js.
+# 1. One translate pass lowercases ASCII and folds Latin letters (U+00C0-U+024F) to their
+#    unaccented ASCII base, with Icelandic and other letters without a decomposition
+#    spelled out in NORMALIZE_LETTERS.
+# 2. One tokenizing regex drops <a> links and emits words, contractions and ( ) , ! ?
+#    as tokens. Everything else separates tokens.
+# Both implementations are checked against engine/old/exporters/normalizer_golden.jsonl
+NORMALIZE_LETTERS = {
+    u"þ": u"th", u"Þ": u"th",
+    u"ð": u"dh", u"Ð": u"dh",
+    u"æ": u"ae", u"Æ": u"ae",
+    u"ø": u"o", u"Ø": u"o",
+    u"œ": u"oe", u"Œ": u"oe",
+    u"ß": u"ss",
+    u"đ": u"d", u"Đ": u"d",
+    u"ł": u"l", u"Ł": u"l",
+    # Typographic apostrophe, so contractions split the same way as with '
+    u"\u2019": u"'",
+}
+ASCII_LETTERS = u"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+try:
+    unichr
+except NameError: # chr handles unicode on python 3
+    unichr = chr
+
+
+def build_normalize_table():
+    """
+    Builds the str.translate table for step 1 of the normalization spec.
+    """
+    table = {ord(c): c.lower() for c in ASCII_LETTERS[:26]}
+    for code in range(0xC0, 0x250):
+        base = unicodedata.normalize("NFD", unichr(code))[0]
+        if base in ASCII_LETTERS:
+            table[code] = base.lower()
+    for letter, replacement in NORMALIZE_LETTERS.items():
+        table[ord(letter)] = replacement
+    return table
+
+
+NORMALIZE_TABLE = build_normalize_table()
+TOKEN_RE = re.compile(r"<a(?=[ \t\r\n>])[^>]*>[\s\S]*?</a>|([a-z0-9]+(?=n't)|n't|'(?:s|ve|re|d|ll)|[a-z0-9]+|[(),!?])")
+
+
 def clean_str(string):
     """
     Tokenization/string cleaning for all datasets except for SST.
-    Original taken from https://github.com/yoonkim/CNN_sentence/blob/master/process_data.py
-    """
-#    string = re.sub("þ", "th", string)
- #   string = re.sub("Þ", "Th", string)
-  #  string = re.sub("ð", "d", string)
-   # string = re.sub("Ð", "D", string)
-    string = strip_accents(string)
-    string = re.sub(r"[^A-Za-z0-9(),!?\'\`]", " ", string)
-    string = re.sub(r"\'s", " \'s", string)
-    string = re.sub(r"\'ve", " \'ve", string)
-    string = re.sub(r"n\'t", " n\'t", string)
-    string = re.sub(r"\'re", " \'re", string)
-    string = re.sub(r"\'d", " \'d", string)
-    string = re.sub(r"\'ll", " \'ll", string)
-    string = re.sub(r",", " , ", string)
-    string = re.sub(r"!", " ! ", string)
-    string = re.sub(r"\(", " \( ", string)
-    string = re.sub(r"\)", " \) ", string)
-    string = re.sub(r"\?", " \? ", string)
-    string = re.sub(r"\s{2,}", " ", string)
-    return string.strip().lower()
-
-
-def load_data_and_labels():
+    Returns the lowercased tokens separated by single spaces, see the spec above.
+    Originally based on https://github.com/yoonkim/CNN_sentence/blob/master/process_data.py
+    """
+    if isinstance(string, bytes):
+        string = string.decode("utf-8")
+    # Links match with an empty token group, filter drops them
+    return u" ".join(filter(None, TOKEN_RE.findall(string.translate(NORMALIZE_TABLE))))
+
+
+def load_data_and_labels(positive_file=POSITIVE_DATA_FILE, negative_file=NEGATIVE_DATA_FILE):
     """
     Loads MR polarity data from files, splits the data into words and generates labels.
     Returns split sentences and labels.
     """
     # Load data from files
-    positive_examples = list(open("../../../exporters/datasets/better_reykjavik/sentiment/positive.polarity").readlines())
+    positive_examples = list(open(positive_file).readlines())
     positive_examples = [s.strip() for s in positive_examples]
-    negative_examples = list(open("../../../exporters/datasets/better_reykjavik/sentiment/negative.polarity").readlines())
+    negative_examples = list(open(negative_file).readlines())
     negative_examples = [s.strip() for s in negative_examples]
     # Split by words
     x_text = positive_examples + negative_examples
@@ -72,7 +117,7 @@ def load_data_and_labels():
     return [x_text, y]
 
 
-def pad_sentences(sentences, padding_word="<PAD/>"):
+def pad_sentences(sentences, padding_word=PADDING_WORD):
     """
     Pads all sentences to the same length. The length is defined by the longest sentence.
     Returns padded sentences.
@@ -110,16 +155,126 @@ def build_input_data(sentences, labels, vocabulary):
     return [x, y]
 
 
-def load_data():
+def build_token_matrix(sentences, vocabulary, padding_word=PADDING_WORD):
+    """
+    Maps unpadded sentences straight into a padded int32 matrix.
+    Avoids building padded Python lists; every row is filled from one flat id array.
+    """
+    lengths = np.array([len(sentence) for sentence in sentences], dtype=np.int32)
+    sequence_length = int(lengths.max())
+    x = np.full((len(sentences), sequence_length), vocabulary[padding_word], dtype=np.int32)
+    word_ids = np.fromiter((vocabulary[word] for word in itertools.chain(*sentences)),
+                           dtype=np.int32, count=int(lengths.sum()))
+    x[np.arange(sequence_length) < lengths[:, None]] = word_ids
+    return x
+
+
+def build_padded_vocab(sentences, padding_word=PADDING_WORD):
+    """
+    Builds a vocabulary like build_vocab(pad_sentences(sentences)) but counts the padding
+    instead of materializing it. The padding word is always part of the vocabulary.
+    """
+    word_counts = Counter(itertools.chain(*sentences))
+    sequence_length = max(len(x) for x in sentences)
+    word_counts[padding_word] += sum(sequence_length - len(x) for x in sentences)
+    vocabulary_inv = [x[0] for x in word_counts.most_common()]
+    vocabulary = {x: i for i, x in enumerate(vocabulary_inv)}
+    return [vocabulary, vocabulary_inv]
+
+
+def data_cache_key(filenames, dedupe_threshold=None):
+    """
+    Hashes the contents of the source files so the cache is rebuilt when the export changes.
+    """
+    digest = hashlib.sha1("{}:{}".format(DATA_CACHE_VERSION, dedupe_threshold).encode("utf-8"))
+    for filename in filenames:
+        with open(filename, "rb") as source_file:
+            for chunk in iter(lambda: source_file.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_vocabulary(filename, vocabulary_inv):
+    """
+    Writes the inverse vocabulary as a JSON list, the index of a word is its id.
+    """
+    with open(filename, "w") as vocabulary_file:
+        json.dump(vocabulary_inv, vocabulary_file)
+
+
+def load_vocabulary(filename):
+    """
+    Reads a vocabulary written by save_vocabulary.
+    Returns vocabulary mapping and inverse vocabulary mapping.
+    """
+    with open(filename) as vocabulary_file:
+        vocabulary_inv = json.load(vocabulary_file)
+    vocabulary = {word: i for i, word in enumerate(vocabulary_inv)}
+    return [vocabulary, vocabulary_inv]
+
+
+def save_data_cache(cache_path, x, y, vocabulary_inv):
+    """
+    Persists the token matrix, labels and vocabulary, writing to a temporary directory first
+    so an interrupted run never leaves a half written cache behind.
+    """
+    tmp_path = "{}.tmp{}".format(cache_path, os.getpid())
+    if not os.path.exists(tmp_path):
+        os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "x.npy"), x)
+    np.save(os.path.join(tmp_path, "y.npy"), y)
+    save_vocabulary(os.path.join(tmp_path, "vocabulary.json"), vocabulary_inv)
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        # Another run finished the same cache first, theirs is identical
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_data_cache(cache_path):
+    """
+    Loads a cached dataset, the token matrix is memory mapped read-only.
+    """
+    x = np.load(os.path.join(cache_path, "x.npy"), mmap_mode="r")
+    y = np.load(os.path.join(cache_path, "y.npy"))
+    vocabulary, vocabulary_inv = load_vocabulary(os.path.join(cache_path, "vocabulary.json"))
+    return [x, y, vocabulary, vocabulary_inv]
+
+
+def deduplicate(sentences, labels, threshold=DEDUPE_THRESHOLD):
+    """
+    Drops near-duplicate sentences, keeping the first of each group, see minhash.deduplicate.
+    """
+    keep = minhash.deduplicate(sentences, threshold)
+    return [sentences[i] for i in keep], labels[keep]
+
+
+def load_data(cache_dir=DATA_CACHE_DIR, positive_file=POSITIVE_DATA_FILE, negative_file=NEGATIVE_DATA_FILE,
+              dedupe_threshold=DEDUPE_THRESHOLD):
     """
     Loads and preprocessed data for the MR dataset.
     Returns input vectors, labels, vocabulary, and inverse vocabulary.
+    Near-duplicates are removed unless dedupe_threshold is 0 or None.
+    The preprocessed data is cached in cache_dir keyed by a hash of the source files,
+    pass cache_dir=None to always rebuild.
     """
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, data_cache_key([positive_file, negative_file], dedupe_threshold or None))
+        if os.path.exists(cache_path):
+            return load_data_cache(cache_path)
     # Load and preprocess data
-    sentences, labels = load_data_and_labels()
-    sentences_padded = pad_sentences(sentences)
-    vocabulary, vocabulary_inv = build_vocab(sentences_padded)
-    x, y = build_input_data(sentences_padded, labels, vocabulary)
+    sentences, labels = load_data_and_labels(positive_file, negative_file)
+    if dedupe_threshold:
+        sentences, labels = deduplicate(sentences, labels, dedupe_threshold)
+    vocabulary, vocabulary_inv = build_padded_vocab(sentences)
+    x = build_token_matrix(sentences, vocabulary)
+    y = np.asarray(labels, dtype=np.int32)
+    if cache_path:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        save_data_cache(cache_path, x, y, vocabulary_inv)
+        return load_data_cache(cache_path)
     return [x, y, vocabulary, vocabulary_inv]
 
 
@@ -127,7 +282,7 @@ def batch_iter(data, batch_size, num_epochs):
     """
     Generates a batch iterator for a dataset.
     """
-    data = np.array(data)
+    data = np.array(data, dtype=object)
     data_size = len(data)
     num_batches_per_epoch = int(len(data)/batch_size) + 1
     for epoch in range(num_epochs):
@@ -138,3 +293,58 @@ def batch_iter(data, batch_size, num_epochs):
             start_index = batch_num * batch_size
             end_index = min((batch_num + 1) * batch_size, data_size)
             yield shuffled_data[start_index:end_index]
+
+
+def sentence_lengths(x, padding_id):
+    """
+    Returns the unpadded length of every row in a padded token matrix.
+    """
+    return np.count_nonzero(np.asarray(x) != padding_id, axis=1)
+
+
+def bucket_boundaries(lengths, num_buckets, min_length=1):
+    """
+    Splits the length distribution into num_buckets buckets holding roughly the same number
+    of examples. Returns the sorted upper bound (inclusive) of each bucket.
+    """
+    quantiles = np.linspace(0, 100, num_buckets + 1)[1:]
+    boundaries = np.unique(np.ceil(np.percentile(lengths, quantiles)).astype(np.int32))
+    return np.maximum(boundaries, min_length)
+
+
+def bucket_batch_iter(x, y, batch_size, num_epochs, lengths, num_buckets=8, min_length=1, shuffle=True):
+    """
+    Generates length bucketed batches for a padded token matrix.
+    Only index arrays are shuffled, each batch is a (x, y) pair copied out of x and y and
+    trimmed to the upper bound of its bucket, but never below min_length which has to cover
+    the widest convolution filter.
+    """
+    lengths = np.asarray(lengths)
+    boundaries = bucket_boundaries(lengths, num_buckets, min_length)
+    bucket_ids = np.searchsorted(boundaries, lengths)
+    buckets = [np.flatnonzero(bucket_ids == i) for i in range(len(boundaries))]
+    for epoch in range(num_epochs):
+        batches = []
+        for bucket_id, indices in enumerate(buckets):
+            if shuffle:
+                indices = np.random.permutation(indices)
+            for start_index in range(0, len(indices), batch_size):
+                batches.append((bucket_id, indices[start_index:start_index + batch_size]))
+        if shuffle:
+            batches = [batches[i] for i in np.random.permutation(len(batches))]
+        for bucket_id, batch_indices in batches:
+            batch_indices = np.sort(batch_indices)
+            width = min(boundaries[bucket_id], x.shape[1])
+            yield x[batch_indices, :width], y[batch_indices]
+
+
+def kfold_indices(num_examples, num_folds, fold, seed=10):
+    """
+    Shuffles example indices with a fixed seed and splits them into num_folds folds.
+    Returns the train and dev indices when fold is held out.
+    """
+    shuffle_indices = np.random.RandomState(seed).permutation(num_examples)
+    folds = np.array_split(shuffle_indices, num_folds)
+    dev_indices = folds[fold]
+    train_indices = np.concatenate([f for i, f in enumerate(folds) if i != fold])
+    return train_indices, dev_indices
@@ -0,0 +1,132 @@
+import zlib
+import numpy as np
+
+
+class HashedLinearClassifier(object):
+    """
+    A linear softmax classifier over hashed unigram and bigram features.
+    Features are hashed into num_buckets columns of a sparse matrix kept as CSR style numpy
+    arrays and the weights are trained with vectorized minibatch SGD, no TensorFlow needed.
+    """
+    def __init__(self, num_classes, num_buckets=2 ** 20, ngrams=2, learning_rate=0.5, l2_reg_lambda=1e-6):
+        self.num_classes = num_classes
+        self.num_buckets = num_buckets
+        self.ngrams = ngrams
+        self.learning_rate = learning_rate
+        self.l2_reg_lambda = l2_reg_lambda
+        self.W = np.zeros((num_buckets, num_classes), dtype=np.float32)
+        self.b = np.zeros(num_classes, dtype=np.float32)
+
+    def hash_features(self, sentence):
+        """
+        Returns the bucket of every n-gram in a tokenized sentence.
+        crc32 is used instead of hash() so buckets are stable across processes.
+        """
+        tokens = [token.encode("utf-8") for token in sentence if token]
+        grams = list(tokens)
+        for n in range(2, self.ngrams + 1):
+            grams.extend(b" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return [zlib.crc32(gram) % self.num_buckets for gram in grams]
+
+    def featurize(self, sentences):
+        """
+        Hashes tokenized sentences into a CSR matrix given as (indptr, indices, values).
+        Each row is L2 normalized so long and short texts get comparable logits.
+        """
+        rows = [self.hash_features(sentence) for sentence in sentences]
+        lengths = np.array([len(row) for row in rows], dtype=np.int64)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.fromiter((index for row in rows for index in row), dtype=np.int64, count=int(indptr[-1]))
+        values = np.repeat(1.0 / np.sqrt(np.maximum(lengths, 1)), lengths).astype(np.float32)
+        return indptr, indices, values
+
+    def _gather_rows(self, features, rows):
+        """
+        Slices the given rows out of a CSR matrix.
+        Returns the feature indices, values and local row number of every non zero.
+        """
+        indptr, indices, values = features
+        starts = indptr[rows]
+        lengths = indptr[rows + 1] - starts
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        positions = offsets + np.arange(int(lengths.sum()))
+        return indices[positions], values[positions], np.repeat(np.arange(len(rows)), lengths)
+
+    def _logits(self, batch_indices, batch_values, batch_rows, num_rows):
+        contributions = self.W[batch_indices] * batch_values[:, None]
+        logits = np.empty((num_rows, self.num_classes), dtype=np.float32)
+        for c in range(self.num_classes):
+            logits[:, c] = np.bincount(batch_rows, weights=contributions[:, c], minlength=num_rows)
+        return logits + self.b
+
+    @staticmethod
+    def _softmax(logits):
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def train_batch(self, features, rows, y_batch):
+        """
+        One SGD step on the given rows, y_batch is one-hot.
+        Returns the mean cross-entropy loss and accuracy of the batch before the update.
+        """
+        batch_indices, batch_values, batch_rows = self._gather_rows(features, rows)
+        probabilities = self._softmax(self._logits(batch_indices, batch_values, batch_rows, len(rows)))
+        errors = (probabilities - y_batch) / len(rows)
+        # Only the buckets used by this batch get a gradient
+        unique_indices, inverse = np.unique(batch_indices, return_inverse=True)
+        gradient = np.empty((len(unique_indices), self.num_classes), dtype=np.float32)
+        for c in range(self.num_classes):
+            gradient[:, c] = np.bincount(inverse, weights=batch_values * errors[batch_rows, c],
+                                         minlength=len(unique_indices))
+        gradient += self.l2_reg_lambda * self.W[unique_indices]
+        self.W[unique_indices] -= self.learning_rate * gradient
+        self.b -= self.learning_rate * errors.sum(axis=0)
+        return self._loss_and_accuracy(probabilities, y_batch)
+
+    def fit_epoch(self, features, y, batch_size=32):
+        """
+        Runs one shuffled epoch of minibatch SGD.
+        Returns the mean training loss and accuracy over the epoch.
+        """
+        order = np.random.permutation(len(y))
+        losses, accuracies = [], []
+        for start_index in range(0, len(order), batch_size):
+            rows = order[start_index:start_index + batch_size]
+            loss, accuracy = self.train_batch(features, rows, y[rows])
+            losses.append(loss * len(rows))
+            accuracies.append(accuracy * len(rows))
+        return sum(losses) / len(y), sum(accuracies) / len(y)
+
+    def predict_proba(self, features):
+        indptr = features[0]
+        rows = np.arange(len(indptr) - 1)
+        batch_indices, batch_values, batch_rows = self._gather_rows(features, rows)
+        return self._softmax(self._logits(batch_indices, batch_values, batch_rows, len(rows)))
+
+    def predict(self, features):
+        return self.predict_proba(features).argmax(axis=1)
+
+    def evaluate(self, features, y):
+        """
+        Returns the mean cross-entropy loss and accuracy for one-hot labels y.
+        """
+        return self._loss_and_accuracy(self.predict_proba(features), y)
+
+    @staticmethod
+    def _loss_and_accuracy(probabilities, y):
+        loss = -np.mean(np.log(np.maximum((probabilities * y).sum(axis=1), 1e-12)))
+        accuracy = np.mean(probabilities.argmax(axis=1) == y.argmax(axis=1))
+        return float(loss), float(accuracy)
+
+    def save(self, filename):
+        np.savez(filename, W=self.W, b=self.b, ngrams=self.ngrams)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        num_buckets, num_classes = data["W"].shape
+        classifier = cls(num_classes, num_buckets=num_buckets, ngrams=int(data["ngrams"]))
+        classifier.W = data["W"]
+        classifier.b = data["b"]
+        return classifier
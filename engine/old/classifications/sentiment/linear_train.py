@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+
+# Trains the NumPy HashedLinearClassifier on the same data and train/dev split as tf_train.py
+# and prints the same style of loss/accuracy report. Needs numpy only.
+
+import os
+import time
+import datetime
+import argparse
+import numpy as np
+import data_helpers
+from hashed_linear import HashedLinearClassifier
+
+# Parameters
+# ==================================================
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--num_buckets", type=int, default=2 ** 20, help="Number of hashed feature buckets (default: 2^20)")
+parser.add_argument("--ngrams", type=int, default=2, help="Longest n-gram hashed, 2 for unigrams and bigrams (default: 2)")
+parser.add_argument("--learning_rate", type=float, default=0.5, help="SGD learning rate (default: 0.5)")
+parser.add_argument("--l2_reg_lambda", type=float, default=1e-6, help="L2 regularization lambda (default: 1e-6)")
+parser.add_argument("--batch_size", type=int, default=32, help="Batch Size (default: 32)")
+parser.add_argument("--dedupe_threshold", type=float, default=data_helpers.DEDUPE_THRESHOLD, help="Drop near-duplicate texts above this similarity, 0 to keep all (default: 0.8)")
+parser.add_argument("--num_epochs", type=int, default=10, help="Number of training epochs (default: 10)")
+FLAGS = parser.parse_args()
+print("\nParameters:")
+for attr, value in sorted(vars(FLAGS).items()):
+    print("{}={}".format(attr.upper(), value))
+print("")
+
+
+# Data Preparatopn
+# ==================================================
+
+# Load data
+print("Loading data...")
+sentences, y = data_helpers.load_data_and_labels()
+if FLAGS.dedupe_threshold:
+    sentences, y = data_helpers.deduplicate(sentences, y, FLAGS.dedupe_threshold)
+# Same shuffle and split as tf_train.py
+np.random.seed(10)
+shuffle_indices = np.random.permutation(np.arange(len(y)))
+sentences_shuffled = [sentences[i] for i in shuffle_indices]
+y_shuffled = y[shuffle_indices]
+sentences_train, sentences_dev = sentences_shuffled[:-1000], sentences_shuffled[-1000:]
+y_train, y_dev = y_shuffled[:-1000], y_shuffled[-1000:]
+
+classifier = HashedLinearClassifier(
+    num_classes=y.shape[1],
+    num_buckets=FLAGS.num_buckets,
+    ngrams=FLAGS.ngrams,
+    learning_rate=FLAGS.learning_rate,
+    l2_reg_lambda=FLAGS.l2_reg_lambda)
+features_train = classifier.featurize(sentences_train)
+features_dev = classifier.featurize(sentences_dev)
+print("Hash buckets: {:d}".format(FLAGS.num_buckets))
+print("Train/Dev split: {:d}/{:d}".format(len(y_train), len(y_dev)))
+
+
+# Training
+# ==================================================
+
+timestamp = str(int(time.time()))
+out_dir = os.path.abspath(os.path.join(os.path.curdir, "runs", "linear_" + timestamp))
+print("Writing to {}\n".format(out_dir))
+
+start = time.time()
+for epoch in range(1, FLAGS.num_epochs + 1):
+    loss, accuracy = classifier.fit_epoch(features_train, y_train, FLAGS.batch_size)
+    time_str = datetime.datetime.now().isoformat()
+    print("{}: epoch {}, loss {:g}, acc {:g}".format(time_str, epoch, loss, accuracy))
+    print("\nEvaluation:")
+    loss, accuracy = classifier.evaluate(features_dev, y_dev)
+    time_str = datetime.datetime.now().isoformat()
+    print("{}: epoch {}, loss {:g}, acc {:g}".format(time_str, epoch, loss, accuracy))
+    print("")
+print("Trained in {:.2f}s".format(time.time() - start))
+
+start = time.time()
+classifier.predict(classifier.featurize(sentences_dev))
+print("Scored {:.0f} examples/sec including featurization".format(len(sentences_dev) / (time.time() - start)))
+
+if not os.path.exists(out_dir):
+    os.makedirs(out_dir)
+model_path = os.path.join(out_dir, "model.npz")
+classifier.save(model_path)
+print("Saved model to {}\n".format(model_path))
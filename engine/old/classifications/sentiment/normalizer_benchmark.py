@@ -0,0 +1,65 @@
+#! /usr/bin/env python
+# coding=utf8
+
+# Checks clean_str against the golden corpus shared with dataset_tools.js and compares its
+# per-sentence cost with the previous multi-pass re.sub implementation.
+# The corpus is the sentiment export repeated up to the requested number of lines.
+#
+# Usage: python normalizer_benchmark.py [num_lines]
+
+import io
+import re
+import sys
+import json
+import time
+import data_helpers
+
+GOLDEN_FILE = "../../exporters/normalizer_golden.jsonl"
+CORPUS_FILES = ["../../exporters/datasets/better_reykjavik/sentiment/positive.polarity",
+                "../../exporters/datasets/better_reykjavik/sentiment/negative.polarity"]
+
+num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+
+def legacy_clean_str(string):
+    string = data_helpers.strip_accents(string)
+    string = re.sub(r"[^A-Za-z0-9(),!?\'\`]", " ", string)
+    string = re.sub(r"\'s", " \'s", string)
+    string = re.sub(r"\'ve", " \'ve", string)
+    string = re.sub(r"n\'t", " n\'t", string)
+    string = re.sub(r"\'re", " \'re", string)
+    string = re.sub(r"\'d", " \'d", string)
+    string = re.sub(r"\'ll", " \'ll", string)
+    string = re.sub(r",", " , ", string)
+    string = re.sub(r"!", " ! ", string)
+    string = re.sub(r"\(", " \( ", string)
+    string = re.sub(r"\)", " \) ", string)
+    string = re.sub(r"\?", " \? ", string)
+    string = re.sub(r"\s{2,}", " ", string)
+    return string.strip().lower()
+
+
+failures = 0
+with io.open(GOLDEN_FILE, encoding="utf-8") as golden_file:
+    for line in golden_file:
+        case = json.loads(line)
+        output = data_helpers.clean_str(case["input"])
+        if output != case["output"]:
+            failures += 1
+            print(u"MISMATCH {!r}: expected {!r} got {!r}".format(case["input"], case["output"], output))
+if failures:
+    sys.exit(1)
+print("Golden corpus OK")
+
+lines = []
+for filename in CORPUS_FILES:
+    with io.open(filename, encoding="utf-8") as corpus_file:
+        lines.extend(line.strip() for line in corpus_file)
+lines = (lines * (num_lines // len(lines) + 1))[:num_lines]
+
+for name, clean in [("legacy clean_str", legacy_clean_str), ("clean_str", data_helpers.clean_str)]:
+    start = time.time()
+    for line in lines:
+        clean(line)
+    elapsed = time.time() - start
+    print("{:>16}: {:.2f} us/sentence over {:d} lines".format(name, elapsed * 1e6 / len(lines), len(lines)))
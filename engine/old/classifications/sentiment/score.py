@@ -0,0 +1,170 @@
+#! /usr/bin/env python
+
+# Scores posts and points with a TextCNN checkpoint written by tf_train.py or categories_train.py.
+# The model and vocabulary are loaded once, then records are read as JSONL or CSV (with a header
+# row) from --input_file or stdin and predictions are written as JSONL, --batch_size records at
+# a time. The non empty --text_fields of a record are joined into the text to score, so points
+# use their content and posts their name and description. The --id_field is copied to the output.
+#
+# An empty input line flushes the pending batch and is answered with an empty line, so a
+# long-running process can be driven interactively over a pipe or with --socket_path:
+#
+#   python score.py --run_dir=runs/1480000000 < points.jsonl > scores.jsonl
+#   python score.py --run_dir=runs/1480000000 --socket_path=/tmp/ac_sentiment.sock
+
+import io
+import os
+import sys
+import csv
+import json
+import numpy as np
+import tensorflow as tf
+import data_helpers
+
+try:
+    import socketserver
+except ImportError: # python 2
+    import SocketServer as socketserver
+
+tf.flags.DEFINE_string("run_dir", "", "Training run directory holding vocabulary.json and checkpoints/")
+tf.flags.DEFINE_string("checkpoint_file", "", "Checkpoint to load (default: latest in run_dir/checkpoints)")
+tf.flags.DEFINE_string("classes", "negative,positive", "Comma-separated class names in output index order")
+tf.flags.DEFINE_string("input_file", "", "JSONL or CSV file to score (default: stdin)")
+tf.flags.DEFINE_string("input_format", "jsonl", "Input format, jsonl or csv")
+tf.flags.DEFINE_string("id_field", "id", "Record field copied to the output")
+tf.flags.DEFINE_string("text_fields", "content,name,description", "Record fields holding the text to score")
+tf.flags.DEFINE_integer("batch_size", 256, "Records scored per model call (default: 256)")
+tf.flags.DEFINE_integer("min_length", 5, "Minimum padded length, has to cover the widest filter (default: 5)")
+tf.flags.DEFINE_string("socket_path", "", "Serve requests on this unix socket instead of reading input_file")
+
+FLAGS = tf.flags.FLAGS
+
+
+class TextCNNScorer(object):
+    """
+    Holds a restored TextCNN graph and its vocabulary for repeated batch scoring.
+    """
+    def __init__(self, run_dir, checkpoint_file, classes, min_length):
+        self.vocabulary, self.vocabulary_inv = data_helpers.load_vocabulary(
+            os.path.join(run_dir, "vocabulary.json"))
+        self.padding_id = self.vocabulary[data_helpers.PADDING_WORD]
+        self.classes = classes
+        self.min_length = min_length
+        if not checkpoint_file:
+            checkpoint_file = tf.train.latest_checkpoint(os.path.join(run_dir, "checkpoints"))
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.sess = tf.Session()
+            saver = tf.train.import_meta_graph("{}.meta".format(checkpoint_file))
+            saver.restore(self.sess, checkpoint_file)
+            self.input_x = self.graph.get_operation_by_name("input_x").outputs[0]
+            self.dropout_keep_prob = self.graph.get_operation_by_name("dropout_keep_prob").outputs[0]
+            self.predictions = self.graph.get_operation_by_name("output/predictions").outputs[0]
+            self.probabilities = tf.nn.softmax(self.graph.get_operation_by_name("output/scores").outputs[0])
+        # Fixed length models need exactly their training width, variable length models any width
+        self.sequence_length = self.input_x.get_shape()[1].value
+
+    def token_matrix(self, texts):
+        sentences = [data_helpers.clean_str(text).split(" ") for text in texts]
+        width = self.sequence_length or max([self.min_length] + [len(sentence) for sentence in sentences])
+        x = np.full((len(sentences), width), self.padding_id, dtype=np.int32)
+        for i, sentence in enumerate(sentences):
+            ids = [self.vocabulary.get(word, self.padding_id) for word in sentence[:width]]
+            x[i, :len(ids)] = ids
+        return x
+
+    def score(self, texts):
+        """
+        Returns (predicted index, class probabilities) for every text.
+        """
+        predictions, probabilities = self.sess.run(
+            [self.predictions, self.probabilities],
+            {self.input_x: self.token_matrix(texts), self.dropout_keep_prob: 1.0})
+        return zip(predictions, probabilities)
+
+
+def record_text(record, text_fields):
+    return " ".join(record[field] for field in text_fields if record.get(field))
+
+
+def read_records(input_file, input_format):
+    """
+    Yields a record dict per input line, or None for an empty line (flush request).
+    """
+    if input_format == "csv":
+        header = None
+        for row in csv.reader(input_file):
+            if not row:
+                yield None
+            elif header is None:
+                header = row
+            else:
+                yield dict(zip(header, row))
+    else:
+        for line in input_file:
+            line = line.strip()
+            yield json.loads(line) if line else None
+
+
+def score_stream(scorer, records, output_file, batch_size, id_field, text_fields):
+    """
+    Scores records in batches and writes one JSON prediction per record, in input order.
+    """
+    def flush(batch):
+        if batch:
+            results = scorer.score([record_text(record, text_fields) for record in batch])
+            for record, (prediction, probabilities) in zip(batch, results):
+                output_file.write(json.dumps({
+                    id_field: record.get(id_field),
+                    "class": scorer.classes[prediction] if prediction < len(scorer.classes) else int(prediction),
+                    "scores": [round(float(p), 6) for p in probabilities]
+                }) + "\n")
+        return []
+
+    batch = []
+    for record in records:
+        if record is None:
+            batch = flush(batch)
+            output_file.write("\n")
+            output_file.flush()
+        else:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                batch = flush(batch)
+    flush(batch)
+    output_file.flush()
+
+
+def serve(scorer, socket_path):
+    """
+    Serves score_stream over a unix socket, each connection is one stream.
+    """
+    class ScoreHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            input_file = io.TextIOWrapper(self.rfile, encoding="utf-8") if sys.version_info[0] > 2 else self.rfile
+            output_file = io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True) if sys.version_info[0] > 2 else self.wfile
+            score_stream(scorer, read_records(input_file, FLAGS.input_format), output_file,
+                         FLAGS.batch_size, FLAGS.id_field, FLAGS.text_fields.split(","))
+
+    class ThreadingUnixStreamServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = ThreadingUnixStreamServer(socket_path, ScoreHandler)
+    print("Scoring on {}".format(socket_path))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    scorer = TextCNNScorer(FLAGS.run_dir, FLAGS.checkpoint_file, FLAGS.classes.split(","), FLAGS.min_length)
+    if FLAGS.socket_path:
+        serve(scorer, FLAGS.socket_path)
+    else:
+        input_file = io.open(FLAGS.input_file, encoding="utf-8") if FLAGS.input_file else sys.stdin
+        score_stream(scorer, read_records(input_file, FLAGS.input_format), sys.stdout,
+                     FLAGS.batch_size, FLAGS.id_field, FLAGS.text_fields.split(","))
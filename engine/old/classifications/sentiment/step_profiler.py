@@ -0,0 +1,91 @@
+import sys
+import csv
+import json
+import time
+import datetime
+import resource
+from contextlib import contextmanager
+
+timer = getattr(time, "perf_counter", time.time)
+
+PHASES = ["data", "compute", "summary", "checkpoint", "eval"]
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB, ru_maxrss is in bytes on macOS and KB elsewhere.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+class StepProfiler(object):
+    """
+    Records where each training step spends its time.
+    Wrap the work of a step in phase(name) blocks and call end_step once per step. Every step is
+    written as a CSV row and every summary_every steps a one line summary is printed.
+    """
+    def __init__(self, csv_filename, summary_every=100):
+        self.summary_every = summary_every
+        self.csv_file = open(csv_filename, "w")
+        self.writer = csv.writer(self.csv_file)
+        self.writer.writerow(["step"] + ["{}_time".format(p) for p in PHASES] +
+                             ["examples", "examples_per_sec", "peak_rss_mb"])
+        self.step_times = dict.fromkeys(PHASES, 0.0)
+        self.window_times = dict.fromkeys(PHASES, 0.0)
+        self.total_times = dict.fromkeys(PHASES, 0.0)
+        self.window_examples = 0
+        self.window_steps = 0
+        self.total_examples = 0
+        self.total_steps = 0
+
+    @contextmanager
+    def phase(self, name):
+        start = timer()
+        try:
+            yield
+        finally:
+            self.step_times[name] += timer() - start
+
+    def end_step(self, step, examples):
+        step_time = sum(self.step_times.values())
+        self.writer.writerow([step] + ["{:.6f}".format(self.step_times[p]) for p in PHASES] +
+                             [examples, "{:.1f}".format(examples / step_time if step_time else 0.0),
+                              "{:.1f}".format(peak_rss_mb())])
+        for p in PHASES:
+            self.window_times[p] += self.step_times[p]
+            self.total_times[p] += self.step_times[p]
+            self.step_times[p] = 0.0
+        self.window_examples += examples
+        self.window_steps += 1
+        self.total_examples += examples
+        self.total_steps += 1
+        if self.window_steps >= self.summary_every:
+            print(self.summary_line(step))
+            self.window_times = dict.fromkeys(PHASES, 0.0)
+            self.window_examples = 0
+            self.window_steps = 0
+
+    def summary_line(self, step):
+        window_time = sum(self.window_times.values())
+        shares = ", ".join("{} {:.0f}%".format(p, 100.0 * self.window_times[p] / window_time if window_time else 0.0)
+                           for p in PHASES)
+        return "{}: profile step {}, {:.1f} examples/sec, {}, peak rss {:.0f}MB".format(
+            datetime.datetime.now().isoformat(), step,
+            self.window_examples / window_time if window_time else 0.0, shares, peak_rss_mb())
+
+    def close(self, json_filename=None):
+        """
+        Closes the step log and optionally writes the totals of the whole run as JSON.
+        """
+        self.csv_file.close()
+        if json_filename:
+            total_time = sum(self.total_times.values())
+            with open(json_filename, "w") as json_file:
+                json.dump({
+                    "steps": self.total_steps,
+                    "examples": self.total_examples,
+                    "examples_per_sec": self.total_examples / total_time if total_time else 0.0,
+                    "peak_rss_mb": peak_rss_mb(),
+                    "phase_times": self.total_times
+                }, json_file, indent=2)
@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+
+# Runs a k-fold cross-validated hyperparameter grid of tf_train.py across a process pool and
+# collects one summary table. Runs start in this directory.
+# The preprocessed dataset cache is built once up front with data_helpers, every run then memory
+# maps it read-only, so --train_script has to be a script here that loads its data the same way.
+# Unknown arguments are passed on to every training run.
+#
+#   python sweep.py --num_folds=5 --embedding_dim 64 128 --filter_sizes 3,4,5 2,3,4 --num_epochs=20
+
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+import multiprocessing
+import data_helpers
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--train_script", default="tf_train.py", help="Training script that loads its data through data_helpers (default: tf_train.py)")
+parser.add_argument("--num_folds", type=int, default=5, help="Number of cross-validation folds (default: 5)")
+parser.add_argument("--embedding_dim", nargs="+", default=["128"], help="Embedding dimensions to try")
+parser.add_argument("--filter_sizes", nargs="+", default=["3,4,5"], help="Comma-separated filter sizes to try")
+parser.add_argument("--num_filters", nargs="+", default=["128"], help="Filters per filter size to try")
+parser.add_argument("--batch_size", nargs="+", default=["64"], help="Batch sizes to try")
+parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(), help="Parallel runs (default: number of cores)")
+parser.add_argument("--data_cache_dir", default=data_helpers.DATA_CACHE_DIR, help="Preprocessed dataset cache shared by all runs")
+parser.add_argument("--dedupe_threshold", type=float, default=data_helpers.DEDUPE_THRESHOLD,
+                    help="Near-duplicate threshold the cache is built with and every run uses (default: 0.8)")
+parser.add_argument("--sweep_dir", default="", help="Output directory (default: runs/sweep_<timestamp>)")
+GRID = ["embedding_dim", "filter_sizes", "num_filters", "batch_size"]
+
+
+def run_training(job):
+    """
+    Runs one training process and returns its parameters merged with its results.json.
+    """
+    train_script, run_dir, params, extra_args = job
+    args = [sys.executable, train_script, "--out_dir={}".format(run_dir)]
+    args += ["--{}={}".format(name, value) for name, value in sorted(params.items())]
+    args += extra_args
+    if not os.path.exists(run_dir):
+        os.makedirs(run_dir)
+    start = time.time()
+    with open(os.path.join(run_dir, "train.log"), "w") as log_file:
+        returncode = subprocess.call(args, stdout=log_file, stderr=subprocess.STDOUT)
+    result = dict(params)
+    result["wall_time"] = time.time() - start
+    result["returncode"] = returncode
+    results_filename = os.path.join(run_dir, "results.json")
+    if returncode == 0 and os.path.exists(results_filename):
+        with open(results_filename) as results_file:
+            result.update(json.load(results_file))
+    return result
+
+
+def format_value(value):
+    return "{:.4f}".format(value) if isinstance(value, float) else str(value)
+
+
+def print_summary(results, num_folds):
+    """
+    Prints every run and the mean over folds per configuration, best configuration first.
+    """
+    columns = GRID + ["fold", "dev_accuracy", "wall_time", "examples_per_sec"]
+    print("\nRuns:")
+    print("\t".join(columns))
+    for result in sorted(results, key=lambda r: [str(r[c]) for c in GRID + ["fold"]]):
+        print("\t".join(format_value(result.get(c, "failed")) for c in columns))
+
+    print("\nConfigurations (mean over {} folds):".format(num_folds))
+    summaries = []
+    for config, runs in itertools.groupby(sorted(results, key=lambda r: [r[c] for c in GRID]),
+                                          key=lambda r: tuple(r[c] for c in GRID)):
+        runs = [run for run in runs if "dev_accuracy" in run]
+        if runs:
+            summaries.append(config + (
+                sum(run["dev_accuracy"] for run in runs) / len(runs),
+                sum(run["wall_time"] for run in runs) / len(runs),
+                sum(run["examples_per_sec"] for run in runs) / len(runs),
+                len(runs)))
+    print("\t".join(GRID + ["dev_accuracy", "wall_time", "examples_per_sec", "completed_folds"]))
+    for summary in sorted(summaries, key=lambda s: -s[len(GRID)]):
+        print("\t".join(format_value(value) for value in summary))
+
+
+if __name__ == "__main__":
+    FLAGS, extra_args = parser.parse_known_args()
+    sweep_dir = os.path.abspath(FLAGS.sweep_dir or os.path.join(os.path.curdir, "runs", "sweep_{}".format(int(time.time()))))
+
+    print("Preparing dataset cache...")
+    data_helpers.load_data(cache_dir=FLAGS.data_cache_dir, dedupe_threshold=FLAGS.dedupe_threshold)
+
+    # Split the cores between the runs so they do not oversubscribe the machine
+    num_threads = max(1, multiprocessing.cpu_count() // FLAGS.processes)
+    extra_args += ["--data_cache_dir={}".format(FLAGS.data_cache_dir), "--num_threads={}".format(num_threads),
+                   "--num_folds={}".format(FLAGS.num_folds), "--dedupe_threshold={}".format(FLAGS.dedupe_threshold)]
+    jobs = []
+    for values in itertools.product(*[getattr(FLAGS, name) for name in GRID]):
+        for fold in range(FLAGS.num_folds):
+            params = dict(zip(GRID, values), fold=fold)
+            run_name = "_".join("{}{}".format(name, str(value).replace(",", "-")) for name, value in sorted(params.items()))
+            jobs.append((FLAGS.train_script, os.path.join(sweep_dir, run_name), params, extra_args))
+    print("Running {} trainings on {} processes, writing to {}".format(len(jobs), FLAGS.processes, sweep_dir))
+
+    pool = multiprocessing.Pool(FLAGS.processes)
+    results = []
+    for result in pool.imap_unordered(run_training, jobs):
+        results.append(result)
+        print("Finished {}/{}: {}".format(len(results), len(jobs), json.dumps(result, sort_keys=True)))
+    pool.close()
+    pool.join()
+
+    with open(os.path.join(sweep_dir, "summary.csv"), "w") as summary_file:
+        columns = GRID + ["fold", "dev_accuracy", "dev_loss", "wall_time", "train_time", "examples_per_sec", "returncode"]
+        writer = csv.DictWriter(summary_file, columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+    print_summary(results, FLAGS.num_folds)
@@ -1,49 +1,76 @@
 var models = require('../../models/index.cjs');
 var async = require('async');
 var fs = require('fs');
-
-var trainCategoriesCsv;
-var testCategoriesCsv;
-var classesCategoriesCsv;
+var _ = require('lodash');
 
 var trainCategoriesCsvFilename = 'datasets/better_reykjavik/categories/train.csv';
 var testCategoriesCsvFilename = 'datasets/better_reykjavik/categories/test.csv';
 var classesCategoriesCsvFilename = 'datasets/better_reykjavik/categories/classes.csv';
-var categories = {};
-var categoriesIds = [];
+var watermarkFilename = 'datasets/better_reykjavik/categories/export_watermark.json';
 
 MAX_CATEGORY_LENGTH = 1700;
+TEST_FRACTION = 0.1;
+
+// The ids replaceBetterReykjavikCategoryId maps to, without 11 which is not exported
+var categoriesIds = [1,2,3,4,5,6,7,8,9,10,12,13];
 
 var clean = require('./dataset_tools').clean;
-var shuffleArray = require('./dataset_tools').shuffleArray;
 var replaceBetterReykjavikCategoryId = require('./dataset_tools').replaceBetterReykjavikCategoryId;
+var forEachPageById = require('./dataset_tools').forEachPageById;
+var openExportStreams = require('./dataset_tools').openExportStreams;
+var writeLines = require('./dataset_tools').writeLines;
+var closeExportStreams = require('./dataset_tools').closeExportStreams;
+var readExportWatermark = require('./dataset_tools').readExportWatermark;
+var writeExportWatermark = require('./dataset_tools').writeExportWatermark;
+
+// With --incremental only posts newer than the last export are appended to the existing files
+var incremental = process.argv.indexOf('--incremental') > -1;
+var watermark = incremental ? readExportWatermark(watermarkFilename) : { lastId: 0, counts: {} };
+var counts = _.clone(watermark.counts);
+var streams;
+
+var addRow = function (lines, category_id, content) {
+  if (counts[category_id] < MAX_CATEGORY_LENGTH) {
+    counts[category_id] += 1;
+    lines[Math.random() < TEST_FRACTION ? 'test' : 'train'].push(category_id+','+content);
+  }
+};
 
 async.series([
   function(callback) {
-    var categoriesCsvRows = [];
+    streams = openExportStreams({
+      train: trainCategoriesCsvFilename,
+      test: testCategoriesCsvFilename
+    }, incremental);
 
-    models.Post.findAll(
+    forEachPageById(models.Post,
       {
+        attributes: ['id', 'name', 'description', 'category_id'],
         where: {
           status: 'published'
         },
         include: [
           {
             model: models.Point,
+            attributes: ['id', 'content', 'value', 'post_id'],
+            separate: true,
             where: {
               status: 'published'
             }
           },
           {
             model: models.Group,
+            attributes: ['id'],
             required: true,
             include: [
               {
                 model: models.Community,
+                attributes: ['id'],
                 required: true,
                 include: [
                   {
                     model: models.Domain,
+                    attributes: ['id'],
                     required: true,
                     where: {
                       id: 1
@@ -54,104 +81,81 @@ async.series([
             ]
           }
         ]
-      }).then(function (posts) {
-      console.log('Found '+posts.length+" posts");
-      async.eachSeries(posts, function (post, seriesCallback) {
-        var newId = replaceBetterReykjavikCategoryId(post.category_id);
-        if (newId && newId!=11) {
-          if (!categories[newId]) {
-            categories[newId] = [];
-            categoriesIds.push(newId);
-          }
-          var content;
-          if (post.description) {
-            content = '"'+clean(post.name) + ' ' + clean(post.description)+'"';
-          } else {
-            content = '"'+clean(post.name)+'"';
-          }
-          if (content.indexOf('Lorem Ipsum har') == -1) {
-            categories[newId].push(content);
-          }
-          async.eachSeries(post.Points, function (point, innerSeriesCallback) {
-            console.log(point.status);
-            if (point.value!=0) {
-              content = '"'+clean(point.content)+'"';
-              if (content!="" && content.length>17) {
-                if (content.indexOf('Mypoint my point') == -1 &&
-                    content.indexOf('Point against Point') == -1) {
-                  categories[newId].push(content);
+      }, watermark.lastId, function (posts, pageCallback) {
+        var lines = { train: [], test: [] };
+        _.each(posts, function (post) {
+          var newId = replaceBetterReykjavikCategoryId(post.category_id);
+          // Only posts with published points, as with the inner join before paging
+          if (newId && newId!=11 && post.Points && post.Points.length > 0) {
+            if (counts[newId] === undefined) {
+              counts[newId] = 0;
+            }
+            var content;
+            if (post.description) {
+              content = '"'+clean(post.name) + ' ' + clean(post.description)+'"';
+            } else {
+              content = '"'+clean(post.name)+'"';
+            }
+            if (content.indexOf('lorem ipsum har') == -1) {
+              addRow(lines, newId, content);
+            }
+            _.each(post.Points, function (point) {
+              if (point.value!=0) {
+                content = '"'+clean(point.content)+'"';
+                if (content!="" && content.length>17) {
+                  if (content.indexOf('mypoint my point') == -1 &&
+                      content.indexOf('point against point') == -1) {
+                    addRow(lines, newId, content);
+                  }
                 }
               }
-            }
-            innerSeriesCallback();
-          }, function () {
-            seriesCallback();
-          });
-        } else {
-          seriesCallback();
-        }
-      }, function () {
-        async.eachSeries(categoriesIds, function (category_id, seriesCallback) {
-          console.log(category_id);
-          console.log("-----"+category_id+"---------------------------: "+categories[category_id].length);
-          if (categories[category_id].length>MAX_CATEGORY_LENGTH) {
-            categories[category_id] = categories[category_id].splice(0,MAX_CATEGORY_LENGTH);
-            console.log("-----"+category_id+"---------------------------: "+categories[category_id].length);
+            });
           }
-          async.eachSeries(categories[category_id], function (post, innerSeriesCallback) {
-            categoriesCsvRows.push(category_id+','+post);
-            console.log("Key: "+category_id+" value: "+post);
-            innerSeriesCallback();
-          }, function () {
-            seriesCallback();
+        });
+        async.eachSeries(_.keys(lines), function (name, seriesCallback) {
+          writeLines(streams[name], lines[name], seriesCallback);
+        }, function (error) {
+          var allCategoriesFull = _.every(categoriesIds, function (category_id) {
+            return counts[category_id] >= MAX_CATEGORY_LENGTH;
           });
-        }, function () {
-          trainCategoriesCsv = shuffleArray(categoriesCsvRows);
-          testCategoriesCsv = trainCategoriesCsv.splice(0,categoriesCsvRows.length*0.1);
-          callback();
+          pageCallback(error, allCategoriesFull);
         });
+      }, function (error, lastId) {
+        console.log("Exported: "+JSON.stringify(counts));
+        watermark = { lastId: lastId, counts: counts };
+        callback(error);
       });
-    }).catch(function(error) {
-      console.log("ERROR: "+error);
-    }) ;
-  },
-  function(callback) {
-    fs.writeFile(trainCategoriesCsvFilename, trainCategoriesCsv.join('\n'), function(err) {
-      if(err) {
-         console.log(err);
-      }
-      callback();
-    });
   },
   function(callback) {
-    fs.writeFile(testCategoriesCsvFilename, testCategoriesCsv.join('\n'), function(err) {
-      if(err) {
-        console.log(err);
-      }
-      callback();
-    });
+    closeExportStreams(streams, callback);
   },
   function(callback) {
-    classesCategoriesCsv = [];
-    async.eachSeries(categoriesIds, function (category_id, seriesCallback) {
-      models.Category.findOne({
-        where: {id: category_id}
-      }).then(function (category) {
-        classesCategoriesCsv.push(category.id + ',' + category.name);
-        seriesCallback();
+    models.Category.findAll({
+      attributes: ['id', 'name'],
+      where: {
+        id: { $in: _.map(_.keys(counts), Number) }
+      },
+      order: [['id', 'ASC']]
+    }).then(function (categories) {
+      var classesCategoriesCsv = _.map(categories, function (category) {
+        return category.id + ',' + category.name;
+      });
+      fs.writeFile(classesCategoriesCsvFilename, classesCategoriesCsv.join('\n'), function(err) {
+        if(err) {
+          console.log(err);
+        }
+        callback();
       });
-    }, function () {
-      callback();
+    }).catch(function (error) {
+      callback(error);
     });
   },
   function(callback) {
-    fs.writeFile(classesCategoriesCsvFilename, classesCategoriesCsv.join('\n'), function(err) {
-      if(err) {
-        console.log(err);
-      }
-      callback();
-    });
+    writeExportWatermark(watermarkFilename, watermark, callback);
   }
 ], function (error) {
+  if (error) {
+    console.log("ERROR: "+error);
+  }
   console.log("FINISHED :)");
 });
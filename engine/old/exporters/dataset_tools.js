@@ -1,4 +1,8 @@
-var removeDiacritics = require('diacritics').remove;
+var async = require('async');
+var fs = require('fs');
+var _ = require('lodash');
+
+var EXPORT_PAGE_SIZE = 500;
 
 var shuffleArray = function (array) {
   for (var i = array.length - 1; i > 0; i--) {
@@ -10,24 +14,63 @@ var shuffleArray = function (array) {
   return array;
 };
 
+// Text normalization spec, shared with clean_str() in engine/old/classifications/*/data_helpers.py
+// 1. One translate pass lowercases ASCII and folds Latin letters (U+00C0-U+024F) to their
+//    unaccented ASCII base, with Icelandic and other letters without a decomposition
+//    spelled out in NORMALIZE_LETTERS.
+// 2. One tokenizing regex drops <a> links and emits words, contractions and ( ) , ! ?
+//    as tokens. Everything else separates tokens.
+// Both implementations are checked against normalizer_golden.jsonl
+var NORMALIZE_LETTERS = {
+  'þ': 'th', 'Þ': 'th',
+  'ð': 'dh', 'Ð': 'dh',
+  'æ': 'ae', 'Æ': 'ae',
+  'ø': 'o', 'Ø': 'o',
+  'œ': 'oe', 'Œ': 'oe',
+  'ß': 'ss',
+  'đ': 'd', 'Đ': 'd',
+  'ł': 'l', 'Ł': 'l',
+  // Typographic apostrophe, so contractions split the same way as with '
+  '’': "'"
+};
+
+var buildNormalizeTable = function () {
+  var table = {};
+  var code, base;
+  for (code = 65; code <= 90; code++) {
+    table[String.fromCharCode(code)] = String.fromCharCode(code + 32);
+  }
+  for (code = 0xC0; code < 0x250; code++) {
+    base = String.fromCharCode(code).normalize('NFD')[0];
+    if (/^[A-Za-z]$/.test(base)) {
+      table[String.fromCharCode(code)] = base.toLowerCase();
+    }
+  }
+  Object.keys(NORMALIZE_LETTERS).forEach(function (letter) {
+    table[letter] = NORMALIZE_LETTERS[letter];
+  });
+  return table;
+};
+
+var NORMALIZE_TABLE = buildNormalizeTable();
+var NORMALIZE_CHARS_RE = new RegExp('[' + Object.keys(NORMALIZE_TABLE).join('') + ']', 'g');
+var TOKEN_RE = /<a(?=[ \t\r\n>])[^>]*>[\s\S]*?<\/a>|([a-z0-9]+(?=n't)|n't|'(?:s|ve|re|d|ll)|[a-z0-9]+|[(),!?])/g;
+
+var translateChar = function (char) {
+  return NORMALIZE_TABLE[char];
+};
+
 var clean = function (string) {
-  string = string.replace(/(\r\n|\n|\r)/gm," ");
-  string = string.replace(',',' ');
-  string = string.replace('\n',' ');
-  string = string.replace(/\'/g,' ');
-  string = string.replace(/\,/g,' ');
-  string = string.replace(/\(/g,' ');
-  string = string.replace(/\=/g,' ');
-  string = string.replace(/\)/g,' ');
-  string = string.replace(/\-/g,' ');
-  string = string.replace(/\./g,' ');
-  string = string.replace(/['"]+/g, '');
-  string = string.replace(/<a\b[^>]*>(.*?)<\/a>/i," ");
-  string = removeDiacritics(string);
-  string = string.replace(/[^A-Za-z0-9(),!?\'\`]/, ' ');
-  string = string.replace(/[^\x00-\x7F]/g, " ");
-  string = string.replace(/\s+/g,' ').trim();
-  return string;
+  var tokens = [];
+  var match;
+  string = string.replace(NORMALIZE_CHARS_RE, translateChar);
+  TOKEN_RE.lastIndex = 0;
+  while ((match = TOKEN_RE.exec(string)) !== null) {
+    if (match[1]) {
+      tokens.push(match[1]);
+    }
+  }
+  return tokens.join(' ');
 };
 
 var replaceBetterReykjavikCategoryId = function (id) {
@@ -75,8 +118,88 @@ var replaceBetterReykjavikCategoryId = function (id) {
   }
 };
 
+// Calls processPage(rows, callback) with consecutive pages of model rows ordered by id, starting
+// after afterId, so only one page is held in memory. processPage can call back with (null, true)
+// to stop early. Calls done(error, lastId) at the end.
+var forEachPageById = function (model, findOptions, afterId, processPage, done) {
+  var lastId = afterId || 0;
+  var moreRows = true;
+  async.whilst(
+    function () { return moreRows; },
+    function (whilstCallback) {
+      model.findAll(_.extend({}, findOptions, {
+        where: _.extend({}, findOptions.where, { id: { $gt: lastId } }),
+        order: [['id', 'ASC']],
+        limit: EXPORT_PAGE_SIZE
+      })).then(function (rows) {
+        moreRows = rows.length === EXPORT_PAGE_SIZE;
+        if (rows.length > 0) {
+          lastId = rows[rows.length - 1].id;
+        }
+        console.log('Exporting page of ' + rows.length + ' ending at id ' + lastId);
+        processPage(rows, function (error, stop) {
+          if (stop) {
+            moreRows = false;
+          }
+          whilstCallback(error);
+        });
+      }).catch(function (error) {
+        whilstCallback(error);
+      });
+    },
+    function (error) {
+      done(error, lastId);
+    }
+  );
+};
+
+// Opens append or truncating write streams for an object of name: filename
+var openExportStreams = function (filenames, append) {
+  return _.mapValues(filenames, function (filename) {
+    return fs.createWriteStream(filename, { flags: append ? 'a' : 'w' });
+  });
+};
+
+// Writes lines to a stream and calls back once the stream can take more, so a slow disk
+// pauses the paging instead of buffering the whole export
+var writeLines = function (stream, lines, callback) {
+  if (lines.length === 0 || stream.write(lines.join('\n') + '\n')) {
+    callback();
+  } else {
+    stream.once('drain', function () {
+      callback();
+    });
+  }
+};
+
+var closeExportStreams = function (streams, callback) {
+  async.eachSeries(_.values(streams), function (stream, seriesCallback) {
+    stream.end(seriesCallback);
+  }, callback);
+};
+
+// The watermark records the last exported id and the per category row counts of the
+// previous export, so an incremental export only appends newer content
+var readExportWatermark = function (filename) {
+  if (fs.existsSync(filename)) {
+    return JSON.parse(fs.readFileSync(filename, 'utf8'));
+  } else {
+    return { lastId: 0, counts: {} };
+  }
+};
+
+var writeExportWatermark = function (filename, watermark, callback) {
+  fs.writeFile(filename, JSON.stringify(watermark), callback);
+};
+
 module.exports = {
   replaceBetterReykjavikCategoryId: replaceBetterReykjavikCategoryId,
   clean: clean,
-  shuffleArray: shuffleArray
+  shuffleArray: shuffleArray,
+  forEachPageById: forEachPageById,
+  openExportStreams: openExportStreams,
+  writeLines: writeLines,
+  closeExportStreams: closeExportStreams,
+  readExportWatermark: readExportWatermark,
+  writeExportWatermark: writeExportWatermark
 };
\ No newline at end of file
@@ -0,0 +1,86 @@
+// Checks clean() against the golden corpus shared with data_helpers.clean_str and compares
+// its per-sentence cost with the previous multi-pass replace implementation.
+// The corpus is the sentiment export repeated up to the requested number of lines.
+//
+// Usage: node normalizer_benchmark.js [numLines]
+
+var fs = require('fs');
+var path = require('path');
+var clean = require('./dataset_tools').clean;
+
+var goldenFilename = path.join(__dirname, 'normalizer_golden.jsonl');
+var corpusFilenames = [
+  path.join(__dirname, 'datasets/better_reykjavik/sentiment/positive.polarity'),
+  path.join(__dirname, 'datasets/better_reykjavik/sentiment/negative.polarity')
+];
+
+var numLines = parseInt(process.argv[2] || '100000', 10);
+
+var legacyClean = function (removeDiacritics, string) {
+  string = string.replace(/(\r\n|\n|\r)/gm," ");
+  string = string.replace(',',' ');
+  string = string.replace('\n',' ');
+  string = string.replace(/\'/g,' ');
+  string = string.replace(/\,/g,' ');
+  string = string.replace(/\(/g,' ');
+  string = string.replace(/\=/g,' ');
+  string = string.replace(/\)/g,' ');
+  string = string.replace(/\-/g,' ');
+  string = string.replace(/\./g,' ');
+  string = string.replace(/['"]+/g, '');
+  string = string.replace(/<a\b[^>]*>(.*?)<\/a>/i," ");
+  string = removeDiacritics(string);
+  string = string.replace(/[^A-Za-z0-9(),!?\'\`]/, ' ');
+  string = string.replace(/[^\x00-\x7F]/g, " ");
+  string = string.replace(/\s+/g,' ').trim();
+  return string;
+};
+
+var timeClean = function (name, cleanFunction, lines) {
+  var start = process.hrtime();
+  for (var i = 0; i < lines.length; i++) {
+    cleanFunction(lines[i]);
+  }
+  var elapsed = process.hrtime(start);
+  var micros = (elapsed[0] * 1e9 + elapsed[1]) / 1e3;
+  console.log(name + ': ' + (micros / lines.length).toFixed(2) + ' us/sentence over ' + lines.length + ' lines');
+};
+
+var failures = 0;
+fs.readFileSync(goldenFilename, 'utf8').split('\n').forEach(function (line) {
+  if (line) {
+    var testCase = JSON.parse(line);
+    var output = clean(testCase.input);
+    if (output !== testCase.output) {
+      failures++;
+      console.log('MISMATCH ' + JSON.stringify(testCase.input) + ': expected ' +
+        JSON.stringify(testCase.output) + ' got ' + JSON.stringify(output));
+    }
+  }
+});
+if (failures > 0) {
+  process.exit(1);
+}
+console.log('Golden corpus OK');
+
+var lines = [];
+corpusFilenames.forEach(function (filename) {
+  fs.readFileSync(filename, 'utf8').split('\n').forEach(function (line) {
+    lines.push(line.trim());
+  });
+});
+while (lines.length < numLines) {
+  lines = lines.concat(lines);
+}
+lines = lines.slice(0, numLines);
+
+var removeDiacritics = null;
+try {
+  removeDiacritics = require('diacritics').remove;
+} catch (error) {
+  console.log('legacy clean: skipped, the diacritics module is not installed');
+}
+if (removeDiacritics) {
+  timeClean('legacy clean', legacyClean.bind(null, removeDiacritics), lines);
+}
+timeClean('clean', clean, lines);
@@ -1,10 +1,7 @@
 var models = require('../../models/index.cjs');
 var async = require('async');
 var fs = require('fs');
-
-var trainCategoriesCsv;
-var testCategoriesCsv;
-var classesCategoriesCsv;
+var _ = require('lodash');
 
 var trainCsvFilename = 'datasets/better_reykjavik/sentiment/train.csv';
 var testTrainCsvFilename = 'datasets/better_reykjavik/sentiment/test.csv';
@@ -13,135 +10,119 @@ var classesTrainCsvFilename = 'datasets/better_reykjavik/sentiment/classes.csv';
 var classesTrainPositiveCsvFilename = 'datasets/better_reykjavik/sentiment/positive.polarity';
 var classesTrainNegativeCsvFilename = 'datasets/better_reykjavik/sentiment/negative.polarity';
 
-var positive = [];
-var negative = [];
+var watermarkFilename = 'datasets/better_reykjavik/sentiment/export_watermark.json';
 
-var categories = { 0: [], 1: []};
 var categoriesIds = [ 0, 1 ];
 
 MAX_SENTIMENT_LENGTH = 700;
+TEST_FRACTION = 0.1;
 
 var clean = require('./dataset_tools').clean;
-var shuffleArray = require('./dataset_tools').shuffleArray;
+var forEachPageById = require('./dataset_tools').forEachPageById;
+var openExportStreams = require('./dataset_tools').openExportStreams;
+var writeLines = require('./dataset_tools').writeLines;
+var closeExportStreams = require('./dataset_tools').closeExportStreams;
+var readExportWatermark = require('./dataset_tools').readExportWatermark;
+var writeExportWatermark = require('./dataset_tools').writeExportWatermark;
+
+// With --incremental only points newer than the last export are appended to the existing files
+var incremental = process.argv.indexOf('--incremental') > -1;
+var watermark = incremental ? readExportWatermark(watermarkFilename) : { lastId: 0, counts: {} };
+var counts = _.extend({ 0: 0, 1: 0 }, watermark.counts);
+var streams;
 
 async.series([
   function(callback) {
-    var categoriesCsvRows = [];
+    streams = openExportStreams({
+      train: trainCsvFilename,
+      test: testTrainCsvFilename,
+      positive: classesTrainPositiveCsvFilename,
+      negative: classesTrainNegativeCsvFilename
+    }, incremental);
 
-    models.Post.findAll(
+    forEachPageById(models.Point,
       {
+        attributes: ['id', 'content', 'value'],
         where: {
-          status: 'published'
+          status: 'published',
+          value: { $ne: 0 }
         },
         include: [
           {
-            model: models.Point,
-            where: {
-              status: 'published'
-            }
-          },
-          {
-            model: models.Group,
+            model: models.Post,
+            attributes: ['id'],
             required: true,
             where: {
-              access: models.Group.ACCESS_PUBLIC
+              status: 'published'
             },
             include: [
               {
-                model: models.Community,
+                model: models.Group,
+                attributes: ['id'],
                 required: true,
                 where: {
-                  access: models.Community.ACCESS_PUBLIC
+                  access: models.Group.ACCESS_PUBLIC
                 },
                 include: [
                   {
-                    model: models.Domain,
+                    model: models.Community,
+                    attributes: ['id'],
                     required: true,
                     where: {
-                      id: { $in: [1,2] }
-                    }
+                      access: models.Community.ACCESS_PUBLIC
+                    },
+                    include: [
+                      {
+                        model: models.Domain,
+                        attributes: ['id'],
+                        required: true,
+                        where: {
+                          id: { $in: [1,2] }
+                        }
+                      }
+                    ]
                   }
                 ]
               }
             ]
           }
         ]
-      }).then(function (posts) {
-      console.log('Found '+posts.length+" posts");
-      async.eachSeries(posts, function (post, seriesCallback) {
-        async.eachSeries(post.Points, function (point, innerSeriesCallback) {
-          if (point.value != 0) {
-            content = '"'+clean(point.content)+'"';
-            if (content!="" && content.length>17) {
-              if (content.indexOf('Mypoint my point') == -1 &&
-                content.indexOf('Point against Point') == -1) {
-                if (point.value > 0) {
-                  categories['0'].push(content);
-                  positive.push(clean(point.content));
-                } else if (point.value < 0) {
-                  categories['1'].push(content);
-                  negative.push(clean(point.content));
-                }
-              }
+      }, watermark.lastId, function (points, pageCallback) {
+        var lines = { train: [], test: [], positive: [], negative: [] };
+        _.each(points, function (point) {
+          var cleanContent = clean(point.content);
+          var content = '"'+cleanContent+'"';
+          if (content.length>17 &&
+              content.indexOf('mypoint my point') == -1 &&
+              content.indexOf('point against point') == -1) {
+            var category_id = point.value > 0 ? 0 : 1;
+            if (counts[category_id] < MAX_SENTIMENT_LENGTH) {
+              counts[category_id] += 1;
+              lines[Math.random() < TEST_FRACTION ? 'test' : 'train'].push(category_id+','+content);
+              lines[category_id === 0 ? 'positive' : 'negative'].push(cleanContent);
             }
           }
-          innerSeriesCallback();
-        }, function () {
-          seriesCallback();
         });
-      }, function () {
-        async.eachSeries(categoriesIds, function (category_id, seriesCallback) {
-          console.log(category_id);
-          console.log("-----"+category_id+"---------------------------: "+categories[category_id].length);
-          if (categories[category_id].length>MAX_SENTIMENT_LENGTH) {
-            categories[category_id] = categories[category_id].splice(0,MAX_SENTIMENT_LENGTH);
-            console.log("-----"+category_id+"---------------------------: "+categories[category_id].length);
-          }
-          async.eachSeries(categories[category_id], function (post, innerSeriesCallback) {
-            categoriesCsvRows.push(category_id+','+post);
-            console.log("Key: "+category_id+" value: "+post);
-            innerSeriesCallback();
-          }, function () {
-            seriesCallback();
+        async.eachSeries(_.keys(lines), function (name, seriesCallback) {
+          writeLines(streams[name], lines[name], seriesCallback);
+        }, function (error) {
+          var allCategoriesFull = _.every(categoriesIds, function (category_id) {
+            return counts[category_id] >= MAX_SENTIMENT_LENGTH;
           });
-        }, function () {
-          trainCategoriesCsv = shuffleArray(categoriesCsvRows);
-          testCategoriesCsv = trainCategoriesCsv.splice(0,categoriesCsvRows.length*0.1);
-          callback();
+          pageCallback(error, allCategoriesFull);
         });
+      }, function (error, lastId) {
+        console.log("Exported: "+JSON.stringify(counts));
+        watermark = { lastId: lastId, counts: counts };
+        callback(error);
       });
-    }).catch(function(error) {
-      console.log("ERROR: "+error);
-    }) ;
   },
   function(callback) {
-    fs.writeFile(trainCsvFilename, trainCategoriesCsv.join('\n'), function(err) {
-      if(err) {
-         console.log(err);
-      }
-      callback();
-    });
+    closeExportStreams(streams, callback);
   },
   function(callback) {
-    fs.writeFile(testTrainCsvFilename, testCategoriesCsv.join('\n'), function(err) {
-      if(err) {
-        console.log(err);
-      }
-      callback();
-    });
-  },
-  function(callback) {
-    negative = positive.splice(0, MAX_SENTIMENT_LENGTH);
-    fs.writeFile(classesTrainPositiveCsvFilename, positive.join('\n'), function(err) {
-      if(err) {
-        console.log(err);
-      }
-      callback();
-    });
-  },
-  function(callback) {
-    negative = negative.splice(0, MAX_SENTIMENT_LENGTH);
-    fs.writeFile(classesTrainNegativeCsvFilename, negative.join('\n'), function(err) {
+    var classesCategoriesCsv = ["0,Positive","1,Negative"];
+    fs.writeFile(classesTrainCsvFilename, classesCategoriesCsv.join('\n'), function(err) {
       if(err) {
         console.log(err);
       }
@@ -149,17 +130,11 @@ async.series([
     });
   },
   function(callback) {
-    classesCategoriesCsv = ["0,Positive","1,Negative"];
-    callback();
-  },
-  function(callback) {
-    fs.writeFile(classesTrainCsvFilename, classesCategoriesCsv.join('\n'), function(err) {
-      if(err) {
-        console.log(err);
-      }
-      callback();
-    });
+    writeExportWatermark(watermarkFilename, watermark, callback);
   }
 ], function (error) {
+  if (error) {
+    console.log("ERROR: "+error);
+  }
   console.log("FINISHED :)");
 });
@@ -0,0 +1,336 @@
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const _ = require('lodash');
+const log = require('../../utils/logger.cjs');
+const getRedisCommands = require('../../utils/redis_commands.cjs');
+
+// Collects post actions in memory and ships them to the analytics service in batches.
+//
+// A batch is sent when MAX_BATCH_SIZE actions are buffered or FLUSH_INTERVAL_MS after the first
+// one arrived, with at most MAX_IN_FLIGHT batches on the wire. When the analytics service is slow
+// and more than MAX_BUFFERED actions are waiting, the callbacks of new actions are held back until
+// the buffer drains, which slows down the workers feeding it.
+//
+// Batches that fail are spooled to a Redis list, or to SPOOL_DIR when Redis is not ready, and
+// sent again after the next successful batch and when the process starts. Batches whose lookups
+// fail are spooled with their lookups. The Redis spool keeps the newest MAX_SPOOLED_BATCHES
+// batches, older ones are dropped and counted. The process using the buffer calls shutdown()
+// from its own shutdown path to spool what is still buffered.
+
+const MAX_BATCH_SIZE = process.env.ANALYTICS_EVENTS_BATCH_SIZE ? parseInt(process.env.ANALYTICS_EVENTS_BATCH_SIZE) : 500;
+const FLUSH_INTERVAL_MS = process.env.ANALYTICS_EVENTS_FLUSH_MS ? parseInt(process.env.ANALYTICS_EVENTS_FLUSH_MS) : 1000;
+const MAX_IN_FLIGHT = process.env.ANALYTICS_EVENTS_MAX_IN_FLIGHT ? parseInt(process.env.ANALYTICS_EVENTS_MAX_IN_FLIGHT) : 2;
+const MAX_BUFFERED = process.env.ANALYTICS_EVENTS_MAX_BUFFERED ? parseInt(process.env.ANALYTICS_EVENTS_MAX_BUFFERED) : 5000;
+const SPOOL_DIR = process.env.ANALYTICS_EVENTS_SPOOL_DIR || path.join(os.tmpdir(), 'analytics-events-spool');
+
+const SPOOL_KEY = 'analytics:post-actions:spool';
+const MAX_SPOOLED_BATCHES = 10000;
+const STARTUP_REPLAY_DELAY_MS = 10000;
+const SHUTDOWN_WAIT_MS = 5000;
+
+// Spooled batches are arrays of actions or { items } with the lookups still to do, the lookup
+// model is stored by name
+const serializeItems = (items) => ({
+  items: items.map(item => ({
+    action: item.action,
+    lookup: item.lookup && item.lookup.itemId ? { model: item.lookup.model.name, itemId: item.lookup.itemId } : null
+  }))
+});
+
+const deserializeItems = (batch) => {
+  const models = require('../../../models/index.cjs');
+  return batch.items.map(item => ({
+    action: item.action,
+    lookup: item.lookup ? { model: models[item.lookup.model], itemId: item.lookup.itemId } : null
+  }));
+};
+
+const batchLength = (batch) => Array.isArray(batch) ? batch.length : batch.items.length;
+
+/**
+ * Creates a buffer that hands arrays of post actions to sendBatch(posts, callback).
+ * Items are { action, lookup } where lookup = { model, itemId } names the endorsement, rating or
+ * point quality to take user_agent and ip_address from, looked up for the whole batch at once.
+ */
+const createEventsBuffer = (sendBatch) => {
+  let buffer = [];
+  let waitingCallbacks = [];
+  let flushTimer = null;
+  let inFlightBatches = 0;
+  let inFlightItems = 0;
+  let replaying = false;
+
+  const stats = {
+    added: 0,
+    sentBatches: 0,
+    sentActions: 0,
+    failedBatches: 0,
+    failedLookups: 0,
+    spooledBatches: 0,
+    droppedSpooledBatches: 0,
+    replayedBatches: 0,
+    droppedActions: 0
+  };
+
+  const pendingCount = () => buffer.length + inFlightItems;
+
+  const releaseWaitingCallbacks = () => {
+    while (waitingCallbacks.length > 0 && pendingCount() < MAX_BUFFERED) {
+      waitingCallbacks.shift()();
+    }
+  };
+
+  // One findAll per model for the whole batch instead of a findOne per action
+  const resolveLookups = async (items) => {
+    const lookupItems = items.filter(item => item.lookup && item.lookup.itemId);
+    const byModel = _.groupBy(lookupItems, item => item.lookup.model.name);
+    for (const modelName of Object.keys(byModel)) {
+      const modelItems = byModel[modelName];
+      const rows = await modelItems[0].lookup.model.findAll({
+        where: {
+          id: {
+            $in: _.uniq(modelItems.map(item => item.lookup.itemId))
+          }
+        },
+        attributes: ['id', 'user_agent', 'ip_address']
+      });
+      const rowsById = new Map(rows.map(row => [row.id, row]));
+      modelItems.forEach(item => {
+        const row = rowsById.get(parseInt(item.lookup.itemId));
+        if (row) {
+          item.action.user_agent = row.user_agent;
+          item.action.ip_address = row.ip_address;
+        } else {
+          item.missing = true;
+          stats.droppedActions += 1;
+          log.error("Can't find item for post action", { model: modelName, itemId: item.lookup.itemId });
+        }
+      });
+    }
+    return items.filter(item => !item.missing).map(item => item.action);
+  };
+
+  const send = (posts) => {
+    return new Promise((resolve, reject) => {
+      sendBatch(posts, (error) => {
+        if (error) {
+          reject(error);
+        } else {
+          resolve();
+        }
+      });
+    });
+  };
+
+  const spoolToDisk = async (batch) => {
+    await fs.promises.mkdir(SPOOL_DIR, { recursive: true });
+    const fileName = `post-actions-${process.pid}-${Date.now()}-${Math.random().toString(36).slice(2, 8)}.json`;
+    await fs.promises.writeFile(path.join(SPOOL_DIR, fileName), JSON.stringify(batch));
+  };
+
+  const spool = async (batch) => {
+    const redis = getRedisCommands();
+    if (redis) {
+      try {
+        const spoolLength = await redis.rPush(SPOOL_KEY, JSON.stringify(batch));
+        stats.spooledBatches += 1;
+        if (spoolLength > MAX_SPOOLED_BATCHES) {
+          await redis.lTrim(SPOOL_KEY, -MAX_SPOOLED_BATCHES, -1);
+          stats.droppedSpooledBatches += spoolLength - MAX_SPOOLED_BATCHES;
+          log.error("Post action spool is full, dropped the oldest batches", { dropped: spoolLength - MAX_SPOOLED_BATCHES });
+        }
+        return;
+      } catch (error) {
+        log.error("Could not spool post actions to Redis", { err: error, count: batchLength(batch) });
+      }
+    }
+    try {
+      await spoolToDisk(batch);
+      stats.spooledBatches += 1;
+    } catch (error) {
+      stats.droppedActions += batchLength(batch);
+      log.error("Could not spool post actions, dropping them", { err: error, count: batchLength(batch) });
+    }
+  };
+
+  // Sends a spooled batch, doing its lookups first when they failed before
+  const sendSpooled = async (batch) => {
+    const posts = Array.isArray(batch) ? batch : await resolveLookups(deserializeItems(batch));
+    if (posts.length > 0) {
+      await send(posts);
+    }
+  };
+
+  const replayDiskSpool = async () => {
+    let fileNames;
+    try {
+      fileNames = await fs.promises.readdir(SPOOL_DIR);
+    } catch (error) {
+      return;
+    }
+    for (const fileName of fileNames.filter(name => name.endsWith('.json'))) {
+      const filePath = path.join(SPOOL_DIR, fileName);
+      let batch;
+      try {
+        batch = JSON.parse(await fs.promises.readFile(filePath, 'utf8'));
+        // Removed before sending so two processes sharing the directory never send it twice
+        await fs.promises.unlink(filePath);
+      } catch (error) {
+        continue;
+      }
+      try {
+        await sendSpooled(batch);
+        stats.replayedBatches += 1;
+      } catch (error) {
+        await spool(batch);
+        return;
+      }
+    }
+  };
+
+  const replayRedisSpool = async () => {
+    const redis = getRedisCommands();
+    if (!redis) {
+      return;
+    }
+    let batchJson;
+    while ((batchJson = await redis.lPop(SPOOL_KEY))) {
+      try {
+        await sendSpooled(JSON.parse(batchJson));
+        stats.replayedBatches += 1;
+      } catch (error) {
+        await redis.lPush(SPOOL_KEY, batchJson);
+        return;
+      }
+    }
+  };
+
+  const replaySpool = () => {
+    if (!replaying) {
+      replaying = true;
+      replayRedisSpool().then(replayDiskSpool).catch(error => {
+        log.error("Could not replay spooled post actions", { err: error });
+      }).then(() => {
+        replaying = false;
+      });
+    }
+  };
+
+  const sendItems = async (items) => {
+    let posts;
+    try {
+      posts = await resolveLookups(items);
+    } catch (error) {
+      // Spooled with the lookups, they are done again when the spool is replayed
+      stats.failedLookups += 1;
+      log.error("Post action lookups failed, spooling the actions", { err: error, count: items.length });
+      await spool(serializeItems(items));
+      return;
+    }
+    if (posts.length === 0) {
+      return;
+    }
+    try {
+      await send(posts);
+      stats.sentBatches += 1;
+      stats.sentActions += posts.length;
+      replaySpool();
+    } catch (error) {
+      stats.failedBatches += 1;
+      log.error("Sending post actions failed, spooling them", { err: error, count: posts.length });
+      await spool(posts);
+    }
+  };
+
+  const flush = () => {
+    if (flushTimer) {
+      clearTimeout(flushTimer);
+      flushTimer = null;
+    }
+    while (buffer.length > 0 && inFlightBatches < MAX_IN_FLIGHT) {
+      const items = buffer.splice(0, MAX_BATCH_SIZE);
+      inFlightBatches += 1;
+      inFlightItems += items.length;
+      sendItems(items).catch(error => {
+        log.error("Post action batch failed", { err: error, count: items.length });
+      }).then(() => {
+        inFlightBatches -= 1;
+        inFlightItems -= items.length;
+        releaseWaitingCallbacks();
+        if (buffer.length >= MAX_BATCH_SIZE) {
+          flush();
+        } else if (buffer.length > 0) {
+          scheduleFlush();
+        }
+      });
+    }
+  };
+
+  const scheduleFlush = () => {
+    if (!flushTimer) {
+      flushTimer = setTimeout(flush, FLUSH_INTERVAL_MS);
+    }
+  };
+
+  // The callback is called once the action is buffered, or when the buffer is over MAX_BUFFERED
+  // once enough of it has been sent
+  const add = (item, callback) => {
+    stats.added += 1;
+    buffer.push(item);
+    if (buffer.length >= MAX_BATCH_SIZE) {
+      flush();
+    } else {
+      scheduleFlush();
+    }
+    if (pendingCount() > MAX_BUFFERED) {
+      waitingCallbacks.push(callback);
+    } else {
+      callback();
+    }
+  };
+
+  const getStats = () => Object.assign({
+    buffered: buffer.length,
+    inFlightBatches,
+    inFlightItems,
+    waitingCallbacks: waitingCallbacks.length
+  }, stats);
+
+  /**
+   * Spools the buffered actions and waits up to SHUTDOWN_WAIT_MS for batches on the wire, for the
+   * shutdown path of the process using the buffer
+   */
+  const shutdown = async () => {
+    if (flushTimer) {
+      clearTimeout(flushTimer);
+      flushTimer = null;
+    }
+    const items = buffer;
+    buffer = [];
+    try {
+      if (items.length > 0) {
+        log.info("Spooling buffered post actions before exit", { count: items.length });
+        await spool(serializeItems(items));
+      }
+      const waitUntil = Date.now() + SHUTDOWN_WAIT_MS;
+      while (inFlightBatches > 0 && Date.now() < waitUntil) {
+        await new Promise(resolve => setTimeout(resolve, 100));
+      }
+    } catch (error) {
+      log.error("Could not spool post actions before exit", { err: error, count: items.length });
+    }
+  };
+
+  // Picks up batches spooled before a restart, after Redis had time to connect
+  setTimeout(replaySpool, STARTUP_REPLAY_DELAY_MS).unref();
+
+  return {
+    add,
+    flush,
+    getStats,
+    shutdown
+  };
+};
+
+module.exports = createEventsBuffer;
@@ -1,8 +1,9 @@
 const models = require('../../../models/index.cjs');
 const _ = require('lodash');
-const async = require('async');
 const log = require('../../utils/logger.cjs');
 const request = require('request');
+const recordPostAction = require('./ranking.cjs').recordPostAction;
+const createEventsBuffer = require('./events_buffer.cjs');
 
 let airbrake = null;
 
@@ -48,56 +49,79 @@ const createManyActions = (posts, callback) => {
     json: { posts: posts }
   };
 
-  request.post(options, (error) => {
+  request.post(options, (error, content) => {
+    if (!error && content && (content.statusCode < 200 || content.statusCode >= 300)) {
+      error = content.statusCode;
+    }
     callback(error);
   });
 };
 
-const createEndorsementTypeAction = (model, activity, itemId, type, done) => {
-  let userAgent;
-  let ipAddress;
-
-  async.series([
-    (seriesCallback) => {
-      if (itemId) {
-        model.findOne({
-          where: {
-            id: itemId
-          },
-          attributes: ['id','user_agent','ip_address']
-        }).then(endorsement => {
-          if (endorsement) {
-            userAgent = endorsement.user_agent;
-            ipAddress = endorsement.ip_address;
-            seriesCallback();
-          } else {
-            seriesCallback("Can't find endorsement: "+activity.object.endorsementId)
-          }
-        }).catch( error => {
-          seriesCallback(error);
-        })
-      } else {
-        log.error("Can't find itemId for createEndorsementTypeAction");
-        seriesCallback();
-      }
+let eventsBuffer = null;
+
+const getEventsBuffer = () => {
+  if (!eventsBuffer) {
+    eventsBuffer = createEventsBuffer(createManyActions);
+  }
+  return eventsBuffer;
+};
+
+// Buffers the action, it is sent with others through addManyPostActions.
+// The user agent and ip address are read from lookup = { model, itemId } when given.
+const queueAction = (userAgent, ipAddress, postId, userId, date, action, lookup, callback) => {
+  getEventsBuffer().add({
+    action: {
+      user_agent: userAgent,
+      ip_address: ipAddress,
+      postId,
+      userId,
+      date,
+      action,
+      esId: `${postId}-${userId}-${action}`
     },
-    (seriesCallback) => {
-      createAction(
-        userAgent,
-        ipAddress,
-        activity.Post.id,
-        activity.user_id,
-        activity.created_at.toISOString(),
-        type,
-        seriesCallback
-      );
-    }
-  ], error => {
-    done(error);
-  })
+    lookup
+  }, callback);
+};
+
+const createEndorsementTypeAction = (model, activity, itemId, type, done) => {
+  if (!itemId) {
+    log.error("Can't find itemId for createEndorsementTypeAction");
+  }
+  queueAction(
+    null,
+    null,
+    activity.Post.id,
+    activity.user_id,
+    activity.created_at.toISOString(),
+    type,
+    itemId ? { model, itemId } : null,
+    done
+  );
 }
 
+const RANKING_ACTIONS = {
+  "activity.post.endorsement.new": 'endorse',
+  "activity.post.rating.new": 'endorse',
+  "activity.post.opposition.new": 'oppose',
+  "activity.post.new": 'new-post',
+  "activity.point.new": 'new-point',
+  "activity.point.helpful.new": 'point-helpful',
+  "activity.point.unhelpful.new": 'point-unhelpful'
+};
+
+// Feeds the group rankings in Redis, also when the analytics service is not set up
+const recordActivityInRanking = (activity) => {
+  const action = RANKING_ACTIONS[activity.type];
+  const postId = activity.post_id || (activity.Point && activity.Point.Post ? activity.Point.Post.id : null);
+  if (action && postId) {
+    recordPostAction(activity.group_id, postId, action, activity.created_at);
+  }
+};
+
 const generateRecommendationEvent = (activity, callback) => {
+  if (activity) {
+    recordActivityInRanking(activity);
+  }
   if (process.env["AC_ANALYTICS_BASE_URL"] && activity) {
     log.info('Events Manager generateRecommendationEvent', {type: activity.type, userId: activity.user_id });
     switch (activity.type) {
@@ -113,33 +137,33 @@ const generateRecommendationEvent = (activity, callback) => {
         createEndorsementTypeAction(models.Endorsement, activity, activity.object.endorsementId, 'oppose',  callback);
         break;
       case "activity.post.new":
-        createAction(
+        queueAction(
           activity.Post.user_agent,
           activity.Post.ip_address,
           activity.Post.id,
           activity.user_id,
           activity.created_at.toISOString(),
-          'new-post', callback);
+          'new-post', null, callback);
         break;
       case "activity.point.new":
       case "activity.point.copied":
         if (activity.Point) {
           if (activity.Point.value==0 && activity.Point.Post) {
-            createAction(
+            queueAction(
               activity.Point.user_agent,
               activity.Point.ip_address,
               activity.Point.Post.id,
               activity.user_id,
               activity.created_at.toISOString(),
-              'new-point-comment', callback);
+              'new-point-comment', null, callback);
           } else if (activity.Point.Post) {
-            createAction(
+            queueAction(
               activity.Point.user_agent,
               activity.Point.ip_address,
               activity.Point.Post.id,
               activity.user_id,
               activity.created_at.toISOString(),
-              'new-point', callback);
+              'new-point', null, callback);
           } else {
             callback();
           }
@@ -238,5 +262,8 @@ module.exports = {
   getRecommendationFor,
   isItemRecommended,
   createAction,
-  createManyActions
+  createManyActions,
+  getEventsStats: () => getEventsBuffer().getStats(),
+  // Spools the buffered post actions, called from the shutdown path of the worker or server
+  shutdownEventsBuffer: () => eventsBuffer ? eventsBuffer.shutdown() : Promise.resolve()
 };
\ No newline at end of file
@@ -0,0 +1,193 @@
+const models = require('../../../models/index.cjs');
+const _ = require('lodash');
+const log = require('../../utils/logger.cjs');
+const getRedisCommands = require('../../utils/redis_commands.cjs');
+
+// Ranked post lists kept in Redis sorted sets so recommendation requests are a ZRANGE and never
+// wait for the external recommender.
+//
+//  recommendations:group:<groupId>:segment:all        Every post action in the group adds a time
+//    weighted score (forward decay, newer actions weigh more without rescoring old ones)
+//  recommendations:group:<groupId>:segment:user:<id>  The personal ranking from the external
+//    recommender, refreshed in the background when it is older than USER_RANKING_TTL
+//
+// Requests use the personal ranking when it exists and the group ranking otherwise.
+
+const GROUP_RANKING_TTL = 60 * 60 * 24 * 30;
+const USER_RANKING_TTL = process.env.USER_RECOMMENDATIONS_TTL ? parseInt(process.env.USER_RECOMMENDATIONS_TTL) : 15 * 60;
+const POST_CACHE_TTL = process.env.RECOMMENDATIONS_POST_CACHE_TTL ? parseInt(process.env.RECOMMENDATIONS_POST_CACHE_TTL) : 5 * 60;
+const REFRESH_LOCK_TTL = 60;
+const MAX_RANKED_POSTS = 500;
+
+// Actions double in weight every DECAY_HALF_LIFE_DAYS, counted from a fixed epoch
+const DECAY_HALF_LIFE_DAYS = 14;
+const DECAY_EPOCH = Date.UTC(2024, 0, 1);
+
+const ACTION_WEIGHTS = {
+  'new-post': 3,
+  'endorse': 2,
+  'oppose': 1,
+  'new-point': 1,
+  'new-point-comment': 1,
+  'point-helpful': 0.5,
+  'point-unhelpful': 0.25
+};
+
+const groupRankingKey = (groupId) => `recommendations:group:${groupId}:segment:all`;
+
+const userRankingKey = (groupId, userId) => `recommendations:group:${groupId}:segment:user:${userId}`;
+
+const decayedWeight = (action, date) => {
+  const days = (new Date(date).getTime() - DECAY_EPOCH) / (1000 * 60 * 60 * 24);
+  return (ACTION_WEIGHTS[action] || 1) * Math.pow(2, days / DECAY_HALF_LIFE_DAYS);
+};
+
+// Called by the events manager for every post action
+const recordPostAction = (groupId, postId, action, date) => {
+  const redis = getRedisCommands();
+  if (redis && groupId && postId) {
+    const key = groupRankingKey(groupId);
+    redis.zIncrBy(key, decayedWeight(action, date), postId.toString()).then(() => {
+      return redis.expire(key, GROUP_RANKING_TTL);
+    }).catch(error => {
+      log.error("Recommendation ranking update failed", { err: error, groupId, postId });
+    });
+  }
+};
+
+// Takes a short lived lock so only one process refreshes a ranking at a time
+const acquireRefreshLock = async (redis, key) => {
+  return (await redis.set(`${key}:refreshing`, '1', { NX: true, EX: REFRESH_LOCK_TTL })) === 'OK';
+};
+
+const replaceRanking = async (redis, key, postIds, ttl) => {
+  const multi = redis.multi().del(key);
+  if (postIds.length > 0) {
+    // Score by position so ZRANGE returns the list in the recommender's order
+    multi.zAdd(key, postIds.map((postId, index) => ({ score: index, value: postId.toString() })));
+    multi.expire(key, ttl);
+  }
+  await multi.exec();
+};
+
+// Seeds an empty group ranking from the endorsement counters
+const seedGroupRanking = async (redis, groupId) => {
+  const key = groupRankingKey(groupId);
+  if (!(await acquireRefreshLock(redis, key))) {
+    return;
+  }
+  const posts = await models.Post.findAll({
+    where: {
+      group_id: groupId
+    },
+    attributes: ['id', 'counter_endorsements_up', 'counter_endorsements_down', 'counter_points', 'created_at'],
+    order: [['counter_endorsements_up', 'desc']],
+    limit: MAX_RANKED_POSTS
+  });
+  if (posts.length > 0) {
+    await redis.zAdd(key, posts.map(post => ({
+      score: decayedWeight('new-post', post.created_at) *
+        (1 + Math.max(0, post.counter_endorsements_up - post.counter_endorsements_down) + post.counter_points),
+      value: post.id.toString()
+    })));
+    await redis.expire(key, GROUP_RANKING_TTL);
+  }
+};
+
+// fetchRecommendations(callback) asks the external recommender for the user's ranked post ids
+const refreshUserRanking = async (redis, groupId, userId, fetchRecommendations) => {
+  const key = userRankingKey(groupId, userId);
+  if (!(await acquireRefreshLock(redis, key))) {
+    return;
+  }
+  fetchRecommendations((error, recommendedItemIds) => {
+    if (error) {
+      log.warn("Recommendation refresh failed, serving the group ranking", { err: error, groupId, userId });
+    } else if (recommendedItemIds) {
+      replaceRanking(redis, key, recommendedItemIds, USER_RANKING_TTL).catch(error => {
+        log.error("Recommendation ranking write failed", { err: error, groupId, userId });
+      });
+    }
+  });
+};
+
+/**
+ * Returns the ranked post ids for a user in a group, best first.
+ * Stale or missing rankings are refreshed in the background and never delay the answer.
+ */
+const getRankedPostIds = async (groupId, userId, limit, fetchRecommendations) => {
+  const redis = getRedisCommands();
+  if (!redis) {
+    return [];
+  }
+
+  let postIds = [];
+  if (userId && userId !== -1) {
+    const key = userRankingKey(groupId, userId);
+    postIds = await redis.zRange(key, 0, limit - 1);
+    if (postIds.length === 0 || (await redis.ttl(key)) < USER_RANKING_TTL / 2) {
+      refreshUserRanking(redis, groupId, userId, fetchRecommendations).catch(error => {
+        log.error("Recommendation refresh failed", { err: error, groupId, userId });
+      });
+    }
+  }
+
+  if (postIds.length === 0) {
+    postIds = await redis.zRange(groupRankingKey(groupId), 0, limit - 1, { REV: true });
+    if (postIds.length === 0) {
+      seedGroupRanking(redis, groupId).catch(error => {
+        log.error("Recommendation ranking seed failed", { err: error, groupId });
+      });
+    }
+  }
+
+  return postIds.map(postId => parseInt(postId));
+};
+
+/**
+ * Loads posts with the given attributes and include in postIds order. Posts are cached in Redis
+ * by id, only the missing ones are queried.
+ */
+const hydratePosts = async (postIds, cacheName, findOptions) => {
+  const redis = getRedisCommands();
+  const cacheKeys = postIds.map(postId => `cache:${cacheName}:post:${postId}`);
+  const cached = redis && postIds.length > 0 ? await redis.mGet(cacheKeys) : [];
+
+  const postsById = new Map();
+  postIds.forEach((postId, index) => {
+    if (cached[index]) {
+      postsById.set(postId, JSON.parse(cached[index]));
+    }
+  });
+
+  const missingIds = postIds.filter(postId => !postsById.has(postId));
+  if (missingIds.length > 0) {
+    const posts = await models.Post.findAll(Object.assign({}, findOptions, {
+      where: {
+        id: {
+          $in: missingIds
+        }
+      }
+    }));
+    const multi = redis ? redis.multi() : null;
+    posts.forEach(post => {
+      const postJson = post.toJSON();
+      postsById.set(post.id, postJson);
+      if (multi) {
+        multi.setEx(`cache:${cacheName}:post:${post.id}`, POST_CACHE_TTL, JSON.stringify(postJson));
+      }
+    });
+    if (multi && posts.length > 0) {
+      await multi.exec();
+    }
+  }
+
+  const positions = new Map(postIds.map((postId, index) => [postId, index]));
+  return _.sortBy(Array.from(postsById.values()), post => positions.get(post.id));
+};
+
+module.exports = {
+  recordPostAction,
+  getRankedPostIds,
+  hydratePosts
+};
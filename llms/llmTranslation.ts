@@ -5,17 +5,196 @@ import { parse } from "path";
 import { Translate } from "aws-sdk";
 import * as cheerio from "cheerio";
 import { Cheerio } from "cheerio";
+import { createHash } from "crypto";
+
+// Translated segments keyed by language and segment hash, shared by all instances so strings
+// repeated across welcome pages and questions are only sent to the LLM once per process
+const segmentCache = new Map<string, string>();
+const maxSegmentCacheEntries = process.env.LLM_SEGMENT_CACHE_MAX_ENTRIES
+  ? parseInt(process.env.LLM_SEGMENT_CACHE_MAX_ENTRIES)
+  : 50000;
 
 export class YpLlmTranslation {
   openaiClient: OpenAI;
   modelName = "gpt-4o";
   maxTokens = 4000;
   temperature = 0.0;
+  maxConcurrentBatches = process.env.LLM_TRANSLATION_CONCURRENCY
+    ? parseInt(process.env.LLM_TRANSLATION_CONCURRENCY)
+    : 4;
+  maxBatchRetries = 2;
+  retryBaseDelayMs = 1000;
+
+  // A fake client with chat.completions.create and moderations.create can be passed in tests
+  constructor(openaiClient?: OpenAI) {
+    this.openaiClient =
+      openaiClient ||
+      new OpenAI({
+        apiKey: process.env.OPENAI_API_KEY,
+      });
+  }
 
-  constructor() {
-    this.openaiClient = new OpenAI({
-      apiKey: process.env.OPENAI_API_KEY,
-    });
+  static segmentCacheKey(languageIsoCode: string, segment: string) {
+    return `${languageIsoCode}:${createHash("sha1")
+      .update(segment)
+      .digest("hex")}`;
+  }
+
+  static getCachedSegment(languageIsoCode: string, segment: string) {
+    return segmentCache.get(
+      YpLlmTranslation.segmentCacheKey(languageIsoCode, segment)
+    );
+  }
+
+  static setCachedSegment(
+    languageIsoCode: string,
+    segment: string,
+    translation: string
+  ) {
+    const key = YpLlmTranslation.segmentCacheKey(languageIsoCode, segment);
+    segmentCache.delete(key);
+    segmentCache.set(key, translation);
+    while (segmentCache.size > maxSegmentCacheEntries) {
+      segmentCache.delete(segmentCache.keys().next().value!);
+    }
+  }
+
+  static clearSegmentCache() {
+    segmentCache.clear();
+  }
+
+  // Rough token count, about four characters per token plus the JSON quoting per string
+  estimateTokens(text: string) {
+    return Math.ceil(text.length / 4) + 4;
+  }
+
+  // Groups strings into batches whose translations should fit in maxTokens of output.
+  // Translations can take more tokens than the source so only half of maxTokens is used.
+  createTokenBatches(strings: string[]): string[][] {
+    const tokenBudget = Math.floor(this.maxTokens / 2);
+    const batches: string[][] = [];
+    let batch: string[] = [];
+    let batchTokens = 0;
+    for (const text of strings) {
+      const tokens = this.estimateTokens(text);
+      if (batch.length > 0 && batchTokens + tokens > tokenBudget) {
+        batches.push(batch);
+        batch = [];
+        batchTokens = 0;
+      }
+      batch.push(text);
+      batchTokens += tokens;
+    }
+    if (batch.length > 0) {
+      batches.push(batch);
+    }
+    return batches;
+  }
+
+  sleep(ms: number) {
+    return new Promise((resolve) => setTimeout(resolve, ms));
+  }
+
+  // Moderates the batch once, then retries failed or misaligned translations with exponential
+  // backoff. callSimpleLlm is called without its own retries so this is the only retry layer.
+  async translateBatchWithRetry(
+    languageIsoCode: string,
+    batch: string[]
+  ): Promise<string[] | null | undefined> {
+    try {
+      if (await this.getModerationFlag(batch.join(" "))) {
+        console.error("Flagged:", batch);
+        return null;
+      }
+    } catch (error) {
+      console.error("Error in batch moderation:", error);
+      return undefined;
+    }
+    const languageName =
+      YpLanguages.getEnglishName(languageIsoCode) || languageIsoCode;
+    for (let attempt = 0; attempt <= this.maxBatchRetries; attempt++) {
+      if (attempt > 0) {
+        await this.sleep(this.retryBaseDelayMs * 2 ** (attempt - 1));
+      }
+      const translatedBatch = await this.callSimpleLlm(
+        languageName,
+        batch,
+        true,
+        this.renderListTranslationSystemMessage,
+        this.renderListTranslationUserMessage,
+        0
+      );
+      if (
+        Array.isArray(translatedBatch) &&
+        translatedBatch.length === batch.length
+      ) {
+        return translatedBatch;
+      }
+      console.warn(
+        `Batch translation attempt ${attempt + 1} failed for ${batch.length} strings`
+      );
+    }
+    return undefined;
+  }
+
+  // Translates strings in token sized batches with at most maxConcurrentBatches in flight.
+  // Cached segments are not sent, new translations are added to the cache.
+  async getCachedListTranslation(
+    languageIsoCode: string,
+    strings: string[]
+  ): Promise<string[] | undefined> {
+    const translations = new Map<string, string>();
+    const missing: string[] = [];
+    for (const text of new Set(strings)) {
+      const cached = YpLlmTranslation.getCachedSegment(languageIsoCode, text);
+      if (cached !== undefined) {
+        translations.set(text, cached);
+      } else {
+        missing.push(text);
+      }
+    }
+
+    const batches = this.createTokenBatches(missing);
+    console.log(
+      `Translating ${missing.length} of ${strings.length} strings in ${batches.length} batches`
+    );
+
+    let nextBatch = 0;
+    let failed = false;
+    const worker = async () => {
+      while (!failed && nextBatch < batches.length) {
+        const batch = batches[nextBatch++];
+        const translatedBatch = await this.translateBatchWithRetry(
+          languageIsoCode,
+          batch
+        );
+        if (!translatedBatch) {
+          console.error("Failed to translate batch:", batch);
+          failed = true;
+          return;
+        }
+        batch.forEach((text, i) => {
+          translations.set(text, translatedBatch[i]);
+          YpLlmTranslation.setCachedSegment(
+            languageIsoCode,
+            text,
+            translatedBatch[i]
+          );
+        });
+      }
+    };
+
+    await Promise.all(
+      Array.from(
+        { length: Math.min(this.maxConcurrentBatches, batches.length) },
+        worker
+      )
+    );
+
+    if (failed) {
+      return undefined;
+    }
+    return strings.map((text) => translations.get(text)!);
   }
 
   extractHtmlStrings(html: string): string[] {
@@ -321,20 +500,12 @@ export class YpLlmTranslation {
         return htmlToTranslate;
       }
 
-      const batchSize = 10;
-      const translatedStrings: string[] = [];
-      for (let i = 0; i < originalStrings.length; i += batchSize) {
-        const batch = originalStrings.slice(i, i + batchSize);
-        const translatedBatch = await this.getListTranslation(
-          languageIsoCode,
-          batch
-        );
-        if (translatedBatch) {
-          translatedStrings.push(...translatedBatch);
-        } else {
-          console.error("Failed to translate batch:", batch);
-          return undefined;
-        }
+      const translatedStrings = await this.getCachedListTranslation(
+        languageIsoCode,
+        originalStrings
+      );
+      if (!translatedStrings) {
+        return undefined;
       }
 
       // Replace original strings in HTML with their translations
@@ -480,7 +651,8 @@ export class YpLlmTranslation {
     toTranslate: string[] | string,
     parseJson: boolean,
     systemRenderer: Function,
-    userRenderer: Function
+    userRenderer: Function,
+    maxRetries = 3
   ): Promise<string | object | null | undefined> {
     const messages = [
       {
@@ -493,7 +665,6 @@ export class YpLlmTranslation {
       },
     ] as any;
 
-    const maxRetries = 3;
     let retries = 0;
 
     let running = true;
@@ -531,6 +702,7 @@ export class YpLlmTranslation {
           running = false;
           return undefined;
         }
+        await this.sleep(this.retryBaseDelayMs * 2 ** (retries - 1));
       }
     }
   }
@@ -97,6 +97,11 @@ module.exports = (sequelize, DataTypes) => {
     AcActivity.belongsToMany(models.AcNotification, { as: 'AcActivities', through: 'notification_activities' });
   };
 
+  // Keeps the daily counts for the stats dashboards up to date
+  AcActivity.addHook("afterCreate", (activity) => {
+    require('../engine/analytics/activity_rollups.cjs').recordActivity(activity);
+  });
+
   AcActivity.ACCESS_PUBLIC = 0;
   AcActivity.ACCESS_COMMUNITY = 1;
   AcActivity.ACCESS_GROUP = 2;
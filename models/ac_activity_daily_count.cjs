@@ -0,0 +1,36 @@
+"use strict";
+
+// Daily activity counts per domain, community and group, maintained by
+// engine/analytics/activity_rollups.cjs and read by the stats dashboards
+
+module.exports = (sequelize, DataTypes) => {
+  const AcActivityDailyCount = sequelize.define("AcActivityDailyCount", {
+    scope_type: { type: DataTypes.STRING, allowNull: false },
+    scope_id: { type: DataTypes.INTEGER, allowNull: false },
+    type: { type: DataTypes.STRING, allowNull: false },
+    day: { type: DataTypes.DATEONLY, allowNull: false },
+    count: { type: DataTypes.INTEGER, allowNull: false, defaultValue: 0 }
+  }, {
+
+    timestamps: true,
+    createdAt: 'created_at',
+    updatedAt: 'updated_at',
+
+    indexes: [
+      {
+        name: 'activity_daily_counts_scope_type_day',
+        unique: true,
+        fields: ['scope_type', 'scope_id', 'type', 'day']
+      },
+      {
+        fields: ['day']
+      }
+    ],
+
+    underscored: true,
+
+    tableName: 'ac_activity_daily_counts'
+  });
+
+  return AcActivityDailyCount;
+};
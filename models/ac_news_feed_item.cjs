@@ -19,6 +19,9 @@ module.exports = (sequelize, DataTypes) => {
       }
     },
 
+    // The unique index on ac_activity_id, type and the scope columns that bulkCreate with
+    // ignoreDuplicates relies on is an expression index, it is created by
+    // scripts/news_feed_items_add_unique_index.js
     indexes: _.concat(commonIndexForActivitiesAndNewsFeeds('latest_activity_at'), [
       {
         fields: ['id'],
@@ -1,8 +1,9 @@
 "use strict";
 
-const { Translate } = require("@google-cloud/translate").v2;
 const farmhash = require("farmhash");
 const log = require("../utils/logger.cjs");
+const translationLookupCache = require("../utils/translation_lookup_cache.cjs");
+const googleTranslateBatcher = require("../utils/google_translate_batcher.cjs");
 
 const PAIRWISE_API_HOST = process.env.PAIRWISE_API_HOST;
 const PAIRWISE_USERNAME = process.env.PAIRWISE_USERNAME;
@@ -10,6 +11,8 @@ const PAIRWISE_PASSWORD = process.env.PAIRWISE_PASSWORD;
 
 const HAS_LLM = process.env.OPENAI_API_KEY;
 
+const inFlightLookups = new Map();
+
 const defaultAuthHeader = {
   "Content-Type": "application/json",
   Authorization: `Basic ${Buffer.from(
@@ -28,6 +31,11 @@ module.exports = (sequelize, DataTypes) => {
     {
       index_key: { type: DataTypes.STRING, allowNull: false },
       content: { type: DataTypes.TEXT, allowNull: false },
+      // Parts of index_key, filled in from it on save so lookups by object don't need LIKE
+      text_type: { type: DataTypes.STRING, allowNull: true },
+      object_id: { type: DataTypes.INTEGER, allowNull: true },
+      language: { type: DataTypes.STRING, allowNull: true },
+      content_hash: { type: DataTypes.STRING, allowNull: true },
     },
     {
       indexes: [
@@ -35,6 +43,14 @@ module.exports = (sequelize, DataTypes) => {
           name: "main_index",
           fields: ["index_key"],
         },
+        {
+          name: "translation_cache_object_index",
+          fields: ["text_type", "object_id", "content_hash"],
+        },
+        {
+          name: "translation_cache_language_index",
+          fields: ["language"],
+        },
       ],
 
       underscored: true,
@@ -47,6 +63,116 @@ module.exports = (sequelize, DataTypes) => {
     }
   );
 
+  // index_key is textType-objectId-language-contentHash, the language itself can contain a dash
+  AcTranslationCache.parseIndexKey = (indexKey) => {
+    const match = /^([^-]+)-(\d+)-(.+)-([^-]+)$/.exec(indexKey || "");
+    if (!match) {
+      return null;
+    }
+    return {
+      text_type: match[1],
+      object_id: parseInt(match[2]),
+      language: match[3],
+      content_hash: match[4],
+    };
+  };
+
+  const setKeyColumns = (translation) => {
+    const keyParts = AcTranslationCache.parseIndexKey(translation.index_key);
+    if (keyParts) {
+      translation.set(keyParts);
+    }
+  };
+
+  AcTranslationCache.addHook("beforeSave", setKeyColumns);
+  AcTranslationCache.addHook("beforeBulkCreate", (translations) => {
+    translations.forEach(setKeyColumns);
+  });
+
+  // Keep the lookup cache in step with rows changed by the admin tools and scripts
+  ["afterCreate", "afterUpdate", "afterDestroy"].forEach((hookType) => {
+    AcTranslationCache.addHook(hookType, (translation) => {
+      return translationLookupCache.invalidate(translation.index_key);
+    });
+  });
+
+  /**
+   * Copies the translations of one object to another object in two set based statements,
+   * translations the target already has are overwritten as the row by row cloning did.
+   * With contentHash only the translations of that exact text are copied, otherwise all of them.
+   */
+  AcTranslationCache.cloneForObject = async (
+    textType,
+    fromObjectId,
+    toObjectId,
+    contentHash
+  ) => {
+    const replacements = {
+      textType,
+      fromObjectId,
+      toObjectId,
+      contentHash: contentHash || null,
+    };
+    const sourceWhere = `source.text_type = :textType AND source.object_id = :fromObjectId
+      AND (CAST(:contentHash AS VARCHAR) IS NULL OR source.content_hash = :contentHash)`;
+
+    return await sequelize.transaction(async (transaction) => {
+      const [updated] = await sequelize.query(
+        `UPDATE translation_cache AS target
+         SET content = source.content, updated_at = now()
+         FROM translation_cache AS source
+         WHERE ${sourceWhere}
+           AND target.text_type = source.text_type
+           AND target.object_id = :toObjectId
+           AND target.language = source.language
+           AND target.content_hash = source.content_hash
+         RETURNING target.index_key`,
+        { replacements, transaction }
+      );
+
+      const [inserted] = await sequelize.query(
+        `INSERT INTO translation_cache
+           (index_key, content, text_type, object_id, language, content_hash, created_at, updated_at)
+         SELECT DISTINCT ON (source.language, source.content_hash)
+           source.text_type || '-' || :toObjectId || '-' || source.language || '-' || source.content_hash,
+           source.content, source.text_type, :toObjectId, source.language, source.content_hash, now(), now()
+         FROM translation_cache AS source
+         WHERE ${sourceWhere}
+           AND NOT EXISTS (
+             SELECT 1 FROM translation_cache AS target
+             WHERE target.text_type = source.text_type
+               AND target.object_id = :toObjectId
+               AND target.language = source.language
+               AND target.content_hash = source.content_hash
+           )
+         ORDER BY source.language, source.content_hash, source.id DESC
+         RETURNING index_key`,
+        { replacements, transaction }
+      );
+
+      // Raw statements skip the model hooks
+      await Promise.all(
+        updated
+          .concat(inserted)
+          .map((row) => translationLookupCache.invalidate(row.index_key))
+      );
+
+      return { updated: updated.length, inserted: inserted.length };
+    });
+  };
+
+  AcTranslationCache.getLookupCacheStats = () => {
+    return Object.assign(translationLookupCache.getStats(), {
+      inFlightLookups: inFlightLookups.size,
+      googleTranslate: googleTranslateBatcher.getStats(),
+    });
+  };
+
+  // Replaces the pooled Google Translate client, for example with a local stub translator
+  AcTranslationCache.setTranslateClient = (client) => {
+    googleTranslateBatcher.setTranslateClient(client);
+  };
+
   AcTranslationCache.translationModelName = "gpt-4o";
   AcTranslationCache.translationMaxTokens = 2048;
   AcTranslationCache.translationTemperature = 0.7;
@@ -67,6 +193,30 @@ module.exports = (sequelize, DataTypes) => {
     "aoiQuestionName",
   ];
 
+  // Text types cached with a group id as object_id, besides groupName and groupContent
+  AcTranslationCache.groupConfigurationTextTypes = [
+    "GroupQuestions",
+    "GroupRegQuestions",
+    "customRatingName",
+    "aoiWelcomeMessage",
+    "aoiWelcomeHtml",
+    "alternativeTextForNewIdeaButton",
+    "alternativeTextForNewIdeaButtonClosed",
+    "alternativeTextForNewIdeaButtonHeader",
+    "alternativeTextForNewIdeaSaveButton",
+    "customCategoryQuestionText",
+    "urlToReviewActionText",
+    "customThankYouTextNewPosts",
+    "customTitleQuestionText",
+    "customFilterText",
+    "customAdminCommentsTitle",
+    "alternativePointForHeader",
+    "customTabTitleNewLocation",
+    "alternativePointAgainstHeader",
+    "alternativePointForLabel",
+    "alternativePointAgainstLabel",
+  ];
+
   AcTranslationCache.getContentToTranslate = async (req, modelInstance) => {
     try {
       if (req.query.textType == "aoiChoiceContent") {
@@ -542,14 +692,7 @@ module.exports = (sequelize, DataTypes) => {
         if (!process.env.GOOGLE_APPLICATION_CREDENTIALS_JSON) {
           reject("No google credentials found");
         } else {
-          const translateAPI = new Translate({
-            credentials: JSON.parse(
-              process.env.GOOGLE_APPLICATION_CREDENTIALS_JSON
-            ),
-            projectId: process.env.GOOGLE_TRANSLATE_PROJECT_ID
-              ? process.env.GOOGLE_TRANSLATE_PROJECT_ID
-              : undefined,
-          });
+          const translateAPI = googleTranslateBatcher.getTranslateClient();
 
           try {
             // Split the texts into chunks of 128 or fewer
@@ -606,38 +749,15 @@ module.exports = (sequelize, DataTypes) => {
         callback
       );
     } else {
-      let translateAPI;
-
-      try {
-        translateAPI = new Translate({
-          credentials: JSON.parse(
-            process.env.GOOGLE_APPLICATION_CREDENTIALS_JSON
-          ),
-          projectId: process.env.GOOGLE_TRANSLATE_PROJECT_ID
-            ? process.env.GOOGLE_TRANSLATE_PROJECT_ID
-            : undefined,
-        });
-      } catch (error) {
-        console.error("Failed to get translation from Google", error);
-      }
-
-      if (!translateAPI) {
+      if (!googleTranslateBatcher.getTranslateClient()) {
         callback("No translation API");
         return;
       }
 
-      console.log("Calling Google Translate...");
-      translateAPI
-        .translate(contentToTranslate, targetLanguage)
-        .then((results) => {
-          const translationResults = results[1];
-          if (
-            translationResults &&
-            translationResults.data &&
-            translationResults.data.translations &&
-            translationResults.data.translations.length > 0
-          ) {
-            const translation = translationResults.data.translations[0];
+      googleTranslateBatcher
+        .translateText(contentToTranslate, targetLanguage)
+        .then((translation) => {
+          if (translation) {
             sequelize.models.AcTranslationCache.create({
               index_key: indexKey,
               content: translation.translatedText,
@@ -712,7 +832,7 @@ module.exports = (sequelize, DataTypes) => {
 
       try {
         const translatedStrings =
-          await AcTranslationCache.llmTranslation.getListTranslation(
+          await AcTranslationCache.llmTranslation.getCachedListTranslation(
             targetLanguage,
             textsToTranslate
           );
@@ -921,6 +1041,62 @@ module.exports = (sequelize, DataTypes) => {
 
       let indexKey = `${textType}-${modelInstance.id}-${targetLanguage}-${contentHash}`;
 
+      const cached = await translationLookupCache.get(indexKey);
+      if (cached) {
+        if (cached.negative) {
+          callback(cached.error || "No translations");
+        } else {
+          callback(null, { content: cached.content });
+        }
+        return;
+      }
+
+      // Single-flight, concurrent requests for the same key wait for the first lookup
+      if (inFlightLookups.has(indexKey)) {
+        inFlightLookups.get(indexKey).push(callback);
+        return;
+      }
+      const callbacks = [callback];
+      inFlightLookups.set(indexKey, callbacks);
+
+      // Answers every waiting request once, later calls are ignored so a provider that calls back
+      // and then rejects can not answer a newer lookup of the same key. A throwing callback does
+      // not skip the ones after it.
+      let answered = false;
+      const lookupCallback = (error, translation) => {
+        if (answered) {
+          return;
+        }
+        answered = true;
+        if (inFlightLookups.get(indexKey) === callbacks) {
+          inFlightLookups.delete(indexKey);
+        }
+        callbacks.forEach((waitingCallback) => {
+          try {
+            waitingCallback(error, translation);
+          } catch (callbackError) {
+            log.error("Error in translation callback", {
+              indexKey,
+              err: callbackError,
+            });
+          }
+        });
+      };
+
+      const lookupStart = Date.now();
+      const cachingCallback = (error, translation) => {
+        if (answered) {
+          return;
+        }
+        translationLookupCache.recordDbLookup(lookupStart, false);
+        if (error === "No translations") {
+          translationLookupCache.setNegative(indexKey, error);
+        } else if (!error && translation && translation.content) {
+          translationLookupCache.set(indexKey, translation.content);
+        }
+        lookupCallback(error, translation);
+      };
+
       sequelize.models.AcTranslationCache.findOne({
         where: {
           index_key: indexKey,
@@ -928,7 +1104,9 @@ module.exports = (sequelize, DataTypes) => {
       })
         .then((translationModel) => {
           if (translationModel) {
-            callback(null, { content: translationModel.content });
+            translationLookupCache.recordDbLookup(lookupStart, true);
+            translationLookupCache.set(indexKey, translationModel.content);
+            lookupCallback(null, { content: translationModel.content });
           } else {
             if (
               [
@@ -945,8 +1123,10 @@ module.exports = (sequelize, DataTypes) => {
                 contentToTranslate,
                 targetLanguage,
                 modelInstance,
-                callback
-              );
+                cachingCallback
+              ).catch((error) => {
+                cachingCallback(error);
+              });
             } else {
               sequelize.models.AcTranslationCache.getTranslationFromGoogle(
                 textType,
@@ -954,15 +1134,18 @@ module.exports = (sequelize, DataTypes) => {
                 contentToTranslate,
                 targetLanguage,
                 modelInstance,
-                callback
-              );
+                cachingCallback
+              ).catch((error) => {
+                cachingCallback(error);
+              });
             }
           }
         })
         .catch((error) => {
-          callback(error);
+          lookupCallback(error);
         });
     } else {
+      translationLookupCache.recordShortText();
       log.warn("Empty or short string for translation", {
         textType: req.query.textType,
         targetLanguage: req.query.targetLanguage,
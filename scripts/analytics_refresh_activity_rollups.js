@@ -0,0 +1,19 @@
+const models = require('../../models/index.cjs');
+const refreshActivityRollups = require('../engine/analytics/activity_rollups.cjs').refreshActivityRollups;
+
+// Recounts the daily activity counts used by the stats dashboards.
+//   node analytics_refresh_activity_rollups.js         Recounts all days, run once before setting STATS_ACTIVITY_ROLLUPS=true
+//   node analytics_refresh_activity_rollups.js [days]  Recounts the last days, run nightly to pick up deleted activities
+
+const days = process.argv[2] ? parseInt(process.argv[2]) : null;
+const fromDate = days ? new Date(Date.now() - days * 24 * 60 * 60 * 1000) : null;
+
+models.AcActivityDailyCount.sync().then(() => {
+  return refreshActivityRollups(fromDate);
+}).then(() => {
+  console.log(`Activity daily counts refreshed ${fromDate ? 'from ' + fromDate.toISOString().slice(0, 10) : 'for all days'}`);
+  process.exit();
+}).catch((error) => {
+  console.error(error);
+  process.exit();
+});
@@ -0,0 +1,39 @@
+const models = require('../../models/index.cjs');
+
+// Adds the unique index that lets the news feed generators insert items with
+// ON CONFLICT DO NOTHING (bulkCreate ignoreDuplicates), so retried or overlapping runs can not
+// add the same activity twice to a feed. Existing duplicates are marked deleted first, the
+// oldest item is kept. The scope columns are coalesced as NULLs never conflict in a unique index.
+// Safe to run again.
+
+const dedupe = async () => {
+  const [, result] = await models.sequelize.query(`
+    UPDATE ac_news_feed_items SET deleted = true, updated_at = now()
+    WHERE id IN (
+      SELECT id FROM (
+        SELECT id, row_number() OVER (
+          PARTITION BY ac_activity_id, type, coalesce(user_id, 0), coalesce(domain_id, 0),
+            coalesce(community_id, 0), coalesce(group_id, 0), coalesce(post_id, 0)
+          ORDER BY id ASC) AS position
+        FROM ac_news_feed_items
+        WHERE deleted = false AND ac_activity_id IS NOT NULL
+      ) AS items
+      WHERE position > 1
+    )`);
+  console.log(`Marked ${result.rowCount} duplicate news feed items deleted`);
+};
+
+const createIndex = async () => {
+  await models.sequelize.query(`CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ac_news_feed_items_unique_activity
+    ON ac_news_feed_items (ac_activity_id, type, coalesce(user_id, 0), coalesce(domain_id, 0),
+      coalesce(community_id, 0), coalesce(group_id, 0), coalesce(post_id, 0))
+    WHERE deleted = false AND ac_activity_id IS NOT NULL`);
+};
+
+dedupe().then(createIndex).then(() => {
+  console.log("All done");
+  process.exit();
+}).catch((error) => {
+  console.error(error);
+  process.exit();
+});
@@ -0,0 +1,49 @@
+const models = require('../../models/index.cjs');
+
+// Adds the text_type, object_id, language and content_hash columns with their indexes to
+// translation_cache and fills them in from index_key for existing rows, in id ranges so the
+// table is never locked for long. The indexes are built CONCURRENTLY so writes go on meanwhile,
+// a build that fails leaves an invalid index that has to be dropped before running again.
+// Safe to run again, only rows without text_type are updated.
+
+const batchSize = process.argv[2] ? parseInt(process.argv[2]) : 20000;
+
+const setupColumns = async () => {
+  await models.sequelize.query(`
+    ALTER TABLE translation_cache
+      ADD COLUMN IF NOT EXISTS text_type VARCHAR(255),
+      ADD COLUMN IF NOT EXISTS object_id INTEGER,
+      ADD COLUMN IF NOT EXISTS language VARCHAR(255),
+      ADD COLUMN IF NOT EXISTS content_hash VARCHAR(255)`);
+  await models.sequelize.query(`CREATE INDEX CONCURRENTLY IF NOT EXISTS translation_cache_object_index
+    ON translation_cache (text_type, object_id, content_hash)`);
+  await models.sequelize.query(`CREATE INDEX CONCURRENTLY IF NOT EXISTS translation_cache_language_index
+    ON translation_cache (language)`);
+};
+
+const backfill = async () => {
+  const [[{ max_id }]] = await models.sequelize.query('SELECT max(id) AS max_id FROM translation_cache');
+  let updatedCount = 0;
+  for (let fromId = 0; fromId < (max_id || 0); fromId += batchSize) {
+    const [, result] = await models.sequelize.query(`
+      UPDATE translation_cache
+      SET text_type = parts[1], object_id = CAST(parts[2] AS INTEGER), language = parts[3], content_hash = parts[4]
+      FROM (
+        SELECT id AS part_id, regexp_match(index_key, '^([^-]+)-(\\d+)-(.+)-([^-]+)$') AS parts
+        FROM translation_cache
+        WHERE id > :fromId AND id <= :toId AND text_type IS NULL
+      ) AS key_parts
+      WHERE translation_cache.id = key_parts.part_id AND parts IS NOT NULL`,
+      { replacements: { fromId, toId: fromId + batchSize } });
+    updatedCount += result.rowCount;
+    console.log(`Backfilled up to id ${fromId + batchSize}, ${updatedCount} rows updated`);
+  }
+};
+
+setupColumns().then(backfill).then(() => {
+  console.log("All done");
+  process.exit();
+}).catch((error) => {
+  console.error(error);
+  process.exit(1);
+});
@@ -3,6 +3,36 @@ const _ = require('lodash');
 
 const objectType = process.argv[2];
 const objectId = process.argv[3];
+const alsoClearTranslations = process.argv[4] === "translations";
+
+const textTypesForObject = {
+  point: ['pointContent', 'pointAdminCommentContent'],
+  group: ['groupName', 'groupContent'].concat(models.AcTranslationCache.groupConfigurationTextTypes),
+  community: ['communityName', 'communityContent'],
+  domain: ['domainName', 'domainContent', 'domainWelcomeHtml']
+};
+
+// With "translations" as the third argument the cached translations of the object are removed
+// too, found through the text_type and object_id columns
+const clearTranslationsAndExit = () => {
+  if (!alsoClearTranslations) {
+    process.exit();
+  } else {
+    models.AcTranslationCache.destroy({
+      where: {
+        text_type: textTypesForObject[objectType],
+        object_id: objectId
+      },
+      individualHooks: true
+    }).then((count) => {
+      console.log(`Deleted ${count} cached translations for ${objectType} ${objectId}`);
+      process.exit();
+    }).catch((error)=>{
+      console.error(error);
+      process.exit();
+    });
+  }
+};
 
 if (objectType==="point") {
   models.Point.findOne({
@@ -16,7 +46,7 @@ if (objectType==="point") {
       result.set('language', null);
       result.save().then(function () {
         console.log(`Cleared language for point ${result.id}`);
-        process.exit();
+        clearTranslationsAndExit();
       }).catch((error)=>{
         console.error(error);
         process.exit();
@@ -41,7 +71,7 @@ if (objectType==="point") {
       result.set('language', null);
       result.save().then(function () {
         console.log(`Cleared language for group ${result.id}`);
-        process.exit();
+        clearTranslationsAndExit();
       }).catch((error)=>{
         console.error(error);
         process.exit();
@@ -66,7 +96,7 @@ if (objectType==="point") {
       result.set('language', null);
       result.save().then(function () {
         console.log(`Cleared language for community ${result.id}`);
-        process.exit();
+        clearTranslationsAndExit();
       }).catch((error)=>{
         console.error(error);
         process.exit();
@@ -91,7 +121,7 @@ if (objectType==="point") {
       result.set('language', null);
       result.save().then(function () {
         console.log(`Cleared language for domain ${result.id}`);
-        process.exit();
+        clearTranslationsAndExit();
       }).catch((error)=>{
         console.error(error);
         process.exit();
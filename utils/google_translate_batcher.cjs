@@ -0,0 +1,150 @@
+"use strict";
+
+// Shared Google Translate client and a micro-batching queue in front of it.
+// Single string translations that arrive within BATCH_WINDOW_MS of each other for the same
+// target language are sent as one multi-string translate call and the results are fanned back
+// out to the waiting callers. Identical strings in the same window share one slot.
+//
+// setTranslateClient() swaps in any object with the translate(texts, targetLanguage) method of
+// the v2 client, so the batching can be run against a local stub translator.
+
+const { Translate } = require("@google-cloud/translate").v2;
+const log = require("./logger.cjs");
+
+const BATCH_WINDOW_MS = process.env.GOOGLE_TRANSLATE_BATCH_WINDOW_MS
+  ? parseInt(process.env.GOOGLE_TRANSLATE_BATCH_WINDOW_MS)
+  : 20;
+
+// Google Translate v2 accepts at most 128 segments per request
+const MAX_BATCH_STRINGS = 128;
+const MAX_BATCH_CHARACTERS = 30000;
+
+let translateClient;
+
+const pendingByLanguage = new Map();
+
+const stats = {
+  requests: 0,
+  coalesced: 0,
+  apiCalls: 0,
+  apiStrings: 0,
+  apiErrors: 0,
+};
+
+const getTranslateClient = () => {
+  if (!translateClient) {
+    if (!process.env.GOOGLE_APPLICATION_CREDENTIALS_JSON) {
+      return null;
+    }
+    try {
+      translateClient = new Translate({
+        credentials: JSON.parse(process.env.GOOGLE_APPLICATION_CREDENTIALS_JSON),
+        projectId: process.env.GOOGLE_TRANSLATE_PROJECT_ID
+          ? process.env.GOOGLE_TRANSLATE_PROJECT_ID
+          : undefined,
+      });
+    } catch (error) {
+      log.error("Failed to create Google Translate client", { error });
+      return null;
+    }
+  }
+  return translateClient;
+};
+
+const setTranslateClient = (client) => {
+  translateClient = client;
+};
+
+const flushLanguage = (targetLanguage) => {
+  const batch = pendingByLanguage.get(targetLanguage);
+  if (!batch) {
+    return;
+  }
+  pendingByLanguage.delete(targetLanguage);
+  clearTimeout(batch.timer);
+
+  const client = getTranslateClient();
+  if (!client) {
+    batch.waiting.forEach((waiters) =>
+      waiters.forEach((waiter) => waiter.reject("No translation API"))
+    );
+    return;
+  }
+
+  const texts = Array.from(batch.waiting.keys());
+  stats.apiCalls++;
+  stats.apiStrings += texts.length;
+  console.log(`Calling Google Translate with ${texts.length} strings...`);
+
+  client
+    .translate(texts, targetLanguage)
+    .then((results) => {
+      const metadata = results[1];
+      const translations =
+        metadata && metadata.data && metadata.data.translations
+          ? metadata.data.translations
+          : [];
+      texts.forEach((text, i) => {
+        batch.waiting.get(text).forEach((waiter) => {
+          if (translations[i]) {
+            waiter.resolve(translations[i]);
+          } else {
+            waiter.reject("No translations");
+          }
+        });
+      });
+    })
+    .catch((error) => {
+      stats.apiErrors++;
+      batch.waiting.forEach((waiters) =>
+        waiters.forEach((waiter) => waiter.reject(error))
+      );
+    });
+};
+
+/**
+ * Translates one string through the batching queue.
+ * Resolves to { translatedText, detectedSourceLanguage } like an entry of the v2 API response.
+ */
+const translateText = (text, targetLanguage) => {
+  stats.requests++;
+  return new Promise((resolve, reject) => {
+    let batch = pendingByLanguage.get(targetLanguage);
+    if (!batch) {
+      batch = {
+        waiting: new Map(),
+        characters: 0,
+        timer: setTimeout(() => flushLanguage(targetLanguage), BATCH_WINDOW_MS),
+      };
+      pendingByLanguage.set(targetLanguage, batch);
+    }
+
+    if (batch.waiting.has(text)) {
+      stats.coalesced++;
+      batch.waiting.get(text).push({ resolve, reject });
+    } else {
+      batch.waiting.set(text, [{ resolve, reject }]);
+      batch.characters += text.length;
+    }
+
+    if (
+      batch.waiting.size >= MAX_BATCH_STRINGS ||
+      batch.characters >= MAX_BATCH_CHARACTERS
+    ) {
+      flushLanguage(targetLanguage);
+    }
+  });
+};
+
+const getStats = () => {
+  return Object.assign({}, stats, {
+    pendingLanguages: pendingByLanguage.size,
+  });
+};
+
+module.exports = {
+  getTranslateClient,
+  setTranslateClient,
+  translateText,
+  getStats,
+};
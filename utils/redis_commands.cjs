@@ -0,0 +1,31 @@
+"use strict";
+
+// Promise based access to the shared Redis client for caches and queues that must not block
+// on Redis. The client is required lazily so loading a module does not open a connection and
+// null is returned while it is not ready, callers then skip Redis instead of queueing commands
+// behind a reconnect.
+
+let redisConnection;
+let redisRequiredAt;
+
+/**
+ * Returns the promise based commands of the shared client or null when Redis is not ready.
+ * With waitForFirstConnect commands are queued during the first connectTimeoutMs after the
+ * client was required, so short lived scripts can still reach Redis.
+ */
+const getRedisCommands = (waitForFirstConnect = false, connectTimeoutMs = 10000) => {
+  if (!redisConnection) {
+    redisConnection = require("./redisConnection.cjs");
+    redisRequiredAt = Date.now();
+  }
+  if (
+    !redisConnection.isReady &&
+    !(waitForFirstConnect && Date.now() - redisRequiredAt < connectTimeoutMs)
+  ) {
+    return null;
+  }
+  // In legacyMode the promise based commands are under .v4
+  return redisConnection.v4 || redisConnection;
+};
+
+module.exports = getRedisCommands;
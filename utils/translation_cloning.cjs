@@ -6,110 +6,22 @@ const request = require('request');
 const farmhash = require('farmhash');
 const fixTargetLocale = require('./translation_helpers.cjs').fixTargetLocale;
 
-// For post get translations in all locales (that exists)
-// select * from translation_cache where index_key LIKE 'communityContent-728-%-3536451109';
-// Clone them with the new post id
-// Same
-// Domains
-// Communities
-// Groups
-// Points
-
-const getTranslationsForSearch = (textType, id, content, callback) => {
-  const indexSearch = `${textType}-${id}-%-${farmhash.hash32(content).toString()}`;
-  models.AcTranslationCache.findAll({
-    where: {
-      index_key: {
-        $like: indexSearch
-      }
-    }
-  }).then( translations => {
-    callback(null, translations);
-  }).catch( error=> {
-    callback(error);
-  })
-}
-
-const getTranslationsConfigSearch = (textType, id, callback) => {
-  const indexSearch = `${textType}-${id}-%-%`;
-  models.AcTranslationCache.findAll({
-    where: {
-      index_key: {
-        $like: indexSearch
-      }
-    }
-  }).then( translations => {
-    callback(null, translations);
-  }).catch( error=> {
-    callback(error);
-  })
-}
-
-const updateIndexKey = (current_index_key, objectId) => {
-  const splitIndex = current_index_key.split("-");
-  splitIndex[1] = objectId;
-  const newIndexKey = splitIndex.join("-");
-  return newIndexKey;
-}
-
-const cloneTranslations = (translations, objectId, callback) => {
-  async.forEach(translations, (translation, forEachCallback) => {
-    const newTranslationJson = JSON.parse(JSON.stringify(translation.toJSON()));
-    delete newTranslationJson['id'];
-    newTranslationJson['index_key'] = updateIndexKey(translation.index_key, objectId);
-    models.AcTranslationCache.findOne({
-      where: {
-        index_key: newTranslationJson.index_key
-      }
-    }).then( translation=> {
-      if (translation) {
-        translation.content = newTranslationJson.content;
-        translation.save().then( () => {
-          forEachCallback();
-        }).catch( error => {
-          forEachCallback(error);
-        })
-      } else {
-        const newTranslation = models.AcTranslationCache.build(newTranslationJson);
-        newTranslation.save().then(()=>{
-          forEachCallback();
-        }).catch( error=> {
-          forEachCallback(error);
-        });
-      }
-    }).catch( error => {
-      forEachCallback(error);
-    })
-  }, (error) => {
-    callback(error);
-  })
-}
+// Translations are found by the structured text_type, object_id and content_hash columns
+// and copied with one insert-select per object, see AcTranslationCache.cloneForObject
 
 const cloneTranslationForItem = (textType, inObjectId, outObjectId, content, callback) => {
-  getTranslationsForSearch(textType, inObjectId, content, (error, translations) => {
-    if (error) {
-      callback(error);
-    } else {
-      if (translations.length>0) {
-        cloneTranslations(translations, outObjectId, callback);
-      }  else {
-        callback();
-      }
-    }
+  models.AcTranslationCache.cloneForObject(textType, inObjectId, outObjectId, farmhash.hash32(content).toString()).then(() => {
+    callback();
+  }).catch( error => {
+    callback(error);
   })
 }
 
 const cloneTranslationForConfig = (textType, inObjectId, outObjectId, callback) => {
-  getTranslationsConfigSearch(textType, inObjectId, (error, translations) => {
-    if (error) {
-      callback(error);
-    } else {
-      if (translations.length>0) {
-        cloneTranslations(translations, outObjectId, callback);
-      }  else {
-        callback();
-      }
-    }
+  models.AcTranslationCache.cloneForObject(textType, inObjectId, outObjectId).then(() => {
+    callback();
+  }).catch( error => {
+    callback(error);
   })
 }
 
@@ -0,0 +1,233 @@
+"use strict";
+
+// Read-through cache in front of the translation_cache table, keyed by the AcTranslationCache
+// index key (textType-id-language-contentHash). A bounded in-process LRU with TTL answers repeat
+// lookups without leaving the process and the shared Redis client is the second tier across
+// processes. Index keys include the content hash so an edited text gets a new key, entries only
+// need invalidating when a stored translation is changed or deleted.
+
+const log = require("./logger.cjs");
+const getRedisCommands = require("./redis_commands.cjs");
+
+const LRU_MAX_ENTRIES = process.env.TRANSLATION_LRU_MAX_ENTRIES
+  ? parseInt(process.env.TRANSLATION_LRU_MAX_ENTRIES)
+  : 20000;
+const LRU_TTL_SECONDS = process.env.TRANSLATION_LRU_TTL_SECONDS
+  ? parseInt(process.env.TRANSLATION_LRU_TTL_SECONDS)
+  : 10 * 60;
+const REDIS_TTL_SECONDS = process.env.TRANSLATION_REDIS_TTL_SECONDS
+  ? parseInt(process.env.TRANSLATION_REDIS_TTL_SECONDS)
+  : 24 * 60 * 60;
+const NEGATIVE_TTL_SECONDS = process.env.TRANSLATION_NEGATIVE_TTL_SECONDS
+  ? parseInt(process.env.TRANSLATION_NEGATIVE_TTL_SECONDS)
+  : 5 * 60;
+const INVALIDATE_TIMEOUT_MS = 2000;
+const FIRST_CONNECT_WAIT_MS = 10000;
+const DISABLE_REDIS_TIER = process.env.TRANSLATION_CACHE_DISABLE_REDIS;
+
+const REDIS_KEYBASE = "cache:translation:";
+
+const lru = new Map();
+
+const now = () => Date.now();
+
+const stats = {
+  lookups: 0,
+  memoryHits: 0,
+  redisHits: 0,
+  dbHits: 0,
+  negativeHits: 0,
+  misses: 0,
+  shortTexts: 0,
+  redisErrors: 0,
+  memoryMs: 0,
+  redisMs: 0,
+  dbMs: 0,
+  missMs: 0,
+};
+
+// Only invalidations right after startup wait for the first connect so short lived scripts work
+const getRedis = (waitForFirstConnect = false) => {
+  if (DISABLE_REDIS_TIER) {
+    return null;
+  }
+  return getRedisCommands(waitForFirstConnect, FIRST_CONNECT_WAIT_MS);
+};
+
+const memoryGet = (indexKey) => {
+  const entry = lru.get(indexKey);
+  if (!entry) {
+    return null;
+  }
+  if (entry.expiresAt < now()) {
+    lru.delete(indexKey);
+    return null;
+  }
+  // Re-insert so the Map keeps least recently used entries first
+  lru.delete(indexKey);
+  lru.set(indexKey, entry);
+  return entry.value;
+};
+
+const memorySet = (indexKey, value, ttlSeconds) => {
+  lru.delete(indexKey);
+  lru.set(indexKey, {
+    value,
+    expiresAt: now() + Math.min(ttlSeconds, LRU_TTL_SECONDS) * 1000,
+  });
+  while (lru.size > LRU_MAX_ENTRIES) {
+    lru.delete(lru.keys().next().value);
+  }
+};
+
+const redisGet = async (indexKey) => {
+  const redis = getRedis();
+  if (!redis) {
+    return null;
+  }
+  try {
+    const found = await redis.get(REDIS_KEYBASE + indexKey);
+    return found ? JSON.parse(found) : null;
+  } catch (error) {
+    stats.redisErrors++;
+    log.warn("Translation cache Redis get failed", { error, indexKey });
+    return null;
+  }
+};
+
+const redisSet = (indexKey, value, ttlSeconds) => {
+  const redis = getRedis();
+  if (redis) {
+    redis
+      .setEx(REDIS_KEYBASE + indexKey, ttlSeconds, JSON.stringify(value))
+      .catch((error) => {
+        stats.redisErrors++;
+        log.warn("Translation cache Redis set failed", { error, indexKey });
+      });
+  }
+};
+
+/**
+ * Looks a translation up in memory then in Redis.
+ * Resolves to { content } for a translation, { negative: true, error } for a cached failure
+ * or null when neither tier has the key. Redis hits are copied into memory.
+ */
+const get = async (indexKey) => {
+  stats.lookups++;
+  const start = now();
+  const inMemory = memoryGet(indexKey);
+  if (inMemory) {
+    stats.memoryHits++;
+    stats.memoryMs += now() - start;
+    if (inMemory.negative) {
+      stats.negativeHits++;
+    }
+    return inMemory;
+  }
+
+  const inRedis = await redisGet(indexKey);
+  stats.redisMs += now() - start;
+  if (inRedis) {
+    stats.redisHits++;
+    if (inRedis.negative) {
+      stats.negativeHits++;
+    }
+    memorySet(
+      indexKey,
+      inRedis,
+      inRedis.negative ? NEGATIVE_TTL_SECONDS : LRU_TTL_SECONDS
+    );
+    return inRedis;
+  }
+
+  return null;
+};
+
+const set = (indexKey, content) => {
+  const value = { content };
+  memorySet(indexKey, value, LRU_TTL_SECONDS);
+  redisSet(indexKey, value, REDIS_TTL_SECONDS);
+};
+
+// Remembers that a key could not be translated so repeat requests do not call the provider again
+const setNegative = (indexKey, error) => {
+  const value = { negative: true, error: error ? error.toString() : null };
+  memorySet(indexKey, value, NEGATIVE_TTL_SECONDS);
+  redisSet(indexKey, value, NEGATIVE_TTL_SECONDS);
+};
+
+/**
+ * Drops a key from both tiers, other processes keep their in-memory copy until its TTL runs out.
+ */
+const invalidate = (indexKey) => {
+  lru.delete(indexKey);
+  const redis = getRedis(true);
+  if (!redis) {
+    return Promise.resolve();
+  }
+  let timeout;
+  return Promise.race([
+    redis.del(REDIS_KEYBASE + indexKey),
+    new Promise((resolve, reject) => {
+      timeout = setTimeout(() => reject("Timeout"), INVALIDATE_TIMEOUT_MS);
+    }),
+  ])
+    .catch((error) => {
+      stats.redisErrors++;
+      log.warn("Translation cache Redis del failed", { error, indexKey });
+    })
+    .finally(() => clearTimeout(timeout));
+};
+
+const recordDbLookup = (start, found) => {
+  if (found) {
+    stats.dbHits++;
+    stats.dbMs += now() - start;
+  } else {
+    stats.misses++;
+    stats.missMs += now() - start;
+  }
+};
+
+const recordShortText = () => {
+  stats.shortTexts++;
+};
+
+/**
+ * Hit/miss counters with mean latencies in ms, dbHits and misses are lookups that reached the
+ * table, misses also include the time of the provider call.
+ */
+const getStats = () => {
+  const mean = (ms, count) => (count ? ms / count : 0);
+  return {
+    lookups: stats.lookups,
+    memoryHits: stats.memoryHits,
+    redisHits: stats.redisHits,
+    dbHits: stats.dbHits,
+    negativeHits: stats.negativeHits,
+    misses: stats.misses,
+    shortTexts: stats.shortTexts,
+    redisErrors: stats.redisErrors,
+    memoryEntries: lru.size,
+    hitRate: mean(stats.memoryHits + stats.redisHits, stats.lookups),
+    meanMemoryMs: mean(stats.memoryMs, stats.memoryHits),
+    meanRedisMs: mean(stats.redisMs, stats.lookups - stats.memoryHits),
+    meanDbMs: mean(stats.dbMs, stats.dbHits),
+    meanMissMs: mean(stats.missMs, stats.misses),
+  };
+};
+
+const clear = () => {
+  lru.clear();
+};
+
+module.exports = {
+  get,
+  set,
+  setNegative,
+  invalidate,
+  recordDbLookup,
+  recordShortText,
+  getStats,
+  clear,
+};
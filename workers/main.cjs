@@ -11,12 +11,15 @@ var delayedJobs = require('./delayed_jobs.cjs');
 var anonymizations = require('./anonymizations.cjs');
 var moderation = require('./moderation.cjs');
 var email = require('./email.cjs');
+var newsFeedBatchSize = require('../engine/news_feeds/generate_from_notifications.cjs').MAX_BATCH_SIZE;
+var emailTemplates = require('../engine/notifications/email_templates.cjs');
 var queue = require('./queue.cjs');
 var speechToText = require('./speech_to_text.cjs');
 const similarities = require('./similarities.cjs');
 const reports = require('./reports.cjs');
 const marketing = require('./marketing.cjs');
 const fraudManagement = require('./fraud_management.cjs');
+const shutdownEventsBuffer = require('../engine/recommendations/events_manager.cjs').shutdownEventsBuffer;
 
 log.info("Dirname", {dirname: __dirname});
 
@@ -45,6 +48,8 @@ i18n
   }, function (err, t) {
     log.info("Have Loaded i18n", {err: err});
 
+    emailTemplates.compileEmailTemplates();
+
     queue.process('send-one-email', 20, function(job, done) {
       email.sendOne(job.data, done);
     });
@@ -61,7 +66,7 @@ i18n
       delayedJobs.process(job.data, done);
     });
 
-    queue.process('process-notification-news-feed', 10, function(job, done) {
+    queue.process('process-notification-news-feed', newsFeedBatchSize, function(job, done) {
       notification_news_feed.process(job.data, done);
     });
 
@@ -111,3 +116,12 @@ i18n
     });
   });
 
+// Buffered post actions are spooled before the worker exits, they are sent after the restart
+['SIGTERM', 'SIGINT'].forEach(function (signal) {
+  process.once(signal, function () {
+    log.info("Worker shutting down", { signal: signal });
+    shutdownEventsBuffer().then(function () {
+      process.exit(0);
+    });
+  });
+});